@@ -1,5 +1,4 @@
 import os
-import argparse
 import pprint
 
 import numpy as np
@@ -9,81 +8,13 @@ import wiggin_mito
 
 from simtk import openmm
 
+from bottlebrush_pbc_args import parser, run_name, COLRATE, ERRORTOL
+
 assert openmm.Platform_getNumPlatforms() > 3
 for i in range(openmm.Platform_getNumPlatforms()):
     print(openmm.Platform_getPlatform(i).getName())
 
 
-parser = argparse.ArgumentParser()
-
-
-parser.add_argument(
-    "--loop_kb", type=float, default=100, help="The average size of loops in kb."
-)
-
-parser.add_argument(
-    "--loop_spacing",
-    type=int,
-    default=1,
-    help="The size of a linker between two consecutive loops.",
-)
-
-parser.add_argument(
-    "--loop_spacing_distr",
-    type=str,
-    default='uniform',
-    help="The distribution of loop sizes (uniform/exp)",
-)
-
-parser.add_argument(
-    "--loop_n", type=int, default=500, help="The number of loops in the system."
-)
-
-parser.add_argument(
-    "--rep_e",
-    type=float,
-    default=1.5,
-    help="The maximal energy of repulsion between particles.",
-)
-
-parser.add_argument(
-    "--axial_density",
-    type=float,
-    default=25,
-    help="The axial density of chromatin in Mb/micron.",
-)
-
-parser.add_argument(
-    "--replicate", 
-    type=int, 
-    default=0, 
-    help="The replicate index.")
-
-parser.add_argument(
-    "--num_blocks", type=int, default=5000, help="The number of blocks to simulate."
-)
-
-parser.add_argument(
-    "--root_loop_spacers",
-    action="store_true",
-    help="If provided, the spacers between root loops will be straight.",
-)
-
-
-parser.add_argument(
-    "--PBCNuclD", 
-    type=float, 
-    default=1.25, 
-    help="The linear dimension of the PBC box per nucleosome (V=N*PBCNuclDˆ3)."
-)
-
-parser.add_argument(
-    "--out_folder",
-    type=str,
-    default="./",
-    help="The root folder where the results will be stored.",
-)
-
 args = parser.parse_args()
 
 bp_particle = 200
@@ -101,8 +32,8 @@ num_blocks = args.num_blocks
 
 root_loop_spacers = args.root_loop_spacers
 
-colrate = 0.01
-errortol = 0.003
+colrate = COLRATE
+errortol = ERRORTOL
 
 wiggle_dist = 0.25
 
@@ -124,30 +55,47 @@ else:
     pbcbox_size = V ** (1/3)
     pbcbox = (pbcbox_size, pbcbox_size, pbcbox_size)
 
-dir_name_dict = dict(
-    Loop=args.loop_kb,
-    Spacing=args.loop_spacing,
-    SpacingDistr=args.loop_spacing_distr,
-    AxDensity=args.axial_density,
-    ColRate=colrate,
-    ErrorTol=errortol,
-    LoopN=args.loop_n,
-    RepE=args.rep_e,
-    PBCNuclD=args.PBCNuclD,   
-    R=replicate,
-)
+# the fine chain must consist of whole coarse beads, so that the fine loops
+# and the back-mapped conformation cover all n particles
+if n % args.coarse_graining:
+    parser.error(
+        f"--coarse_graining must divide the number of particles {n}, e.g. "
+        + ", ".join(str(k) for k in range(2, 11) if n % k == 0)
+    )
 
-if root_loop_spacers:
-    dir_name_dict["RootLoopSpacers"] = 1
+if (args.coarse_graining > 1) and not args.backmap_from:
+    # each bead represents coarse_graining particles; lengths shrink so that
+    # the back-mapped conformation has the target density
+    cg_scale = args.coarse_graining ** (1 / 3)
+    n = n // args.coarse_graining
+    if pbcbox:
+        pbcbox = tuple(side / cg_scale for side in pbcbox)
+    if args.PBCNuclD and args.axial_density:
+        axial_length_final /= cg_scale
+
+# each replica gets its own PBC cell, placed side by side along x
+replica_box = pbcbox
+if pbcbox and (args.n_replicas != 1):
+    pbcbox = (pbcbox[0] * args.n_replicas, pbcbox[1], pbcbox[2])
 
-name = "-".join(f"{n}_{v}" for n, v in dir_name_dict.items())
+if args.periodic and not (args.PBCNuclD and args.axial_density):
+    parser.error("--periodic requires --PBCNuclD and --axial_density")
 
-c = wiggin.core.SimConstructor(name=name, folder=os.path.join(out_folder, name))
+if args.pbc_compression_blocks and not args.PBCNuclD:
+    parser.error("--pbc_compression_blocks requires --PBCNuclD")
+
+if (args.initial_conformation != "rw") and not args.PBCNuclD:
+    parser.error("space-filling initial conformations require --PBCNuclD")
+
+name = run_name(args)
+
+folder = os.path.join(out_folder, name)
+c = wiggin.core.SimConstructor(name=name, folder=folder)
 
 
 c.add_action(
     wiggin.actions.sim.InitializeSimulation(
-        N=loop_size*loop_n,
+        N=n*args.n_replicas,
         # platform='CPU'
         # GPU='1',
         PBCbox=pbcbox,
@@ -156,21 +104,73 @@ c.add_action(
     )
 )
 
+# a resumed simulation continues from the checkpointed conformation
+resuming = bool(args.checkpoint_every) and os.path.exists(
+    wiggin_mito.checkpoint.checkpoint_path(folder))
+
+if args.checkpoint_every:
+    c.add_action(
+        wiggin_mito.actions.checkpoint.Checkpoint(
+            every=args.checkpoint_every,
+        )
+    )
+
 c.add_action(
     wiggin.actions.interactions.Chains(
+        chains=[(r * n, (r + 1) * n, False) for r in range(args.n_replicas)],
         wiggle_dist=wiggle_dist,
         repulsion_e=rep_e),
 )
 
-c.add_action(
-    wiggin_mito.actions.loops.SingleLayerLoopPositions(
-        loop_size=loop_size,
-        loop_spacing=loop_spacing,
-        loop_spacing_distr=args.loop_spacing_distr,
+if args.n_replicas != 1:
+    c.add_action(
+        wiggin_mito.actions.replicas.ReplicaMultiplexing(
+            n_replicas=args.n_replicas,
+            replica_box=replica_box if pbcbox else None,
+            spacing=(
+                None if pbcbox
+                else args.replica_spacing or 3 * n ** 0.5 + 10
+            ),
         ),
-)
+    )
 
+if args.trajectory_max_error:
+    c.add_action(
+        wiggin_mito.actions.output.ChainDeltaOutput(
+            max_error=args.trajectory_max_error,
+            compression=(
+                None if args.trajectory_compression == "none"
+                else args.trajectory_compression
+            ),
+        ),
+    )
 
+if args.backmap_from:
+    c.add_action(
+        wiggin_mito.actions.loops.LoadedLoopPositions(
+            folder=args.backmap_from,
+            ),
+    )
+
+else:
+    c.add_action(
+        wiggin_mito.actions.loops.SingleLayerLoopPositions(
+            loop_size=loop_size,
+            loop_spacing=loop_spacing,
+            loop_spacing_distr=args.loop_spacing_distr,
+            loop_gamma_k=args.loop_gamma_k,
+            coarse_graining=args.coarse_graining,
+            seed=args.loop_seed,
+            ),
+    )
+
+
+if args.periodic:
+    c.add_action(
+        wiggin_mito.actions.interactions.PeriodicBackbone(
+            period=axial_length_final,
+        ),
+    )
 
 c.add_action(
     wiggin_mito.actions.interactions.HarmonicLoops(
@@ -184,29 +184,89 @@ if root_loop_spacers:
         wiggin_mito.actions.interactions.RootLoopSeparator(),
     )
 
-if args.axial_density:
+tip_positions = None
+if args.axial_density and not args.periodic:
+    tip_positions = [(0, 0, 0), (0, 0, axial_length_final)]
+
+if args.warm_start:
+    c.add_action(
+        wiggin_mito.actions.conformations.WarmStartConformation(
+            ignore_keys=("R", "LoopSeed", "WarmStart"),
+            # under --periodic, rescaled to the z side of the periodic box
+            axial_length=axial_length_final if args.axial_density else None,
+            end=None if tip_positions is None else tip_positions[1],
+        ),
+    )
+
+elif args.backmap_from:
+    c.add_action(
+        wiggin_mito.actions.conformations.BackmappedLoopBrushConformation(
+            coarse_folder=args.backmap_from,
+            coarse_graining=args.coarse_graining,
+        ),
+    )
+
+elif args.initial_conformation != "rw":
+    c.add_action(
+        wiggin_mito.actions.conformations.SpaceFillingLoopBrushConformation(
+            box=replica_box,
+            curve=args.initial_conformation,
+            start=None if tip_positions is None else tip_positions[0],
+            end=None if tip_positions is None else tip_positions[1],
+        ),
+    )
+
+elif args.periodic or not args.axial_density:
+    c.add_action(
+        wiggin_mito.actions.conformations.RWLoopBrushConformation(),
+    )
+
+else:
     c.add_action(
         wiggin_mito.actions.conformations.RWLoopBrushConformation(end=(0, 0, axial_length_final)),
     )
 
+if tip_positions is not None:
     c.add_action(
         wiggin_mito.actions.constraints.TetherTips(
             k = (2, 2, 2),
             particles = (0, -1),
-            positions = [(0, 0, 0), (0, 0, axial_length_final)]
+            positions = tip_positions
 
         )
     )
 
-else:
+if args.pbc_compression_blocks:
     c.add_action(
-        wiggin_mito.actions.conformations.RWLoopBrushConformation(),
+        wiggin_mito.actions.constraints.PBCBoxCompression(
+            box_final=pbcbox,
+            ts=(0, args.pbc_compression_blocks),
+        )
     )
 
+if args.full_output_every:
+    c.add_action(
+        wiggin_mito.actions.output.SelectiveOutput(
+            full_every=args.full_output_every,
+        ),
+    )
 
-c.add_action(
-    wiggin.actions.sim.LocalEnergyMinimization()
-)
+if args.async_output:
+    c.add_action(
+        wiggin_mito.actions.output.AsyncOutput(),
+    )
+
+
+if args.soft_start_blocks:
+    c.add_action(
+        wiggin_mito.actions.interactions.SoftStartRepulsion(
+            n_blocks=args.soft_start_blocks,
+        )
+    )
+elif not resuming:
+    c.add_action(
+        wiggin.actions.sim.LocalEnergyMinimization()
+    )
 
 c.add_action(
     wiggin.actions.sim.BlockStep(
@@ -227,3 +287,5 @@ c.save_config()
 c.run_init()
 
 c.run_loop()
+
+wiggin_mito.sweep.mark_done(folder)
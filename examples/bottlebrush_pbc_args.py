@@ -0,0 +1,255 @@
+"""
+The command line arguments of bottlebrush_pbc.py and the naming of its
+run folders, shared with the sweep script (sweep_bottlebrush_pbc.py).
+"""
+import argparse
+
+
+COLRATE = 0.01
+ERRORTOL = 0.003
+
+
+parser = argparse.ArgumentParser()
+
+
+parser.add_argument(
+    "--loop_kb", type=float, default=100, help="The average size of loops in kb."
+)
+
+parser.add_argument(
+    "--loop_spacing",
+    type=int,
+    default=1,
+    help="The size of a linker between two consecutive loops.",
+)
+
+parser.add_argument(
+    "--loop_spacing_distr",
+    type=str,
+    default='uniform',
+    help="The distribution of spacer sizes (uniform/exp/gamma)",
+)
+
+parser.add_argument(
+    "--loop_gamma_k",
+    type=float,
+    default=1,
+    help="The shape parameter of the gamma distribution of loop sizes.",
+)
+
+parser.add_argument(
+    "--loop_n", type=int, default=500, help="The number of loops in the system."
+)
+
+parser.add_argument(
+    "--rep_e",
+    type=float,
+    default=1.5,
+    help="The maximal energy of repulsion between particles.",
+)
+
+parser.add_argument(
+    "--axial_density",
+    type=float,
+    default=25,
+    help="The axial density of chromatin in Mb/micron.",
+)
+
+parser.add_argument(
+    "--replicate", 
+    type=int, 
+    default=0, 
+    help="The replicate index.")
+
+parser.add_argument(
+    "--n_replicas",
+    type=int,
+    default=1,
+    help="The number of independent replicas simulated in a single system. "
+    "With --PBCNuclD, each replica gets its own PBC cell along x.",
+)
+
+parser.add_argument(
+    "--replica_spacing",
+    type=float,
+    default=None,
+    help="The shift between replicas along x without --PBCNuclD; must exceed "
+    "the extent of a replica plus the cutoff (default: 3*sqrt(N) + 10).",
+)
+
+parser.add_argument(
+    "--num_blocks", type=int, default=5000, help="The number of blocks to simulate."
+)
+
+parser.add_argument(
+    "--root_loop_spacers",
+    action="store_true",
+    help="If provided, the spacers between root loops will be straight.",
+)
+
+parser.add_argument(
+    "--periodic",
+    action="store_true",
+    help="If provided, the backbone wraps around the periodic box along the z axis, "
+    "simulating a unit cell of an infinite loop brush.",
+)
+
+parser.add_argument(
+    "--initial_conformation",
+    type=str,
+    default="rw",
+    choices=["rw", "hilbert", "serpentine"],
+    help="The initial conformation: a random walk or a backbone along "
+    "a space-filling curve through the PBC box.",
+)
+
+parser.add_argument(
+    "--pbc_compression_blocks",
+    type=int,
+    default=0,
+    help="If positive, the PBC box is shrunk from the size of the initial "
+    "conformation to the target size over this number of blocks.",
+)
+
+parser.add_argument(
+    "--soft_start_blocks",
+    type=int,
+    default=0,
+    help="If positive, the repulsion and loop bonds are ramped up over this "
+    "number of blocks instead of the initial energy minimization.",
+)
+
+parser.add_argument(
+    "--coarse_graining",
+    type=int,
+    default=1,
+    help="The number of particles per coarse-grained bead; must divide the number "
+    "of particles. Without --backmap_from, a coarse-grained system is simulated.",
+)
+
+parser.add_argument(
+    "--backmap_from",
+    type=str,
+    default=None,
+    help="The folder of a finished coarse-grained run to back-map "
+    "the initial conformation from.",
+)
+
+parser.add_argument(
+    "--loop_seed",
+    type=int,
+    default=None,
+    help="The seed of the random loop positions; runs with the same seed have the same loops.",
+)
+
+parser.add_argument(
+    "--warm_start",
+    action="store_true",
+    help="If provided, start from the final conformation of the finished run "
+    "in out_folder with the nearest parameters and the same loops.",
+)
+
+parser.add_argument(
+    "--checkpoint_every",
+    type=int,
+    default=0,
+    help="If positive, save a checkpoint every this number of blocks and "
+    "resume from an existing checkpoint.",
+)
+
+parser.add_argument(
+    "--trajectory_max_error",
+    type=float,
+    default=0,
+    help="If positive, block coordinates are stored as quantized bond vectors "
+    "with this max error (in bond lengths) instead of full-precision HDF5 blocks.",
+)
+
+parser.add_argument(
+    "--trajectory_compression",
+    type=str,
+    default="bitpack",
+    choices=["none", "bitpack", "zlib"],
+    help="The compression of --trajectory_max_error trajectories; bitpack keeps "
+    "memory-mapped reads (see wiggin_mito.actions.output.ChainDeltaOutput).",
+)
+
+parser.add_argument(
+    "--async_output",
+    action="store_true",
+    help="If provided, blocks are written in a background thread.",
+)
+
+parser.add_argument(
+    "--full_output_every",
+    type=int,
+    default=0,
+    help="If positive, only the backbone, root loop bases and tips are stored "
+    "every block, and the full state every this number of blocks "
+    "(but at least every 10 blocks during compression).",
+)
+
+parser.add_argument(
+    "--PBCNuclD", 
+    type=float, 
+    default=1.25, 
+    help="The linear dimension of the PBC box per nucleosome (V=N*PBCNuclDˆ3)."
+)
+
+parser.add_argument(
+    "--out_folder",
+    type=str,
+    default="./",
+    help="The root folder where the results will be stored.",
+)
+
+
+def run_name(args):
+    """
+    The name of the run folder, Key1_value1-Key2_value2-...,
+    see wiggin_mito.sweep.parse_run_name().
+    """
+    dir_name_dict = dict(
+        Loop=args.loop_kb,
+        Spacing=args.loop_spacing,
+        SpacingDistr=args.loop_spacing_distr,
+        AxDensity=args.axial_density,
+        ColRate=COLRATE,
+        ErrorTol=ERRORTOL,
+        LoopN=args.loop_n,
+        RepE=args.rep_e,
+        PBCNuclD=args.PBCNuclD,   
+        R=args.replicate,
+    )
+
+    if args.loop_gamma_k != 1:
+        dir_name_dict["LoopGammaK"] = args.loop_gamma_k
+
+    if args.root_loop_spacers:
+        dir_name_dict["RootLoopSpacers"] = 1
+
+    if args.periodic:
+        dir_name_dict["Periodic"] = 1
+
+    if args.soft_start_blocks:
+        dir_name_dict["SoftStart"] = args.soft_start_blocks
+
+    if args.pbc_compression_blocks:
+        dir_name_dict["PBCCompression"] = args.pbc_compression_blocks
+
+    if args.initial_conformation != "rw":
+        dir_name_dict["InitConf"] = args.initial_conformation
+
+    if args.coarse_graining > 1:
+        dir_name_dict["BackmappedCG" if args.backmap_from else "CG"] = args.coarse_graining
+
+    if args.loop_seed is not None:
+        dir_name_dict["LoopSeed"] = args.loop_seed
+
+    if args.warm_start:
+        dir_name_dict["WarmStart"] = 1
+
+    if args.n_replicas != 1:
+        dir_name_dict["Replicas"] = args.n_replicas
+
+    return "-".join(f"{n}_{v}" for n, v in dir_name_dict.items())
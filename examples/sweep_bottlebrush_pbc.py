@@ -9,12 +9,14 @@
 #SBATCH --output=./logs/mitosweep_40_pbc-%A_%a.out
 #SBATCH --error=./logs/mitosweep_40_pbc-%A_%a.err
 
-import subprocess
+import argparse
 import os
-import numpy as np
-import itertools
 import logging
 
+import wiggin_mito.sweep
+
+import bottlebrush_pbc_args
+
 logging.basicConfig(level=logging.INFO)
 
 cli_base_params = {
@@ -43,45 +45,44 @@ cli_grids = [
 ]
 
 
-N_PARAM_COMBOS = sum(np.prod([len(v) for v in grid.values()]) for grid in cli_grids)
-
-logging.info(f"Sweeping over {N_PARAM_COMBOS} parameter combinations!")
-
-dry_run = True if "SLURM_ARRAY_TASK_ID" not in os.environ else False
-if dry_run:
-    logging.warning("SLURM_ARRAY_TASK_ID not found, executing a dry run!")
-task_id = int(os.environ.get("SLURM_ARRAY_TASK_ID", 0))
-logging.info(f"Executing task # {task_id}")
-
-
-cli_extra_params = next(
-    itertools.islice(
-        itertools.chain.from_iterable(
-            itertools.product(*[[(k, val) for val in vals] for k, vals in grid.items()])
-            for grid in cli_grids
-        ),
-        task_id,
-        task_id + 1,
+def run_folder(params):
+    # the same folder naming as in bottlebrush_pbc.py
+    args = bottlebrush_pbc_args.parser.parse_args(
+        wiggin_mito.sweep.params_to_cli(params))
+    return os.path.join(args.out_folder, bottlebrush_pbc_args.run_name(args))
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--n_workers", type=int, default=None)
+parser.add_argument("--threads_per_worker", type=int, default=1)
+parser.add_argument("--dry_run", action="store_true")
+sweep_args = parser.parse_args()
+
+points = wiggin_mito.sweep.expand_grids(cli_base_params, cli_grids)
+logging.info(f"Sweeping over {len(points)} parameter combinations!")
+
+if sweep_args.dry_run:
+    for params in points:
+        done = wiggin_mito.sweep.is_done(params, folder_func=run_folder)
+        cmd = " ".join(wiggin_mito.sweep.params_to_cli(params))
+        print(("DONE " if done else "TODO ") + cmd)
+
+elif "SLURM_ARRAY_TASK_ID" in os.environ:
+    # one point per task of a SLURM array
+    task_id = int(os.environ["SLURM_ARRAY_TASK_ID"])
+    logging.info(f"Executing task # {task_id}")
+    params = points[task_id]
+    if not wiggin_mito.sweep.is_done(params, folder_func=run_folder):
+        wiggin_mito.sweep.run_point(
+            "./bottlebrush_pbc.py", params, folder_func=run_folder
+        )
+
+else:
+    wiggin_mito.sweep.run_sweep(
+        "./bottlebrush_pbc.py",
+        cli_base_params,
+        cli_grids,
+        folder_func=run_folder,
+        n_workers=sweep_args.n_workers,
+        threads_per_worker=sweep_args.threads_per_worker,
     )
-)
-print(cli_extra_params)
-cli_extra_params = dict(cli_extra_params)
-
-cli_params = dict(cli_base_params)
-cli_params.update(cli_extra_params)
-
-cmd = [
-    "python",
-    "./bottlebrush_pbc.py",
-]
-
-for k, v in cli_params.items():
-    if v is not None:
-        cmd.append(k)
-        if bool(str(v)):
-            cmd.append(str(v))
-
-logging.info(f"Executing command: {repr(cmd)}")
-
-if not dry_run:
-    subprocess.call(cmd)
@@ -1,3 +1,3 @@
-from . import conformations, forces, actions  # noqa: F401
+from . import checkpoint, conformations, forces, multiscale, random_loop_arrays, replicas, reporters, sidecar, simutils, sweep, trajstore, actions, analysis  # noqa: F401
 
 __version__ = '0.0.1-pre'
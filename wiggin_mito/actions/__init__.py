@@ -1 +1 @@
-from . import cohesion, conformations, constraints, heteropolymer, interactions, loops  # noqa: F401
\ No newline at end of file
+from . import analysis, checkpoint, cohesion, conformations, constraints, heteropolymer, interactions, loops, output, replicas  # noqa: F401
\ No newline at end of file
@@ -0,0 +1,95 @@
+from dataclasses import dataclass
+import logging
+import os
+from typing import Optional, Sequence # noqa: F401
+
+import numpy as np
+
+from .. import simutils
+from ..analysis import cache, msd
+
+from wiggin.core import SimAction
+
+
+logging.basicConfig(level=logging.INFO)
+
+
+@dataclass
+class MultiTauMSDCorrelator(SimAction):
+    """
+    Compute the MSD of particle groups on the fly, with a multi-tau
+    correlator (see analysis.msd.MultiTauMSD) that takes O(log T) memory.
+    Lags are measured in blocks. The result is saved to
+    folder/analysis/msd.npz every save_every blocks.
+
+    Must be added after the loop actions. With several replicas,
+    groups are only defined for the first replica. Note that the
+    correlator is not stored in checkpoints: after a resume (see Checkpoint),
+    it restarts and saves to folder/analysis/msd_from_<block>.npz, keeping
+    the result of the previous part of the run.
+
+    Parameters
+    ----------
+    groups: Sequence[str]
+        Particle groups, see analysis.msd.particle_groups(), e.g.
+        "loop_bases" and "loop_tips" (the midpoints of loops). Note that the
+        correlator keeps about p*log(T) frames of every particle of
+        the groups, so large groups (e.g. "loop_layers") take a lot of memory.
+    every: int
+        The number of blocks between frames of the correlator.
+    start: int
+        The first block to use, e.g. after the compression.
+    p, m: int
+        The parameters of the correlator.
+    save_every: int
+        The number of blocks between saves of the result.
+    """
+    groups: Sequence[str] = ('backbone', 'tips', 'loop_bases', 'loop_tips')
+    every: int = 1
+    start: int = 0
+    p: int = 16
+    m: int = 2
+    save_every: int = 100
+
+    _reads_shared = ['N', 'folder', 'loops', 'backbone', 'replicas', 'checkpoint']
+
+    def run_init(self, sim):
+        # do not use self.params!
+        # only use parameters from self and self._shared
+        replica_info = self._shared.get('replicas')
+        N = self._shared['N'] if replica_info is None else replica_info['replica_N']
+        loops = np.asarray(self._shared['loops'])
+        backbone = self._shared['backbone']
+        if replica_info is not None:
+            loops = loops[loops.max(axis=1) < N] if len(loops) else loops
+            backbone = None if backbone is None else np.asarray(backbone)[np.asarray(backbone) < N]
+
+        self._correlator = msd.MultiTauMSD(
+            msd.particle_groups(N, loops, backbone, self.groups), p=self.p, m=self.m)
+        self._resumed = self._shared.get('checkpoint') is not None
+        self._path = None
+
+        return sim
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self._path), exist_ok=True)
+        tmp_path = self._path + '.tmp.npz'
+        np.savez(tmp_path, **self._correlator.result(dt=self.every))
+        os.replace(tmp_path, self._path)
+
+    def run_loop(self, sim):
+        if (sim.block < self.start) or ((sim.block - self.start) % self.every):
+            return sim
+
+        if not sim.forces_applied:
+            sim._apply_forces()
+        if self._path is None:
+            # the block is known only after the checkpoint is restored
+            name = f'msd_from_{sim.block}.npz' if self._resumed else 'msd.npz'
+            self._path = os.path.join(self._shared['folder'], cache.CACHE_FOLDER, name)
+        self._correlator.add(simutils.get_positions(sim))
+
+        if self._correlator.n_frames % max(1, self.save_every // self.every) == 0:
+            self._save()
+
+        return sim
@@ -0,0 +1,138 @@
+from dataclasses import dataclass
+import logging
+import os
+import signal
+import sys
+from typing import Optional # noqa: F401
+
+import numpy as np
+
+from .. import checkpoint
+
+from wiggin.core import SimAction
+
+
+logging.basicConfig(level=logging.INFO)
+
+
+@dataclass
+class Checkpoint(SimAction):
+    """
+    Periodically save the dynamic state of the simulation and resume
+    from it after a restart.
+
+    A checkpoint is saved every `every` blocks, on SIGUSR1 and on SIGTERM
+    (e.g. before a SLURM time limit); after SIGTERM, the simulation exits
+    with exit_code. Signals are processed between blocks.
+
+    If resume is True and a checkpoint exists, the simulation continues
+    from the checkpointed block: configure-time random generation
+    (loops, particle types) is reproduced from the stored seed (shared as
+    config_seed), initial conformations are not generated, and positions,
+    velocities, context parameters and RNG states are restored before
+    the first block. The stored output is kept: the output files are
+    stashed while InitializeSimulation creates its (overwriting) reporter,
+    and HDF5 reporters continue from the checkpointed block, dropping
+    the blocks reported after the checkpoint.
+
+    Must be added right after InitializeSimulation, so that it is configured
+    before, and its run_loop() is executed before, all other actions.
+
+    Parameters
+    ----------
+    every: int
+        The number of blocks between checkpoints.
+    path: str or None
+        The checkpoint file, folder/checkpoint/checkpoint.npz by default.
+    resume: bool
+        Whether to resume from an existing checkpoint.
+    config_seed: int or None
+        The seed of configure-time random generation, random by default.
+    exit_code: int
+        The exit code after saving a checkpoint on SIGTERM.
+    """
+    every: int = 100
+    path: Optional[str] = None
+    resume: bool = True
+    config_seed: Optional[int] = None
+    exit_code: int = 143
+
+    _reads_shared = ['folder']
+    _writes_shared = ['checkpoint', 'config_seed']
+
+    def configure(self):
+        out_shared = {}
+
+        if self.path is None:
+            self.path = checkpoint.checkpoint_path(self._shared['folder'])
+
+        if self.resume and os.path.exists(self.path):
+            self.config_seed = checkpoint.load_checkpoint(self.path)['extra']['config_seed']
+            out_shared['checkpoint'] = self.path
+            checkpoint.stash_output(self._shared['folder'])
+            logging.info(f'Resuming from {self.path}')
+        elif self.config_seed is None:
+            self.config_seed = int(np.random.default_rng().integers(2 ** 31))
+
+        # reproduces configure-time random generation when resuming
+        out_shared['config_seed'] = self.config_seed
+
+        return out_shared
+
+    def _request(self, signum, frame):
+        self._requested.add(signum)
+
+    def run_init(self, sim):
+        # do not use self.params!
+        # only use parameters from self and self._shared
+        self._requested = set()
+        self._pending_restore = self._shared.get('checkpoint') is not None
+        if self._pending_restore:
+            checkpoint.unstash_output(self._shared['folder'])
+
+        checkpoint.register_state(
+            sim,
+            'reporter_counters',
+            lambda: checkpoint.reporter_counters(sim.reporters),
+            lambda counters: checkpoint.set_reporter_counters(sim.reporters, counters),
+        )
+
+        for signum in [signal.SIGTERM, signal.SIGUSR1]:
+            try:
+                signal.signal(signum, self._request)
+            except ValueError:
+                logging.warning('Checkpoint signal handlers can only be installed in the main thread')
+
+        return sim
+
+    def _save(self, sim):
+        # stored blocks must not lag behind the checkpoint: write out
+        # the blocks buffered by reporters (and queued by AsyncReporter)
+        for reporter in sim.reporters:
+            reporter.dump_data()
+        checkpoint.save_checkpoint(
+            sim, self.path, extra=dict(config_seed=self.config_seed))
+
+    def run_loop(self, sim):
+        if self._pending_restore:
+            if not sim.forces_applied:
+                sim._apply_forces()
+            checkpoint.restore_checkpoint(
+                sim, checkpoint.load_checkpoint(self._shared['checkpoint']))
+            self._pending_restore = False
+            return sim
+
+        if (sim.block > 0) and (sim.block % self.every == 0):
+            self._save(sim)
+        elif self._requested:
+            self._save(sim)
+
+        if signal.SIGTERM in self._requested:
+            for reporter in sim.reporters:
+                reporter.dump_data()
+            logging.info('Exiting after SIGTERM')
+            sys.exit(self.exit_code)
+
+        self._requested.clear()
+
+        return sim
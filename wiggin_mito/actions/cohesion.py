@@ -1,10 +1,12 @@
 from dataclasses import dataclass
 
 from typing import Any
-from wiggin.core import SimAction
 
-import polychrom
-import polychrom.forces
+import numpy as np
+
+from .. import forces
+
+from wiggin.core import SimAction
 
 
 @dataclass
@@ -34,18 +36,16 @@ class CrosslinkParallelChains(SimAction):
         # do not use self.args!
         # only use parameters from config.action and config.shared
 
-        bonds = sum(
-            [
-                zip(
-                    range(chain1[0], chain1[1], chain1[2]),
-                    range(chain2[0], chain2[1], chain2[2]),
-                )
-                for chain1, chain2 in self.chains
-            ]
-        )
+        bonds = []
+        for chain1, chain2 in self.chains:
+            idxs1 = np.arange(*chain1)
+            idxs2 = np.arange(*chain2)
+            n_bonds = min(len(idxs1), len(idxs2))
+            bonds.append(np.vstack([idxs1[:n_bonds], idxs2[:n_bonds]]).T)
+        bonds = np.vstack(bonds)
 
         sim.add_force(
-            polychrom.forces.harmonic_bonds(
+            forces.harmonic_bonds(
                 sim,
                 bonds=bonds,
                 bondLength=self.bond_length,
@@ -1,10 +1,11 @@
 from dataclasses import dataclass
 import logging
+import os
 from typing import Union, Tuple, Sequence, Any, Optional # noqa: F401
 
 import numpy as np
 
-from .. import conformations
+from .. import checkpoint, conformations, multiscale, replicas, sidecar, sweep
 
 from wiggin.core import SimAction
 
@@ -12,6 +13,43 @@ from wiggin.core import SimAction
 logging.basicConfig(level=logging.INFO)
 
 
+def _set_initial_data(shared, sim):
+    """
+    Load the initial conformation into the simulation; when resuming from
+    a checkpoint (see Checkpoint), the conformation is not generated.
+    """
+    checkpoint_path = shared.get("checkpoint")
+    if checkpoint_path is not None:
+        sim.set_data(checkpoint.load_positions(checkpoint_path))
+        return
+
+    conformation = shared["initial_conformation"]
+    sim.set_data(np.asarray(conformation))
+    conformation.release()
+
+
+def _lazy_conformation(shared, generator, kwargs, seed, metadata=None):
+    """
+    Make a LazyConformation of a loop brush; if the simulation is split
+    into replicas (see ReplicaMultiplexing), each replica is generated
+    independently.
+    """
+    replica_info = shared.get("replicas")
+    if (replica_info is not None) and (replica_info["n_replicas"] > 1):
+        kwargs = dict(
+            kwargs,
+            generator=generator,
+            n_replicas=replica_info["n_replicas"],
+            replica_N=replica_info["replica_N"],
+            offsets=np.asarray(replica_info["offsets"]),
+        )
+        generator = replicas.make_replicated_conformation
+        metadata = None
+
+    return conformations.LazyConformation(
+        generator, kwargs, seed=seed, metadata=metadata)
+
+
 @dataclass
 class HelicalLoopBrushConformation(SimAction):
     helix_radius: Optional[float] = None
@@ -19,8 +57,10 @@ class HelicalLoopBrushConformation(SimAction):
     helix_step: Optional[float] = None
     axial_compression_factor: Optional[float] = None
     random_loop_orientations: bool = True
+    nested_loop_fold: str = "pin"
+    seed: Optional[int] = None
     
-    _reads_shared = ['N', 'loops']
+    _reads_shared = ['N', 'loops', 'folder', 'replicas', 'checkpoint']
     _writes_shared = ['initial_conformation']
 
     def configure(self):
@@ -136,23 +176,32 @@ class HelicalLoopBrushConformation(SimAction):
         self.helix_step = helix_step
         self.helix_radius = helix_radius
 
-        out_shared[
-            "initial_conformation"
-        ] = conformations.make_helical_loopbrush(
+        if self.seed is None:
+            self.seed = int(np.random.randint(2 ** 31))
+
+        kwargs = dict(
             L=self._shared["N"],
             helix_radius=helix_radius,
             helix_step=helix_step,
             loops=self._shared["loops"],
             random_loop_orientations=self.random_loop_orientations,
+            nested_loop_fold=self.nested_loop_fold,
+        )
+        out_shared["initial_conformation"] = _lazy_conformation(
+            self._shared,
+            conformations.make_helical_loopbrush,
+            kwargs,
+            seed=self.seed,
+            metadata=conformations.helical_loopbrush_metadata(**kwargs),
         )
 
-        return out_shared
+        return sidecar.store_large_arrays(out_shared, self._shared.get('folder'))
 
 
     def run_init(self, sim):
         # do not use self.params!
         # only use parameters from config.action and config.shared
-        sim.set_data(self._shared["initial_conformation"])
+        _set_initial_data(self._shared, sim)
 
         return sim
 
@@ -164,9 +213,11 @@ class UniformHelicalLoopBrushConformation(SimAction):
     axial_compression_factor: Optional[float] = None
     period_particles: Optional[float] = None
     loop_fold: str = "RW"
+    nested_loop_fold: Optional[str] = None
     chain_bond_length: float = 1.0
+    seed: Optional[int] = None
     
-    _reads_shared = ['N', 'loops']
+    _reads_shared = ['N', 'loops', 'folder', 'replicas', 'checkpoint']
     _writes_shared = ['initial_conformation']        
 
     def configure(self):
@@ -221,25 +272,32 @@ class UniformHelicalLoopBrushConformation(SimAction):
         self.helix_step = helix_step
         self.helix_radius = helix_radius
 
-        out_shared[
-            "initial_conformation"
-        ] = conformations.make_uniform_helical_loopbrush(
-            L=self._shared["N"],
-            helix_radius=helix_radius,
-            helix_step=helix_step,
-            period_particles=self.period_particles,
-            loops=self._shared["loops"],
-            chain_bond_length=self.chain_bond_length,
-            loop_fold=self.loop_fold,
+        if self.seed is None:
+            self.seed = int(np.random.randint(2 ** 31))
+
+        out_shared["initial_conformation"] = _lazy_conformation(
+            self._shared,
+            conformations.make_uniform_helical_loopbrush,
+            dict(
+                L=self._shared["N"],
+                helix_radius=helix_radius,
+                helix_step=helix_step,
+                period_particles=self.period_particles,
+                loops=self._shared["loops"],
+                chain_bond_length=self.chain_bond_length,
+                loop_fold=self.loop_fold,
+                nested_loop_fold=self.nested_loop_fold,
+            ),
+            seed=self.seed,
         )
 
-        return out_shared
+        return sidecar.store_large_arrays(out_shared, self._shared.get('folder'))
 
 
     def run_init(self, sim):
         # do not use self.params!
         # only use parameters from config.action and config.shared
-        sim.set_data(self._shared["initial_conformation"])
+        _set_initial_data(self._shared, sim)
 
         return sim
 
@@ -247,27 +305,254 @@ class UniformHelicalLoopBrushConformation(SimAction):
 @dataclass
 class RWLoopBrushConformation(SimAction):
     end: Optional[Tuple[float, float, float]] = None
+    seed: Optional[int] = None
 
-    _reads_shared = ['N', 'loops']
+    _reads_shared = ['N', 'loops', 'folder', 'replicas', 'periodic_z', 'checkpoint']
     _writes_shared = ['initial_conformation']        
 
     def configure(self):
         out_shared = {}
 
-        out_shared[
-            "initial_conformation"
-        ] = conformations.make_random_loopbrush(
-            L=self._shared["N"],
-            loops=self._shared["loops"],
-            end=self.end
+        if self.seed is None:
+            self.seed = int(np.random.randint(2 ** 31))
+
+        out_shared["initial_conformation"] = _lazy_conformation(
+            self._shared,
+            conformations.make_random_loopbrush,
+            dict(
+                L=self._shared["N"],
+                loops=self._shared["loops"],
+                end=self.end,
+                periodic_z=self._shared.get("periodic_z"),
+            ),
+            seed=self.seed,
         )
 
-        return out_shared
+        return sidecar.store_large_arrays(out_shared, self._shared.get('folder'))
+
+
+    def run_init(self, sim):
+        # do not use self.params!
+        # only use parameters from config.action and config.shared
+        _set_initial_data(self._shared, sim)
+
+        return sim
+
+
+@dataclass
+class SpaceFillingLoopBrushConformation(SimAction):
+    box: Optional[Tuple[float, float, float]] = None
+    curve: str = "hilbert"
+    backbone_extension: float = 0.5
+    start: Optional[Tuple[float, float, float]] = None
+    end: Optional[Tuple[float, float, float]] = None
+    seed: Optional[int] = None
+
+    _reads_shared = ['N', 'loops', 'folder', 'replicas', 'periodic_z', 'checkpoint']
+    _writes_shared = ['initial_conformation']
+
+    def configure(self):
+        out_shared = {}
+
+        if self.box is None:
+            raise ValueError("Please specify the box to fill, e.g. the PBC box")
+
+        if self.seed is None:
+            self.seed = int(np.random.randint(2 ** 31))
+
+        out_shared["initial_conformation"] = _lazy_conformation(
+            self._shared,
+            conformations.make_space_filling_loopbrush,
+            dict(
+                L=self._shared["N"],
+                loops=self._shared["loops"],
+                box=self.box,
+                curve=self.curve,
+                backbone_extension=self.backbone_extension,
+                start=self.start,
+                end=self.end,
+                periodic_z=self._shared.get("periodic_z"),
+            ),
+            seed=self.seed,
+        )
+
+        return sidecar.store_large_arrays(out_shared, self._shared.get('folder'))
+
+
+    def run_init(self, sim):
+        # do not use self.params!
+        # only use parameters from config.action and config.shared
+        _set_initial_data(self._shared, sim)
+
+        return sim
+
+
+@dataclass
+class BackmappedLoopBrushConformation(SimAction):
+    """
+    Start from the back-mapped final conformation of a coarse-grained
+    simulation, where each bead represented `coarse_graining` monomers.
+    Use together with LoadedLoopPositions(folder=coarse_folder).
+    """
+    coarse_folder: Optional[str] = None
+    coarse_graining: int = 10
+    scale: Optional[float] = None
+    block: int = -1
+    seed: Optional[int] = None
+
+    _reads_shared = ['N', 'loops', 'folder', 'checkpoint']
+    _writes_shared = ['initial_conformation']
+
+    def configure(self):
+        out_shared = {}
+
+        if self.coarse_folder is None:
+            raise ValueError("Please specify the folder of the coarse-grained simulation")
+
+        if self.seed is None:
+            self.seed = int(np.random.randint(2 ** 31))
+
+        out_shared["initial_conformation"] = conformations.LazyConformation(
+            multiscale.backmap_from_folder,
+            dict(
+                coarse_folder=self.coarse_folder,
+                k=self.coarse_graining,
+                L=self._shared["N"],
+                loops=self._shared["loops"],
+                block=self.block,
+                scale=self.scale,
+            ),
+            seed=self.seed,
+        )
+
+        return sidecar.store_large_arrays(out_shared, self._shared.get('folder'))
+
+
+    def run_init(self, sim):
+        # do not use self.params!
+        # only use parameters from config.action and config.shared
+        _set_initial_data(self._shared, sim)
+
+        return sim
+
+
+@dataclass
+class WarmStartConformation(SimAction):
+    """
+    Start from the final conformation of the finished run with the nearest
+    parameters (e.g. a neighboring point of a parameter sweep), rescaled
+    to the new axial length. Runs are found among the folders named as
+    Key1_value1-Key2_value2-..., see wiggin_mito.sweep.find_nearest_run().
+
+    The loaded conformation is only used if it has the same number of
+    particles and all loop bases of this run are within max_loop_base_dist
+    in it (i.e. both runs have the same loops, e.g. generated with the same
+    seed); otherwise, a random loop brush conformation is generated.
+
+    Parameters
+    ----------
+    runs_folder: str or None
+        The folder with run folders, the parent of this run's folder by default.
+    run_params: dict or None
+        The parameters of this run, parsed from its folder name by default.
+    ignore_keys: list of str
+        Parameters that do not affect the distance between runs.
+    axial_length: float or None
+        The new distance between the chain tips along the z axis.
+        With PeriodicBackbone, the z side of the periodic box is used
+        by default.
+    max_loop_base_dist: float
+        The max tolerated distance between loop bases.
+    end: (float, float, float) or None
+        The backbone end of the fallback random conformation.
+    block: int
+        The block of the source run to load.
+    """
+    runs_folder: Optional[str] = None
+    run_params: Optional[dict] = None
+    ignore_keys: Sequence[str] = ("R",)
+    axial_length: Optional[float] = None
+    max_loop_base_dist: float = 3.0
+    end: Optional[Tuple[float, float, float]] = None
+    block: int = -1
+    seed: Optional[int] = None
+    source_folder: Optional[str] = None
+
+    _reads_shared = ['N', 'loops', 'folder', 'periodic_z', 'checkpoint']
+    _writes_shared = ['initial_conformation']
+
+    def _find_source(self):
+        folder = os.path.normpath(self._shared["folder"])
+        params = self.run_params
+        if params is None:
+            params = sweep.parse_run_name(os.path.basename(folder))
+            if params is None:
+                logging.warning(f"Cannot parse the parameters of the run from {folder}")
+                return None
+        runs_folder = self.runs_folder or os.path.dirname(folder)
+
+        source, dist = sweep.find_nearest_run(
+            runs_folder, params, self.ignore_keys, exclude=folder)
+        if source is None:
+            logging.info(f"No finished runs to warm-start from in {runs_folder}")
+            return None
+
+        try:
+            coords = conformations.load_conformation(source, self.block)
+        except Exception as e:
+            logging.warning(f"Cannot load the conformation from {source}: {e}")
+            return None
+
+        if len(coords) != self._shared["N"]:
+            logging.info(f"The run {source} has a different number of particles")
+            return None
+        base_dist = conformations.loop_base_distances(coords, self._shared["loops"])
+        if len(base_dist) and base_dist.max() > self.max_loop_base_dist:
+            logging.info(
+                f"The loops of {source} do not match the loops of this run "
+                f"(max loop base distance {base_dist.max():.1f})"
+            )
+            return None
+
+        logging.info(f"Warm start from {source}, parameter distance {dist:.3f}")
+        return source
+
+    def configure(self):
+        out_shared = {}
+
+        if self.seed is None:
+            self.seed = int(np.random.randint(2 ** 31))
+
+        periodic_z = self._shared.get("periodic_z")
+        self.source_folder = self._find_source()
+        if self.source_folder is not None:
+            generator = conformations.warm_start_loopbrush
+            kwargs = dict(
+                folder=self.source_folder,
+                L=self._shared["N"],
+                loops=self._shared["loops"],
+                axial_length=periodic_z if self.axial_length is None else self.axial_length,
+                block=self.block,
+                periodic=periodic_z is not None,
+            )
+        else:
+            generator = conformations.make_random_loopbrush
+            kwargs = dict(
+                L=self._shared["N"],
+                loops=self._shared["loops"],
+                end=self.end,
+                periodic_z=periodic_z,
+            )
+
+        out_shared["initial_conformation"] = conformations.LazyConformation(
+            generator, kwargs, seed=self.seed)
+
+        return sidecar.store_large_arrays(out_shared, self._shared.get('folder'))
 
 
     def run_init(self, sim):
         # do not use self.params!
         # only use parameters from config.action and config.shared
-        sim.set_data(self._shared["initial_conformation"])
+        _set_initial_data(self._shared, sim)
 
         return sim
@@ -4,7 +4,11 @@ from typing import Union, Tuple, Sequence, Any, Optional # noqa: F401
 
 import numpy as np
 
+import wiggin_mito.checkpoint
 import wiggin_mito.forces
+import wiggin_mito.conformations
+import wiggin_mito.replicas
+import wiggin_mito.simutils
 
 import wiggin
 from wiggin.core import SimAction
@@ -85,16 +89,29 @@ class TetherTips(SimAction):
     k: Union[float, Tuple[float, float, float]] = (0, 0, 5)
     particles: Sequence[int] = (0, -1)
     positions: Any = "current"
-            
+
+    _reads_shared = ['replicas']
 
     def run_init(self, sim):
+        particles, positions = self.particles, self.positions
+
+        # tether the tips of every replica, see ReplicaMultiplexing
+        replica_info = self._shared.get('replicas')
+        if (replica_info is not None) and (replica_info['n_replicas'] > 1):
+            particles = wiggin_mito.replicas.expand_particles(
+                particles, replica_info['n_replicas'], replica_info['replica_N'])
+            if not isinstance(positions, str):
+                positions = (
+                    np.asarray(replica_info['offsets'])[:, None, :]
+                    + np.asarray(positions, dtype=float)[None, :, :]
+                ).reshape(-1, 3)
 
         sim.add_force(
             polychrom.forces.tether_particles(
                 sim_object=sim,
-                particles=self.particles,
+                particles=particles,
                 k=self.k,
-                positions=self.positions,
+                positions=positions,
                 name='wm_tether_tips'
             )
         )
@@ -117,19 +134,25 @@ class LoopBrushCylinderCompression(SimAction):
                 "Both z_min and z_max have to be either specified or left as None."
             )
 
-        coords = self._shared["initial_conformation"]
-        
+        conformation = wiggin_mito.conformations.as_lazy_conformation(
+            self._shared["initial_conformation"]
+        )
+
         if self.z_min is None:
-            self.z_min = coords[:, 2].min()
+            self.z_min = conformation.z_extent()[0]
         elif self.z_min == "bb":
-            self.z_min = coords[self._shared["backbone"]][:, 2].min()
+            self.z_min = conformation.backbone_bounding_box(
+                self._shared["backbone"]
+            )[0, 2]
         else:
             self.z_min = self.z_min
 
         if self.z_max is None:
-            self.z_max = coords[:, 2].max()
+            self.z_max = conformation.z_extent()[1]
         elif self.z_max == "bb":
-            self.z_max = coords[self._shared["backbone"]][:, 2].max()
+            self.z_max = conformation.backbone_bounding_box(
+                self._shared["backbone"]
+            )[1, 2]
         else:
             self.z_max = self.z_max
 
@@ -140,8 +163,7 @@ class LoopBrushCylinderCompression(SimAction):
         elif (self.r is None) and (
             self.per_particle_volume is None
         ):
-            coords = self._shared["initial_conformation"]
-            self.r = ((coords[:, :2] ** 2).sum(axis=1) ** 0.5).max()
+            self.r = conformation.max_radius()
         # elif (self.r is None) and (
         #     self.per_particle_volume is not None
         # ):
@@ -177,15 +199,25 @@ class DynamicLoopBrushCylinderCompression(SimAction):
     k_confinement: Optional[float] = 1.0
     axial_length_final: Optional[float] = None
 
-    _reads_shared = ['N', 'initial_conformation']
+    _reads_shared = ['N', 'initial_conformation', 'compression_ts']
+    _writes_shared = ['compression_ts']
+
+    def configure(self):
+        # compression windows, e.g. for denser output, see SelectiveOutput
+        windows = [
+            list(ts) for ts in [self.ts_axial_compression, self.ts_volume_compression]
+            if ts is not None
+        ]
+        return {'compression_ts': self._shared.get('compression_ts', []) + windows}
 
     def spawn_actions(self):
         new_actions = []
         N = self._shared["N"]
-        coords = self._shared["initial_conformation"]
-        bottom_init = coords[:, 2].min()
-        top_init = coords[:, 2].max()
-        r_init = ((coords[:, :2] ** 2).sum(axis=1) ** 0.5).max()
+        conformation = wiggin_mito.conformations.as_lazy_conformation(
+            self._shared["initial_conformation"]
+        )
+        bottom_init, top_init = conformation.z_extent()
+        r_init = conformation.max_radius()
         ppv_init = np.pi * r_init * r_init * (top_init - bottom_init) / N
         axial_length_final = self.axial_length_final
 
@@ -231,3 +263,299 @@ class DynamicLoopBrushCylinderCompression(SimAction):
         )
 
         return new_actions
+
+
+@dataclass
+class PBCBoxCompression(SimAction):
+    """
+    Compress a PBC simulation by shrinking the periodic box in small
+    steps, once per block, from the initial to the final size.
+    At each step, the coordinates are rescaled affinely per segment:
+    the centers of mass of chain segments (a root loop with the following
+    backbone linker) are scaled with the box, while each segment is moved
+    as a rigid body, preserving the bonds within segments.
+    Tethered tips (wm_tether_tips), if present, are rescaled as well.
+
+    Parameters
+    ----------
+    box_final: (float, float, float)
+        The final sides of the PBC box.
+    box_init: (float, float, float) or None
+        The initial sides of the PBC box. If None, the bounding box of
+        the initial conformation is used, but not smaller than box_final.
+    ts: (int, int)
+        The blocks when the compression starts and ends.
+    power: float
+        The shape of the compression curve; with power<1, most of the
+        compression happens early.
+    segment_len: int or None
+        If provided, chain segments are of this fixed length.
+    """
+    box_final: Optional[Tuple[float, float, float]] = None
+    box_init: Optional[Tuple[float, float, float]] = None
+    ts: Tuple[int, int] = (0, 100)
+    power: float = 1.0
+    segment_len: Optional[int] = None
+
+    _reads_shared = ['N', 'loops', 'initial_conformation', 'replicas', 'periodic_z', 'compression_ts']
+    _writes_shared = ['compression_ts']
+
+    def configure(self):
+        if self.box_final is None:
+            raise ValueError("Please specify the final size of the PBC box")
+        box_final = np.asarray(self.box_final, dtype=float)
+
+        if self.box_init is None:
+            conformation = wiggin_mito.conformations.as_lazy_conformation(
+                self._shared["initial_conformation"]
+            )
+            bbox = conformation.bounding_box()
+            box_init = np.maximum(bbox[1] - bbox[0], box_final)
+        else:
+            box_init = np.asarray(self.box_init, dtype=float)
+
+        # the periodic backbone is bonded across the box along z
+        periodic_z = self._shared.get("periodic_z")
+        if periodic_z is not None:
+            box_init[2] = box_final[2] = periodic_z
+
+        self.box_final = tuple(box_final.tolist())
+        self.box_init = tuple(box_init.tolist())
+
+        return {'compression_ts': self._shared.get('compression_ts', []) + [list(self.ts)]}
+
+    def run_init(self, sim):
+        # do not use self.params!
+        # only use parameters from self and self._shared
+        if not getattr(sim, "PBC", False):
+            raise ValueError("PBCBoxCompression requires a simulation with a PBC box")
+
+        N = self._shared["N"]
+        # segments do not span replicas, see ReplicaMultiplexing
+        replica_info = self._shared.get("replicas")
+        replica_N = N if replica_info is None else replica_info["replica_N"]
+        if self.segment_len is not None:
+            boundaries = (
+                np.arange(0, N, replica_N)[:, None] + np.arange(0, replica_N, self.segment_len)[None, :]
+            ).ravel()
+        else:
+            loops = np.asarray(self._shared["loops"])
+            boundaries = np.union1d(
+                loops[looplib.looptools.get_roots(loops)].min(axis=1), np.arange(0, N, replica_N))
+        self._seg_ids = wiggin_mito.simutils.segment_ids(N, boundaries)
+
+        wiggin_mito.simutils.set_default_box(sim, self.box_init)
+        self._box = np.asarray(self.box_init)
+
+        def set_state(box):
+            self._box = np.asarray(box)
+
+        wiggin_mito.checkpoint.register_state(
+            sim, 'PBCBoxCompression', lambda: self._box.tolist(), set_state)
+
+        return sim
+
+    def run_loop(self, sim):
+        ts_start, ts_end = self.ts
+        if not (ts_start <= sim.block < ts_end):
+            return sim
+
+        if not sim.forces_applied:
+            sim._apply_forces()
+
+        frac = ((sim.block - ts_start + 1) / (ts_end - ts_start)) ** self.power
+        box_init, box_final = np.asarray(self.box_init), np.asarray(self.box_final)
+        new_box = box_init + (box_final - box_init) * frac
+        scale = new_box / self._box
+
+        coords = wiggin_mito.simutils.get_positions(sim)
+        coords = wiggin_mito.simutils.scale_segments(coords, self._seg_ids, scale)
+        wiggin_mito.simutils.set_box(sim, new_box)
+        wiggin_mito.simutils.set_positions(sim, coords)
+        if 'wm_tether_tips' in sim.force_dict:
+            wiggin_mito.simutils.scale_tether_positions(sim, 'wm_tether_tips', scale)
+
+        self._box = new_box
+
+        return sim
+
+
+@dataclass
+class AdaptiveCylinderCompression(SimAction):
+    """
+    Compress a loop brush with a cylindrical confinement and tethered tips,
+    advancing the compression as fast as the system tolerates.
+
+    The compression progress goes from 0 (the cylinder around the initial
+    conformation) to 1 (the final axial length and per-particle volume).
+    After each block, the progress is advanced by an adaptive step if
+    the system keeps up with the confinement, i.e. if:
+    (a) the confinement energy per particle is below max_energy_per_particle,
+    (b) the max distance of particles from the axis exceeds the radius
+    of the cylinder by less than max_radius_lag (relative),
+    (c) particles stick out of the top of the cylinder by less than
+    max_axial_lag (relative to the cylinder length).
+    Otherwise, the compression pauses and the step shrinks.
+    The top of the cylinder moves linearly with progress, the per-particle
+    volume - geometrically.
+
+    Parameters
+    ----------
+    axial_length_final: float
+        The final length of the cylinder.
+    per_particle_volume: float
+        The final volume of the cylinder per particle.
+    k_confinement: float
+        The stiffness of the cylinder walls.
+    k_tether: float or (float, float, float)
+        The stiffness of tethers of the chain tips.
+    max_energy_per_particle: float
+        The max tolerated confinement energy per particle, in kT.
+    max_radius_lag, max_axial_lag: float
+        The max tolerated relative lag of the system behind the walls.
+    step_init, step_min, step_max: float
+        The initial, min and max steps of progress per block.
+    growth, shrink: float
+        The factors of the step after successful and failed blocks.
+    block_start: int
+        The block when the compression starts.
+    """
+    axial_length_final: Optional[float] = None
+    per_particle_volume: Optional[float] = 1.25 * 1.25 * 1.25
+    k_confinement: float = 1.0
+    k_tether: Union[float, Tuple[float, float, float]] = (0, 0, 5)
+    max_energy_per_particle: float = 0.05
+    max_radius_lag: float = 0.1
+    max_axial_lag: float = 0.1
+    step_init: float = 0.01
+    step_min: float = 1e-4
+    step_max: float = 0.1
+    growth: float = 1.5
+    shrink: float = 0.5
+    block_start: int = 0
+
+    _reads_shared = ['N', 'initial_conformation']
+
+    def configure(self):
+        if self.axial_length_final is None:
+            raise ValueError("Please specify the final axial length")
+
+        N = self._shared["N"]
+        conformation = wiggin_mito.conformations.as_lazy_conformation(
+            self._shared["initial_conformation"]
+        )
+        self._bottom, self._top_init = conformation.z_extent()
+        r_init = conformation.max_radius()
+        self._ppv_init = (
+            np.pi * r_init * r_init * (self._top_init - self._bottom) / N
+        )
+        self._top_final = self._bottom + self.axial_length_final
+
+        return {}
+
+    def _params(self, progress):
+        top = self._top_init + (self._top_final - self._top_init) * progress
+        ppv = self._ppv_init * (
+            self.per_particle_volume / self._ppv_init) ** progress
+        return top, ppv
+
+    def run_init(self, sim):
+        # do not use self.params!
+        # only use parameters from self and self._shared
+        self._progress = 0.0
+        self._step = self.step_init
+
+        def set_state(state):
+            self._progress, self._step = state
+
+        wiggin_mito.checkpoint.register_state(
+            sim,
+            'AdaptiveCylinderCompression',
+            lambda: [self._progress, self._step],
+            set_state,
+        )
+
+        confinement = wiggin_mito.forces.cylindrical_confinement(
+            sim_object=sim,
+            per_particle_volume=self._ppv_init,
+            bottom=self._bottom,
+            top=self._top_init,
+            k=self.k_confinement,
+            name='wm_cylindrical_confinement'
+        )
+        # a separate force group to measure the confinement energy
+        confinement.setForceGroup(31)
+        sim.add_force(confinement)
+
+        sim.add_force(
+            polychrom.forces.tether_particles(
+                sim_object=sim,
+                particles=(0, -1),
+                k=self.k_tether,
+                positions="current",
+                name='wm_tether_tips'
+            )
+        )
+
+        return sim
+
+    def _keeps_up(self, sim):
+        N = self._shared["N"]
+        top, ppv = self._params(self._progress)
+        r_wall = np.sqrt(ppv * N / (top - self._bottom) / np.pi)
+
+        group = sim.force_dict['wm_cylindrical_confinement'].getForceGroup()
+        energy = sim.context.getState(
+            getEnergy=True, groups={group}).getPotentialEnergy() / sim.kT / N
+
+        coords = wiggin_mito.simutils.get_positions(sim)
+        r_max = np.sqrt((coords[:, :2] ** 2).sum(axis=1).max())
+        z_max = coords[:, 2].max()
+
+        logging.info(
+            f'Adaptive compression: progress {self._progress:.4f}, '
+            f'confinement energy {energy:.4f} kT/particle, '
+            f'r_max/r_wall {r_max / r_wall:.3f}, z_max {z_max:.1f}, top {top:.1f}'
+        )
+
+        return (
+            (energy <= self.max_energy_per_particle)
+            and (r_max <= r_wall * (1 + self.max_radius_lag))
+            and (z_max - top <= (top - self._bottom) * self.max_axial_lag)
+        )
+
+    def run_loop(self, sim):
+        # the compression has no fixed schedule, see SelectiveOutput
+        sim.wm_compression_active = (
+            (sim.block >= self.block_start) and (self._progress < 1.0))
+        if not sim.wm_compression_active:
+            return sim
+
+        if not sim.forces_applied:
+            sim._apply_forces()
+
+        if self._keeps_up(sim):
+            self._progress = min(1.0, self._progress + self._step)
+            self._step = min(self.step_max, self._step * self.growth)
+        else:
+            self._step = max(self.step_min, self._step * self.shrink)
+
+        top, ppv = self._params(self._progress)
+        sim.context.setParameter('top', top)
+        sim.context.setParameter('ppv', ppv)
+
+        tethers = sim.force_dict['wm_tether_tips']
+        z0_idx = [
+            tethers.getPerParticleParameterName(i)
+            for i in range(tethers.getNumPerParticleParameters())
+        ].index('z0')
+        particle, params = tethers.getParticleParameters(1)
+        params = list(params)
+        params[z0_idx] = top
+        tethers.setParticleParameters(1, particle, params)
+        tethers.updateParametersInContext(sim.context)
+
+        if self._progress >= 1.0:
+            logging.info(f'Adaptive compression finished at block {sim.block}')
+
+        return sim
@@ -5,7 +5,7 @@ from typing import Union, Tuple, Sequence, Any, Optional # noqa: F401
 
 import numpy as np
 
-from .. import forces
+from .. import forces, sidecar
 
 from wiggin.core import SimAction
 
@@ -21,7 +21,7 @@ logging.basicConfig(level=logging.INFO)
 class RandomBlockParticleTypes(SimAction):
     avg_block_lens: Sequence[int] = (2, 2)
     
-    _reads_shared = ['N']
+    _reads_shared = ['N', 'folder', 'config_seed']
     _writes_shared = ['particle_types']
 
 
@@ -34,6 +34,12 @@ class RandomBlockParticleTypes(SimAction):
         n_types = len(avg_block_lens)
         particle_types = np.full(N, -1)
 
+        # the seed of Checkpoint reproduces particle types on resume
+        seed = self._shared.get('config_seed')
+        if seed is not None:
+            rng_state = np.random.get_state()
+            np.random.seed(seed)
+
         p, new_p, t = 0, 0, 0
         while new_p <= N:
             new_p = p + np.random.geometric(1 / avg_block_lens[t])
@@ -41,9 +47,13 @@ class RandomBlockParticleTypes(SimAction):
             t = (t + 1) % n_types
             p = new_p
 
+        if seed is not None:
+            np.random.set_state(rng_state)
+
         out_shared["particle_types"] = particle_types
 
-        return out_shared
+        # stored regardless of the size for analysis, see analysis.profiles
+        return sidecar.store_large_arrays(out_shared, self._shared.get('folder'), min_size=0)
 
 
 
@@ -4,7 +4,7 @@ from typing import Union, Tuple, Sequence, Any, Optional # noqa: F401
 
 import numpy as np
 
-from .. import forces
+from .. import forces, replicas
 
 from wiggin.core import SimAction
 import wiggin.forces
@@ -14,11 +14,25 @@ import looplib.looptools
 
 import polychrom
 import polychrom.forces
+from polychrom.forces import openmm
 
 
 logging.basicConfig(level=logging.INFO)
 
 
+def _split_by_replica(idxs, shared):
+    """
+    Split particle indices (or rows of indices) into those of each replica
+    (see ReplicaMultiplexing), e.g. to wrap each replica around
+    the periodic box separately.
+    """
+    replica_info = shared.get("replicas")
+    if replica_info is None:
+        return [np.asarray(idxs)]
+    return replicas.split_by_replica(
+        idxs, replica_info["n_replicas"], replica_info["replica_N"])
+
+
 @dataclass
 class HarmonicLoops(SimAction):
     wiggle_dist: float = 0.25
@@ -47,7 +61,7 @@ class HarmonicLoops(SimAction):
 class RootLoopSeparator(SimAction):
     wiggle_dist: float = 0.25
 
-    _reads_shared = ['loops']
+    _reads_shared = ['N', 'loops', 'replicas', 'periodic_z']
 
     def run_init(self, sim):
         # do not use self.params!
@@ -56,42 +70,254 @@ class RootLoopSeparator(SimAction):
         loops = self._shared["loops"]
         root_loops = loops[looplib.looptools.get_roots(loops)]
         root_loop_spacers = np.vstack([root_loops[:-1][:, 1], root_loops[1:][:, 0]]).T
+        replica_info = self._shared.get("replicas")
+        if replica_info is not None:
+            root_loop_spacers = root_loop_spacers[
+                replicas.within_replicas(root_loop_spacers, replica_info["replica_N"])
+            ]
         root_loop_spacer_lens = root_loop_spacers[:, 1] - root_loop_spacers[:, 0]
 
-        sim.add_force(
-            wiggin.forces.adjustable_harmonic_bonds(
-                sim_object=sim,
-                bonds=root_loop_spacers,
-                bondWiggleDistance=self.wiggle_dist,
-                bondLength=root_loop_spacer_lens,
-                name="RootLoopSpacers",
-                override_checks=True,
-            )
+        # the spacers between the last and the first root loops of each
+        # replica across the periodic boundary, see PeriodicBackbone
+        periodic_z = self._shared.get("periodic_z")
+        if periodic_z is not None:
+            replica_N = self._shared["N"] if replica_info is None else replica_info["replica_N"]
+            wrap_spacers = np.array(
+                [[rl[-1][1], rl[0][0]]
+                 for rl in _split_by_replica(root_loops, self._shared) if len(rl)]
+            ).reshape(-1, 2)
+            root_loop_spacers = np.vstack([root_loop_spacers, wrap_spacers])
+            root_loop_spacer_lens = np.r_[
+                root_loop_spacer_lens,
+                replica_N - wrap_spacers[:, 0] + wrap_spacers[:, 1]]
+
+        force = wiggin.forces.adjustable_harmonic_bonds(
+            sim_object=sim,
+            bonds=root_loop_spacers,
+            bondWiggleDistance=self.wiggle_dist,
+            bondLength=root_loop_spacer_lens,
+            name="RootLoopSpacers",
+            override_checks=True,
         )
+        if periodic_z is not None:
+            force.setUsesPeriodicBoundaryConditions(True)
+
+        sim.add_force(force)
 
 
 @dataclass
 class BackboneStiffness(SimAction):
     k: float = 1.5
 
-    _reads_shared = ['backbone']
+    _reads_shared = ['backbone', 'replicas', 'periodic_z']
         
 
     def run_init(self, sim):
         # do not use self.params!
         # only use parameters from self.selfame] and self._shared
 
-        bb_list = sorted(self._shared["backbone"])
-        triplets = [bb_list[i : i + 3] for i in range(len(bb_list) - 2)]
-        sim.add_force(
-            forces.angle_force(
-                sim_object=sim,
-                triplets=triplets,
-                k=self.k,
-                theta_0=np.pi,
-                name="backbone_stiffness",
-                override_checks=True,
+        bb = np.unique(self._shared["backbone"])
+        triplets = np.lib.stride_tricks.sliding_window_view(bb, 3)
+        replica_info = self._shared.get("replicas")
+        if replica_info is not None:
+            triplets = triplets[
+                replicas.within_replicas(triplets, replica_info["replica_N"])
+            ]
+
+        # the triplets of each replica across the periodic boundary,
+        # see PeriodicBackbone
+        periodic_z = self._shared.get("periodic_z")
+        if periodic_z is not None:
+            triplets = np.vstack(
+                [triplets]
+                + [
+                    [[r_bb[-2], r_bb[-1], r_bb[0]], [r_bb[-1], r_bb[0], r_bb[1]]]
+                    for r_bb in _split_by_replica(bb, self._shared) if len(r_bb) >= 3
+                ]
             )
+
+        force = forces.angle_force(
+            sim_object=sim,
+            triplets=triplets,
+            k=self.k,
+            theta_0=np.pi,
+            name="backbone_stiffness",
+            override_checks=True,
+        )
+        if periodic_z is not None:
+            force.setUsesPeriodicBoundaryConditions(True)
+
+        sim.add_force(force)
+
+
+@dataclass
+class PeriodicBackbone(SimAction):
+    """
+    Wrap the backbone of a loop brush around the periodic box along
+    the z axis, turning a loop brush segment into a unit cell of an
+    infinite loop brush. The last backbone particle is bonded to the first
+    one across the periodic boundary (in each replica, if the simulation
+    is split into replicas, see ReplicaMultiplexing).
+
+    Must be added after the loop actions and before the conformation
+    actions and the actions that bond backbone particles
+    (RootLoopSeparator, BackboneStiffness). The simulation must use
+    a PBC box with the z side equal to `period`.
+
+    Parameters
+    ----------
+    period: float
+        The z side of the PBC box.
+    wiggle_dist: float
+        The wiggle distance of the wrapping bond.
+    bond_length: float
+        The length of the wrapping bond.
+    """
+    period: Optional[float] = None
+    wiggle_dist: float = 0.05
+    bond_length: float = 1.0
+
+    _reads_shared = ['backbone', 'replicas']
+    _writes_shared = ['periodic_z']
+
+    def configure(self):
+        out_shared = {}
+
+        if self.period is None:
+            raise ValueError("Please specify the z side of the PBC box")
+        out_shared['periodic_z'] = self.period
+
+        return out_shared
+
+    def run_init(self, sim):
+        # do not use self.params!
+        # only use parameters from self and self._shared
+        if not getattr(sim, "PBC", False):
+            raise ValueError("PeriodicBackbone requires a simulation with a PBC box")
+
+        bb = np.unique(self._shared["backbone"])
+        wrap_bonds = [
+            (int(r_bb[-1]), int(r_bb[0]))
+            for r_bb in _split_by_replica(bb, self._shared) if len(r_bb) >= 2
+        ]
+
+        force = forces.harmonic_bonds(
+            sim_object=sim,
+            bonds=wrap_bonds,
+            bondWiggleDistance=self.wiggle_dist,
+            bondLength=self.bond_length,
+            name="wm_periodic_backbone_bond",
+            override_checks=True,
         )
+        force.setUsesPeriodicBoundaryConditions(True)
+        sim.add_force(force)
+
+        # the bonded particles should not repel each other, as in Chains
+        for other_force in sim.force_dict.values():
+            if isinstance(other_force, openmm.CustomNonbondedForce):
+                for wrap_bond in wrap_bonds:
+                    other_force.addExclusion(*wrap_bond)
+
+        return sim
+
+
+
+
+@dataclass
+class SoftStartRepulsion(SimAction):
+    """
+    Start a simulation with softened repulsion between particles (and,
+    optionally, softened loop bonds) and ramp them up to their configured
+    values over the first blocks, letting dynamics resolve overlaps
+    of the initial conformation instead of a full energy minimization.
+
+    The repulsion energy is controlled via the global parameter REPe
+    of the polychrom and wiggin_mito nonbonded forces; the configured
+    value of each force is ramped separately in the system, while the
+    context holds a single REPe shared by all forces.
+    Must be added after all actions that add forces.
+
+    Parameters
+    ----------
+    repulsion_factor_init: float
+        The initial repulsion energy relative to the configured one.
+    bond_factor_init: float
+        The initial stiffness of bonds relative to the configured one.
+    bond_forces: list of str
+        The names of harmonic bond forces to soften.
+    n_blocks: int
+        The number of blocks of the ramp.
+    block_start: int
+        The block when the ramp starts.
+    """
+    repulsion_factor_init: float = 0.05
+    bond_factor_init: float = 0.1
+    bond_forces: Sequence[str] = ("loop_harmonic_bonds",)
+    n_blocks: int = 10
+    block_start: int = 0
+
+    def run_init(self, sim):
+        # do not use self.params!
+        # only use parameters from self and self._shared
+        self._done = False
+        # the configured REPe of each force, by force name and parameter index
+        self._rep_e = {}
+        for name, force in sim.force_dict.items():
+            if not isinstance(force, openmm.CustomNonbondedForce):
+                continue
+            for i in range(force.getNumGlobalParameters()):
+                if force.getGlobalParameterName(i) == "REPe":
+                    self._rep_e[name] = (i, force.getGlobalParameterDefaultValue(i))
+                    force.setGlobalParameterDefaultValue(
+                        i, self._rep_e[name][1] * self.repulsion_factor_init)
+        if not self._rep_e:
+            logging.warning("SoftStartRepulsion found no forces with REPe")
+        elif len({rep_e for _, rep_e in self._rep_e.values()}) > 1:
+            logging.warning(
+                "SoftStartRepulsion: forces have different REPe, but share "
+                f"a single REPe in the context: {self._rep_e}")
+
+        self._bond_ks = {}
+        for name in self.bond_forces:
+            if name not in sim.force_dict:
+                logging.warning(f"SoftStartRepulsion: no bond force {name}")
+                continue
+            force = sim.force_dict[name]
+            ks = np.array(
+                [force.getBondParameters(i)[3] for i in range(force.getNumBonds())])
+            self._bond_ks[name] = ks
+            self._set_bond_ks(force, ks * self.bond_factor_init)
+
+        return sim
+
+    @staticmethod
+    def _set_bond_ks(force, ks):
+        for i, k in enumerate(ks):
+            p1, p2, length, _ = force.getBondParameters(i)
+            force.setBondParameters(i, p1, p2, length, k)
+
+    def run_loop(self, sim):
+        block = sim.block - self.block_start
+        if (block < 0) or self._done:
+            return sim
+
+        if not sim.forces_applied:
+            sim._apply_forces()
+
+        # the final values are set once, even if the ramp is skipped on resume
+        progress = min(1.0, block / self.n_blocks)
+        self._done = progress >= 1.0
+        if self._rep_e:
+            factor = self.repulsion_factor_init + (1 - self.repulsion_factor_init) * progress
+            for name, (i, rep_e) in self._rep_e.items():
+                sim.force_dict[name].setGlobalParameterDefaultValue(i, rep_e * factor)
+            # the context value follows the first force, as when the context is created
+            sim.context.setParameter("REPe", next(iter(self._rep_e.values()))[1] * factor)
 
+        factor = self.bond_factor_init + (1 - self.bond_factor_init) * progress
+        for name, ks in self._bond_ks.items():
+            force = sim.force_dict[name]
+            self._set_bond_ks(force, ks * factor)
+            force.updateParametersInContext(sim.context)
 
+        return sim
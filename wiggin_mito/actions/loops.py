@@ -10,10 +10,24 @@ import looplib
 import looplib.looptools
 import looplib.random_loop_arrays
 
+from .. import multiscale, random_loop_arrays, sidecar
+
 
 logging.basicConfig(level=logging.INFO)
 
 
+def _coarse_grain_loops(fine_loops, coarse_graining, folder):
+    """
+    Map loops generated at the fine resolution onto the coarse chain of
+    the simulation; the fine loops are stored for back-mapping
+    (see LoadedLoopPositions and BackmappedLoopBrushConformation).
+    """
+    loops = multiscale.coarse_grain_loops(fine_loops, coarse_graining)
+    if folder is not None:
+        fine_loops = sidecar.save(fine_loops, folder, 'fine_loops')
+    return loops, fine_loops
+
+
 @dataclass
 class SingleLayerLoopPositions(SimAction):
     loop_size: float = 400
@@ -21,9 +35,13 @@ class SingleLayerLoopPositions(SimAction):
     loop_spacing: int = 1
     chain_idxs: Optional[Sequence[int]] = None
     loop_spacing_distr: str = 'uniform'
+    spacing_gamma_k: float = 1
+    min_loop_size: int = 3
+    coarse_graining: int = 1
+    seed: Optional[int] = None
 
-    _reads_shared = ['N', 'chains']
-    _writes_shared = ['loops', 'backbone']
+    _reads_shared = ['N', 'chains', 'folder', 'config_seed']
+    _writes_shared = ['loops', 'backbone', 'fine_loops']
 
     def configure(self):
         out_shared = {}
@@ -37,12 +55,22 @@ class SingleLayerLoopPositions(SimAction):
         else:
             chains = [self._shared["chains"][int(self.chain_idxs)]]
 
+        # a fixed seed reproduces loops across runs, e.g. for warm starts;
+        # otherwise, the seed of Checkpoint reproduces them on resume
+        seed = self.seed if self.seed is not None else self._shared.get('config_seed')
+        if seed is not None:
+            rng_state = np.random.get_state()
+            np.random.seed(seed)
+
+        # with coarse graining, loops are generated for the fine chain
+        k = self.coarse_graining
         loops = []
         for start, end, is_ring in chains:
             if end is None:
                 end = self._shared['N']
+            start, end = start * k, end * k
             chain_len = end - start
-            if self.loop_gamma_k == 1:
+            if (self.loop_gamma_k == 1) and (self.loop_spacing_distr != 'gamma'):
                 loops.append(
                     looplib.random_loop_arrays.exponential_loop_array(
                         chain_len,
@@ -52,22 +80,27 @@ class SingleLayerLoopPositions(SimAction):
                     )
                 )
             else:
-                if self.loop_spacing_distr != 'uniform':
-                    raise ValueError(
-                        'Non-uniformly distributed spacers with '
-                        'gamma-distributed loops are currently not implemented :(')
                 loops.append(
-                    looplib.random_loop_arrays.gamma_loop_array(
+                    random_loop_arrays.gamma_loop_array(
                         chain_len,
                         self.loop_size,
                         self.loop_gamma_k,
                         self.loop_spacing,
-                        min_loop_size=3
+                        loop_spacing_distr=self.loop_spacing_distr,
+                        spacing_gamma_k=self.spacing_gamma_k,
+                        min_loop_size=self.min_loop_size,
                     )
                 )
-            loops[0] += start
+            loops[-1] += start
         loops = np.vstack(loops)
 
+        if seed is not None:
+            np.random.set_state(rng_state)
+
+        if k > 1:
+            loops, out_shared["fine_loops"] = _coarse_grain_loops(
+                loops, k, self._shared.get('folder'))
+
         out_shared["loops"] = (
             loops
             if "loops" not in out_shared
@@ -81,7 +114,8 @@ class SingleLayerLoopPositions(SimAction):
         except Exception:
             out_shared["backbone"] = None
 
-        return out_shared
+        # loops are stored regardless of their size for analysis, see analysis.profiles
+        return sidecar.store_large_arrays(out_shared, self._shared.get('folder'), min_size=0)
 
 
 @dataclass
@@ -93,9 +127,11 @@ class TwoLayerLoopPositions(SimAction):
     outer_inner_offset: int = 1
     inner_loop_gamma_k: float = 1
     outer_loop_gamma_k: float = 1
+    coarse_graining: int = 1
+    seed: Optional[int] = None
             
-    _reads_shared = ['N']
-    _writes_shared = ['loops', 'backbone']
+    _reads_shared = ['N', 'folder', 'replicas', 'config_seed']
+    _writes_shared = ['loops', 'backbone', 'fine_loops']
 
         
     def configure(self):
@@ -103,21 +139,51 @@ class TwoLayerLoopPositions(SimAction):
 
         N = self._shared["N"]
 
-        (
-            outer_loops,
-            inner_loops,
-        ) = looplib.random_loop_arrays.two_layer_gamma_loop_array(
-            N,
-            self.outer_loop_size,
-            self.outer_loop_gamma_k,
-            self.outer_loop_spacing,
-            self.inner_loop_size,
-            self.inner_loop_gamma_k,
-            self.inner_loop_spacing,
-            self.outer_inner_offset,
-        )
+        # generate loops in every replica independently, see ReplicaMultiplexing
+        replica_info = self._shared.get("replicas")
+        if replica_info is None:
+            n_replicas, replica_N = 1, N
+        else:
+            n_replicas, replica_N = replica_info["n_replicas"], replica_info["replica_N"]
+
+        # a fixed seed reproduces loops across runs, e.g. for warm starts;
+        # otherwise, the seed of Checkpoint reproduces them on resume
+        seed = self.seed if self.seed is not None else self._shared.get('config_seed')
+        if seed is not None:
+            rng_state = np.random.get_state()
+            np.random.seed(seed)
+
+        outer_loops, inner_loops = [], []
+        for r in range(n_replicas):
+            (
+                replica_outer_loops,
+                replica_inner_loops,
+            ) = looplib.random_loop_arrays.two_layer_gamma_loop_array(
+                replica_N * self.coarse_graining,
+                self.outer_loop_size,
+                self.outer_loop_gamma_k,
+                self.outer_loop_spacing,
+                self.inner_loop_size,
+                self.inner_loop_gamma_k,
+                self.inner_loop_spacing,
+                self.outer_inner_offset,
+            )
+            offset = r * replica_N * self.coarse_graining
+            outer_loops.append(np.asarray(replica_outer_loops) + offset)
+            inner_loops.append(np.asarray(replica_inner_loops) + offset)
+        outer_loops = np.vstack(outer_loops)
+        inner_loops = np.vstack(inner_loops)
+
+        if seed is not None:
+            np.random.set_state(rng_state)
+
         loops = np.vstack([outer_loops, inner_loops])
         loops.sort()
+        if self.coarse_graining > 1:
+            loops, out_shared["fine_loops"] = _coarse_grain_loops(
+                loops, self.coarse_graining, self._shared.get('folder'))
+            outer_loops = multiscale.coarse_grain_loops(outer_loops, self.coarse_graining)
+            inner_loops = multiscale.coarse_grain_loops(inner_loops, self.coarse_graining)
 
         out_shared["loops"] = (
             loops
@@ -132,5 +198,40 @@ class TwoLayerLoopPositions(SimAction):
             outer_loops, N=N
         )
 
-        return out_shared
+        # loops are stored regardless of their size for analysis, see analysis.profiles
+        return sidecar.store_large_arrays(out_shared, self._shared.get('folder'), min_size=0)
+
+@dataclass
+class LoadedLoopPositions(SimAction):
+    """
+    Load loops stored by a previous simulation, e.g. the fine-resolution
+    loops of a coarse-grained simulation (name='fine_loops').
+    """
+    folder: Optional[str] = None
+    name: str = 'fine_loops'
+
+    _reads_shared = ['N', 'folder']
+    _writes_shared = ['loops', 'backbone']
+
+    def configure(self):
+        out_shared = {}
+
+        if self.folder is None:
+            raise ValueError("Please specify the folder of the simulation to load loops from")
+
+        loops = np.asarray(sidecar.load_shared_array(self.folder, self.name))
+        if loops.max() >= self._shared['N']:
+            raise ValueError(
+                f"The loaded loops do not fit into the chain of {self._shared['N']} particles"
+            )
+        out_shared["loops"] = loops
+
+        try:
+            out_shared["backbone"] = looplib.looptools.get_backbone(
+                out_shared["loops"], N = self._shared['N']
+            )
+        except Exception:
+            out_shared["backbone"] = None
 
+        # loops are stored regardless of their size for analysis, see analysis.profiles
+        return sidecar.store_large_arrays(out_shared, self._shared.get('folder'), min_size=0)
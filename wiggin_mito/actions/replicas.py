@@ -0,0 +1,167 @@
+from dataclasses import dataclass
+import logging
+import os
+from typing import Optional, Tuple # noqa: F401
+
+import numpy as np
+
+from .. import conformations, replicas, reporters
+
+from wiggin.core import SimAction
+
+import polychrom
+import polychrom.hdf5_format
+from polychrom.forces import openmm
+
+
+logging.basicConfig(level=logging.INFO)
+
+
+@dataclass
+class ReplicaMultiplexing(SimAction):
+    """
+    Simulate many independent replicas of a small system in a single
+    OpenMM context. The N particles of the simulation are split into
+    n_replicas consecutive blocks of equal size, placed side by side
+    along the x axis.
+
+    With PBC, each replica gets its own cell, replica_box: the PBC box of
+    the simulation must be n_replicas cells long along x. Without PBC,
+    replicas are shifted by `spacing`, which must exceed the extent of
+    a replica plus the nonbonded cutoff. Replicas are never overlaid:
+    OpenMM would still evaluate all pairs of overlaid particles, making
+    the nonbonded cost grow as n_replicas^2, more than separate runs.
+    Interactions between particles of different replicas are also
+    switched off, as a safety net for replicas that drift apart.
+
+    Must be added after the actions that create nonbonded forces
+    (e.g. Chains) and before the actions that generate loops and
+    conformations. Loop actions must be given one chain per replica.
+
+    Parameters
+    ----------
+    n_replicas: int
+        The number of replicas.
+    replica_box: (float, float, float) or None
+        The PBC cell of a single replica, for simulations with PBC.
+    spacing: float or None
+        The shift between replicas along the x axis, for simulations
+        without PBC.
+    demultiplex_output: bool
+        If True, coordinates of each replica are stored in a separate
+        folder, folder/replica_i.
+    max_data_length: int
+        The number of blocks per file of replica reporters.
+    """
+    n_replicas: int = 1
+    replica_box: Optional[Tuple[float, float, float]] = None
+    spacing: Optional[float] = None
+    demultiplex_output: bool = True
+    max_data_length: int = 50
+
+    _reads_shared = ['N', 'folder', 'checkpoint', 'initial_conformation']
+    _writes_shared = ['replicas']
+
+    def configure(self):
+        out_shared = {}
+
+        N = self._shared['N']
+        if N % self.n_replicas:
+            raise ValueError(
+                f"The number of particles {N} is not divisible "
+                f"by the number of replicas {self.n_replicas}"
+            )
+
+        if self.replica_box is not None:
+            spacing = self.replica_box[0]
+        elif self.spacing is not None:
+            spacing = self.spacing
+        else:
+            raise ValueError(
+                "Please specify replica_box (with PBC) or spacing (without PBC), "
+                "overlaid replicas are slower than separate runs"
+            )
+
+        out_shared['replicas'] = dict(
+            n_replicas=self.n_replicas,
+            replica_N=N // self.n_replicas,
+            offsets=replicas.replica_offsets(self.n_replicas, spacing).tolist(),
+        )
+
+        return out_shared
+
+    def _check_separation(self, sim):
+        n_replicas = self._shared['replicas']['n_replicas']
+        if getattr(sim, 'PBC', False):
+            if self.replica_box is None:
+                raise ValueError('Please specify replica_box for a simulation with PBC')
+            box = getattr(sim, 'kwargs', {}).get('PBCbox')
+            if box and not np.isclose(box[0], n_replicas * self.replica_box[0]):
+                raise ValueError(
+                    f'The PBC box {box} must be {n_replicas} replica cells '
+                    f'{self.replica_box} long along x'
+                )
+            return
+
+        if self.spacing is None:
+            raise ValueError('Please specify spacing for a simulation without PBC')
+        if (self._shared.get('initial_conformation') is None) or (
+            self._shared.get('checkpoint') is not None
+        ):
+            return
+        cutoffs = [
+            force.getCutoffDistance() / sim.conlen
+            for force in sim.force_dict.values()
+            if isinstance(force, openmm.CustomNonbondedForce)
+        ]
+        bbox = conformations.as_lazy_conformation(
+            self._shared['initial_conformation']
+        ).bounding_box(np.arange(self._shared['replicas']['replica_N']))
+        min_spacing = bbox[1, 0] - bbox[0, 0] + max(cutoffs, default=0)
+        if self.spacing <= min_spacing:
+            raise ValueError(
+                f'The spacing {self.spacing} must exceed the extent of a replica '
+                f'plus the nonbonded cutoff, {min_spacing:.1f}'
+            )
+
+    def run_init(self, sim):
+        # do not use self.params!
+        # only use parameters from self and self._shared
+        replica_info = self._shared['replicas']
+        ids = replicas.replica_ids(
+            replica_info['n_replicas'], replica_info['replica_N'])
+
+        self._check_separation(sim)
+
+        n_masked = 0
+        for force in sim.force_dict.values():
+            if isinstance(force, openmm.CustomNonbondedForce):
+                replicas.mask_interreplica_interactions(force, ids)
+                n_masked += 1
+        if n_masked == 0:
+            logging.warning(
+                'ReplicaMultiplexing found no nonbonded forces to mask, '
+                'add it after the actions that create nonbonded forces'
+            )
+
+        if self.demultiplex_output:
+            # keep the stored blocks when resuming, see Checkpoint
+            resuming = self._shared.get('checkpoint') is not None
+            replica_reporters = [
+                polychrom.hdf5_format.HDF5Reporter(
+                    folder=os.path.join(self._shared['folder'], f'replica_{r}'),
+                    max_data_length=self.max_data_length,
+                    overwrite=not resuming,
+                    check_exists=not resuming,
+                )
+                for r in range(replica_info['n_replicas'])
+            ]
+            sim.reporters = [
+                reporters.ReplicaReporter(
+                    replica_reporters,
+                    replica_info['replica_N'],
+                    common_reporter=sim.reporters[0] if sim.reporters else None,
+                )
+            ]
+
+        return sim
@@ -0,0 +1 @@
+from . import cache, contacts, helix, loopstats, msd, profiles, scalings  # noqa: F401
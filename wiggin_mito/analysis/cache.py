@@ -0,0 +1,35 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+
+CACHE_FOLDER = "analysis"
+
+
+def cache_path(folder, name, params):
+    """
+    The path of a cached result of an analysis of a run; results of
+    analyses with different parameters are stored in different files.
+    """
+    key = hashlib.md5(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()[:12]
+    return os.path.join(folder, CACHE_FOLDER, f"{name}-{key}.npz")
+
+
+def cached(folder, name, params, compute, overwrite=False):
+    """
+    Return the result of compute() (a dict of arrays), cached in the run
+    folder under the given analysis name and parameters.
+    """
+    path = cache_path(folder, name, params)
+    if os.path.exists(path) and not overwrite:
+        with np.load(path) as f:
+            return {k: f[k] for k in f.files if k != "params"}
+
+    result = compute()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp.npz"
+    np.savez(tmp_path, params=np.array(json.dumps(params, default=str)), **result)
+    os.replace(tmp_path, path)
+    return result
@@ -0,0 +1,223 @@
+import multiprocessing
+
+import numpy as np
+import scipy.sparse
+
+from .. import trajstore
+
+
+def _cell_grid(coords, cutoff, box=None):
+    """
+    Assign particles to cubic-ish cells with sides of at least cutoff.
+    With a PBC box, coordinates are wrapped into the box and the grid
+    is periodic.
+    """
+    if box is None:
+        shifted = coords - coords.min(axis=0)
+        n_cells = np.floor(shifted.max(axis=0) / cutoff).astype(np.int64) + 1
+        cell_size = np.full(3, float(cutoff))
+    else:
+        box = np.asarray(box, dtype=float)
+        shifted = np.mod(coords, box)
+        n_cells = np.maximum(np.floor(box / cutoff).astype(np.int64), 1)
+        cell_size = box / n_cells
+
+    cell_idx3 = np.minimum(np.floor(shifted / cell_size).astype(np.int64), n_cells - 1)
+    return cell_idx3, n_cells
+
+
+def _neighbor_offsets(n_cells, periodic):
+    """
+    The offsets of neighbor cells (incl. the cell itself); offsets that
+    coincide on small periodic grids are counted once.
+    """
+    offsets = np.array(np.meshgrid([-1, 0, 1], [-1, 0, 1], [-1, 0, 1], indexing="ij")).reshape(3, -1).T
+    if periodic:
+        offsets = np.unique(np.mod(offsets, n_cells), axis=0)
+    return offsets
+
+
+def iter_contact_chunks(coords, cutoff, box=None, max_pairs=2 ** 22):
+    """
+    Find all pairs of particles closer than cutoff with a vectorized cell
+    list, yielding them in chunks of at most ~max_pairs candidate pairs,
+    so that the full list of pairs is never kept in memory.
+
+    Parameters
+    ----------
+    coords: np.ndarray
+        An (N, 3) array of coordinates.
+    cutoff: float
+        The contact radius.
+    box: (float, float, float) or None
+        The sides of the PBC box; if provided, distances follow
+        the minimum image convention.
+    max_pairs: int
+        The max number of candidate pairs checked at once.
+
+    Yields
+    ------
+    i, j: np.ndarray
+        Indices of particles in contact, i < j.
+    """
+    coords = np.asarray(coords, dtype=np.float64)
+    periodic = box is not None
+    box = None if box is None else np.asarray(box, dtype=float)
+    cell_idx3, n_cells = _cell_grid(coords, cutoff, box)
+
+    # particles are processed in the cell order for memory locality
+    cell_ids = np.ravel_multi_index(cell_idx3.T, n_cells)
+    order = np.argsort(cell_ids, kind="stable")
+    coords, cell_idx3 = coords[order], cell_idx3[order]
+    counts = np.bincount(cell_ids, minlength=int(np.prod(n_cells)))
+    starts = np.r_[0, np.cumsum(counts)[:-1]]
+
+    for offset in _neighbor_offsets(n_cells, periodic):
+        nb_idx3 = cell_idx3 + offset
+        if periodic:
+            nb_idx3 = np.mod(nb_idx3, n_cells)
+            particles = np.arange(len(coords))
+        else:
+            valid = ((nb_idx3 >= 0) & (nb_idx3 < n_cells)).all(axis=1)
+            particles = np.flatnonzero(valid)
+            nb_idx3 = nb_idx3[valid]
+            if len(particles) == 0:
+                continue
+        nb_cells = np.ravel_multi_index(nb_idx3.T, n_cells)
+        nb_counts = counts[nb_cells]
+
+        # split particles into chunks with a bounded number of candidate pairs
+        cum_counts = np.cumsum(nb_counts)
+        bounds = np.searchsorted(cum_counts, np.arange(max_pairs, cum_counts[-1] + max_pairs, max_pairs))
+        bounds = np.unique(np.r_[0, np.minimum(bounds + 1, len(particles))])
+
+        for lo, hi in zip(bounds[:-1], bounds[1:]):
+            chunk_counts = nb_counts[lo:hi]
+            total = chunk_counts.sum()
+            if total == 0:
+                continue
+            i = np.repeat(particles[lo:hi], chunk_counts)
+            within = np.arange(total) - np.repeat(np.cumsum(chunk_counts) - chunk_counts, chunk_counts)
+            j = np.repeat(starts[nb_cells[lo:hi]], chunk_counts) + within
+
+            # each pair is found from both of its cells
+            keep = i < j
+            i, j = i[keep], j[keep]
+            d = coords[j] - coords[i]
+            if periodic:
+                d -= np.round(d / box) * box
+            close = (d * d).sum(axis=1) <= cutoff * cutoff
+            i, j = order[i[close]], order[j[close]]
+            yield np.minimum(i, j), np.maximum(i, j)
+
+
+def contact_map(
+    coords, cutoff, bin_size=1, n_bins=None, box=None, particle_ids=None, sparse=False, max_pairs=2 ** 22
+):
+    """
+    Bin the contacts of a conformation into a symmetric contact map.
+
+    Parameters
+    ----------
+    coords: np.ndarray
+        An (N, 3) array of coordinates.
+    cutoff: float
+        The contact radius.
+    bin_size: int
+        The number of particles per bin of the map.
+    n_bins: int or None
+        The size of the map, enough for all particles by default.
+    box: (float, float, float) or None
+        The sides of the PBC box.
+    particle_ids: np.ndarray or None
+        The indices of particles in the simulation, if coords are
+        a subset (e.g. the backbone).
+    sparse: bool
+        If True, returns a scipy.sparse.csr_matrix, otherwise a dense array.
+
+    Returns
+    -------
+    cmap: np.ndarray or scipy.sparse.csr_matrix
+        The numbers of contacts between bins. The diagonal counts contacts
+        within bins (incl. self-contacts of particles).
+    """
+    ids = np.arange(len(coords)) if particle_ids is None else np.asarray(particle_ids)
+    n_bins = int(ids.max() // bin_size + 1) if n_bins is None else n_bins
+    bins = ids // bin_size
+
+    upper = _empty_map(n_bins, sparse)
+    for i, j in iter_contact_chunks(coords, cutoff, box=box, max_pairs=max_pairs):
+        upper = _add_pairs(upper, bins[i], bins[j], n_bins, sparse)
+
+    # contacts within bins are counted once, self-contacts added on the diagonal
+    diag = np.bincount(bins, minlength=n_bins)
+    if sparse:
+        upper = upper.tocsr()
+        return (upper + upper.T - scipy.sparse.diags(upper.diagonal(), dtype=np.int64) + scipy.sparse.diags(diag, dtype=np.int64)).tocsr()
+    return upper + upper.T - np.diag(np.diag(upper)) + np.diag(diag)
+
+
+def _empty_map(n_bins, sparse):
+    if sparse:
+        return scipy.sparse.csr_matrix((n_bins, n_bins), dtype=np.int64)
+    return np.zeros((n_bins, n_bins), dtype=np.int64)
+
+
+def _add_pairs(cmap, bi, bj, n_bins, sparse):
+    lo, hi = np.minimum(bi, bj), np.maximum(bi, bj)
+    keys, counts = np.unique(lo * n_bins + hi, return_counts=True)
+    if sparse:
+        return cmap + scipy.sparse.csr_matrix(
+            (counts, (keys // n_bins, keys % n_bins)), shape=(n_bins, n_bins))
+    np.add.at(cmap.ravel(), keys, counts)
+    return cmap
+
+
+def _trajectory_map_worker(args):
+    folder, block_idxs, kwargs = args
+    view = trajstore.TrajectoryView(folder)
+    cmap = None
+    for i in block_idxs:
+        block_map = contact_map(view[i], particle_ids=view.particles, **kwargs)
+        cmap = block_map if cmap is None else cmap + block_map
+    return cmap
+
+
+def trajectory_contact_map(
+    folder, cutoff, bin_size=1, blocks=slice(None), box=None, sparse=False, n_processes=1, **kwargs
+):
+    """
+    Sum contact maps over the blocks of a stored trajectory, streaming
+    the blocks (see trajstore.TrajectoryView) and splitting them between
+    n_processes worker processes.
+
+    Returns
+    -------
+    cmap: np.ndarray or scipy.sparse.csr_matrix
+        The total contact map.
+    n_blocks: int
+        The number of blocks summed.
+    """
+    view = trajstore.TrajectoryView(folder)
+    block_idxs = np.arange(len(view))[blocks]
+    kwargs = dict(
+        kwargs,
+        cutoff=cutoff,
+        bin_size=bin_size,
+        n_bins=int(view.particles.max() // bin_size + 1),
+        box=box,
+        sparse=sparse,
+    )
+    tasks = [
+        (view.folder, idxs, kwargs)
+        for idxs in np.array_split(block_idxs, max(1, min(n_processes, len(block_idxs))))
+    ]
+
+    if n_processes > 1:
+        with multiprocessing.Pool(len(tasks)) as pool:
+            maps = pool.map(_trajectory_map_worker, tasks)
+    else:
+        maps = [_trajectory_map_worker(task) for task in tasks]
+
+    maps = [m for m in maps if m is not None]
+    return sum(maps[1:], maps[0]), len(block_idxs)
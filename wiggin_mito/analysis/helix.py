@@ -0,0 +1,178 @@
+import hashlib
+
+import numpy as np
+
+from .. import trajstore
+from . import cache
+
+
+def principal_axes(coords):
+    """
+    The principal axes of each frame of an (n_frames, n, 3) array,
+    sorted by decreasing variance, as an (n_frames, 3, 3) array of row
+    vectors. The first axis points from the first to the last particle,
+    and the axes form a right-handed basis.
+    """
+    X = coords - coords.mean(axis=1, keepdims=True)
+    cov = np.einsum("fni,fnj->fij", X, X) / X.shape[1]
+    _, vecs = np.linalg.eigh(cov)
+    axes = np.transpose(vecs[:, :, ::-1], (0, 2, 1)).copy()
+
+    flip = np.einsum("fi,fi->f", X[:, -1] - X[:, 0], axes[:, 0]) < 0
+    axes[flip, 0] *= -1
+    axes[:, 2] = np.cross(axes[:, 0], axes[:, 1])
+    return axes
+
+
+def axial_profile(coords, n_grid, axes=None):
+    """
+    Project frames of the backbone onto their principal axis and average
+    the transverse position (as a complex number u + iv) in n_grid bins
+    along the axis, vectorized over frames.
+
+    Returns
+    -------
+    w: np.ndarray
+        An (n_frames, n_grid) complex array of transverse positions;
+        empty bins are linearly interpolated.
+    dz: np.ndarray
+        The bin size of each frame.
+    """
+    coords = np.asarray(coords, dtype=np.float64)
+    n_frames, n = coords.shape[:2]
+    axes = principal_axes(coords) if axes is None else axes
+    X = coords - coords.mean(axis=1, keepdims=True)
+    proj = np.einsum("fni,fji->fnj", X, axes)
+    z, w = proj[..., 0], proj[..., 1] + 1j * proj[..., 2]
+
+    z_min, z_max = z.min(axis=1, keepdims=True), z.max(axis=1, keepdims=True)
+    dz = (z_max - z_min)[:, 0] / n_grid
+    bins = np.minimum(((z - z_min) / dz[:, None]).astype(np.int64), n_grid - 1)
+    flat = (bins + np.arange(n_frames)[:, None] * n_grid).ravel()
+    counts = np.bincount(flat, minlength=n_frames * n_grid).reshape(n_frames, n_grid)
+    sums = (
+        np.bincount(flat, weights=w.real.ravel(), minlength=n_frames * n_grid)
+        + 1j * np.bincount(flat, weights=w.imag.ravel(), minlength=n_frames * n_grid)
+    ).reshape(n_frames, n_grid)
+    profile = sums / np.maximum(counts, 1)
+
+    grid = np.arange(n_grid)
+    for f in np.flatnonzero((counts == 0).any(axis=1)):
+        full = counts[f] > 0
+        profile[f, ~full] = np.interp(grid[~full], grid[full], profile[f, full].real) + 1j * np.interp(
+            grid[~full], grid[full], profile[f, full].imag
+        )
+    return profile, dz
+
+
+def helix_spectrum(w, dz, window, hop=None):
+    """
+    Estimate the helical pitch, radius and handedness in sliding windows
+    along the axis from the peak of the FFT of transverse positions.
+    A right-handed helix rotates counterclockwise as z grows, i.e. its
+    transverse position has a positive spatial frequency.
+
+    Parameters
+    ----------
+    w: np.ndarray
+        An (n_frames, n_grid) complex array, see axial_profile().
+    dz: np.ndarray
+        The bin size of each frame.
+    window: int
+        The window size in bins.
+    hop: int or None
+        The step between windows, window // 2 by default.
+
+    Returns
+    -------
+    result: dict
+        pitch, radius and handedness (+1 right, -1 left),
+        as (n_frames, n_windows) arrays.
+    """
+    hop = window // 2 if hop is None else hop
+    n_windows = (w.shape[1] - window) // hop + 1
+    starts = np.arange(n_windows) * hop
+    segments = w[:, starts[:, None] + np.arange(window)]
+    segments = segments - segments.mean(axis=-1, keepdims=True)
+
+    taper = np.hanning(window)
+    spectrum = np.fft.fft(segments * taper, axis=-1)
+    power = np.abs(spectrum) ** 2
+    power[..., 0] = 0
+    freqs = np.fft.fftfreq(window)
+
+    peak = power.argmax(axis=-1)
+    # parabolic interpolation of the peak on the log power
+    log_p = np.log(power + 1e-300)
+    left = np.take_along_axis(log_p, ((peak - 1) % window)[..., None], -1)[..., 0]
+    mid = np.take_along_axis(log_p, peak[..., None], -1)[..., 0]
+    right = np.take_along_axis(log_p, ((peak + 1) % window)[..., None], -1)[..., 0]
+    denom = left - 2 * mid + right
+    shift = np.where(np.abs(denom) > 0, 0.5 * (left - right) / np.where(denom == 0, 1, denom), 0)
+    freq = freqs[peak] + np.clip(shift, -0.5, 0.5) / window
+
+    amplitude = np.abs(np.take_along_axis(spectrum, peak[..., None], -1)[..., 0]) / taper.sum()
+    with np.errstate(divide="ignore"):
+        pitch = dz[:, None] / np.abs(freq)
+    return dict(pitch=pitch, radius=amplitude, handedness=np.sign(freq).astype(np.int64))
+
+
+def estimate_helix(coords, n_grid=512, window=None, hop=None):
+    """
+    Estimate the helical pitch, radius and handedness of backbone frames,
+    see axial_profile() and helix_spectrum().
+
+    Parameters
+    ----------
+    coords: np.ndarray
+        An (n_frames, n_backbone, 3) array (or a single frame).
+    n_grid: int
+        The number of bins along the axis.
+    window, hop: int or None
+        Sliding windows in bins, the whole axis by default.
+    """
+    coords = np.asarray(coords)
+    single = coords.ndim == 2
+    w, dz = axial_profile(coords[None] if single else coords, n_grid)
+    result = helix_spectrum(w, dz, n_grid if window is None else window, hop)
+    if single:
+        result = {k: v[0] for k, v in result.items()}
+    return result
+
+
+def trajectory_helix(
+    folder, backbone, blocks=slice(None), n_grid=512, window=None, hop=None, chunk=64, use_cache=True
+):
+    """
+    Helix parameters of the backbone over a stored trajectory, reading
+    chunks of frames from the memory-mapped view (see trajstore.TrajectoryView);
+    the result is cached in the run folder.
+
+    Returns
+    -------
+    result: dict
+        blocks, and pitch, radius and handedness as (n_frames, n_windows) arrays.
+    """
+    view = trajstore.TrajectoryView(folder)
+    block_idxs = np.arange(len(view))[blocks]
+    backbone = np.asarray(backbone, dtype=np.int64)
+    params = dict(
+        blocks=view.blocks[block_idxs].tolist(),
+        backbone_md5=hashlib.md5(backbone.tobytes()).hexdigest(),
+        n_grid=n_grid,
+        window=window,
+        hop=hop,
+    )
+
+    def compute():
+        parts = [
+            estimate_helix(view.take(backbone, blocks=block_idxs[i:i + chunk]), n_grid, window, hop)
+            for i in range(0, len(block_idxs), chunk)
+        ]
+        result = {k: np.concatenate([p[k] for p in parts]) for k in parts[0]}
+        result["blocks"] = view.blocks[block_idxs]
+        return result
+
+    if not use_cache:
+        return compute()
+    return cache.cached(view.folder, "helix", params, compute)
@@ -0,0 +1,166 @@
+import hashlib
+
+import numpy as np
+
+from .. import conformations, trajstore
+from . import cache
+
+
+def loop_parents(loops):
+    """
+    The index of the enclosing loop of each loop one level up,
+    or -1 for root loops.
+    """
+    loops = np.sort(np.asarray(loops, dtype=np.int64).reshape(-1, 2), axis=1)
+    depths = conformations.loop_depths(loops)
+    parents = np.full(len(loops), -1, dtype=np.int64)
+    for depth in range(1, depths.max() + 1 if len(loops) else 1):
+        outer = np.flatnonzero(depths == depth - 1)
+        outer = outer[np.argsort(loops[outer, 0])]
+        inner = np.flatnonzero(depths == depth)
+        # loops of the same depth do not overlap
+        parents[inner] = outer[np.searchsorted(loops[outer, 0], loops[inner, 0], side="right") - 1]
+    return parents
+
+
+def _interval_sums(cs, loops):
+    """Sums over [start, end] from a cumulative sum along axis 1 with a leading zero."""
+    return cs[:, loops[:, 1] + 1] - cs[:, loops[:, 0]]
+
+
+def loop_stats(coords, loops, exclude_nested=False):
+    """
+    Per-loop statistics of frames of a loop brush, vectorized over loops
+    and frames with cumulative sums along the chain and reduceat over
+    the (non-overlapping) loops of each layer.
+
+    Parameters
+    ----------
+    coords: np.ndarray
+        An (n_frames, N, 3) array (or a single frame).
+    loops: np.ndarray
+        An (n_loops, 2) array of loops.
+    exclude_nested: bool
+        If True, the gyration radius of a loop is computed over its own
+        particles, excluding its nested loops.
+
+    Returns
+    -------
+    stats: dict
+        (n_frames, n_loops) arrays of
+        rg: the radius of gyration,
+        base_dist: the distance between the loop bases,
+        tip_dist: the distance from the middle of the bases to the middle particle,
+        extension: the max distance from the middle of the bases to a loop particle,
+        and spacing: the distance from the end of a loop to the start of
+        the next loop of the same layer (nan for the last loop of a layer).
+    """
+    coords = np.asarray(coords, dtype=np.float64)
+    single = coords.ndim == 2
+    X = coords[None] if single else coords
+    X = X - X.mean(axis=1, keepdims=True)
+    loops = np.sort(np.asarray(loops, dtype=np.int64).reshape(-1, 2), axis=1)
+    n_frames, n_loops = X.shape[0], len(loops)
+
+    zero = np.zeros((n_frames, 1))
+    cs1 = np.concatenate([np.zeros((n_frames, 1, 3)), np.cumsum(X, axis=1)], axis=1)
+    cs2 = np.concatenate([zero, np.cumsum((X * X).sum(axis=-1), axis=1)], axis=1)
+    s1, s2 = _interval_sums(cs1, loops), _interval_sums(cs2, loops)
+    n = (loops[:, 1] - loops[:, 0] + 1).astype(float)
+
+    if exclude_nested:
+        parents = loop_parents(loops)
+        nested = parents >= 0
+        for arr, vals in [(s1, s1[:, nested]), (s2, s2[:, nested])]:
+            np.subtract.at(arr, (slice(None), parents[nested]), vals)
+        n = n - np.bincount(parents[nested], weights=n[nested], minlength=n_loops)
+
+    mean = s1 / n[:, None]
+    rg = np.sqrt(np.maximum(s2 / n - (mean * mean).sum(axis=-1), 0))
+
+    base_a, base_b = X[:, loops[:, 0]], X[:, loops[:, 1]]
+    mid = (base_a + base_b) / 2
+    base_dist = np.linalg.norm(base_b - base_a, axis=-1)
+    tip_dist = np.linalg.norm(X[:, (loops[:, 0] + loops[:, 1]) // 2] - mid, axis=-1)
+
+    extension = np.zeros((n_frames, n_loops))
+    spacing = np.full((n_frames, n_loops), np.nan)
+    depths = conformations.loop_depths(loops)
+    for depth in np.unique(depths):
+        layer = np.flatnonzero(depths == depth)
+        layer = layer[np.argsort(loops[layer, 0])]
+        starts, ends = loops[layer, 0], loops[layer, 1]
+
+        # particles of the layer and their loops
+        lens = ends - starts + 1
+        owner = np.repeat(np.arange(len(layer)), lens)
+        particles = np.repeat(starts - np.r_[0, np.cumsum(lens)[:-1]], lens) + np.arange(lens.sum())
+        dist = np.linalg.norm(X[:, particles] - mid[:, layer[owner]], axis=-1)
+        extension[:, layer] = np.maximum.reduceat(dist, np.r_[0, np.cumsum(lens)[:-1]], axis=1)
+
+        spacing[:, layer[:-1]] = np.linalg.norm(X[:, starts[1:]] - X[:, ends[:-1]], axis=-1)
+
+    stats = dict(rg=rg, base_dist=base_dist, tip_dist=tip_dist, extension=extension, spacing=spacing)
+    if single:
+        stats = {k: v[0] for k, v in stats.items()}
+    return stats
+
+
+def per_layer(stats, loops):
+    """
+    Average per-loop statistics over the loops of each layer (nesting depth),
+    returning (..., n_layers) arrays; nan values are ignored.
+    """
+    depths = conformations.loop_depths(loops)
+    n_layers = depths.max() + 1 if len(depths) else 0
+    out = {}
+    for key, vals in stats.items():
+        vals = np.atleast_2d(vals)
+        valid = ~np.isnan(vals)
+        sums = np.stack([np.bincount(depths, weights=np.where(valid[f], vals[f], 0), minlength=n_layers)
+                         for f in range(len(vals))])
+        counts = np.stack([np.bincount(depths, weights=valid[f], minlength=n_layers) for f in range(len(vals))])
+        with np.errstate(invalid="ignore"):
+            out[key] = (sums / counts).reshape(np.shape(stats[key])[:-1] + (n_layers,))
+    return out
+
+
+def trajectory_loop_stats(folder, loops, blocks=slice(None), exclude_nested=False, chunk=16, use_cache=True):
+    """
+    Per-loop and per-layer statistics over a stored trajectory, read in
+    chunks of frames from the memory-mapped view (see
+    trajstore.TrajectoryView) and cached in the run folder.
+
+    Returns
+    -------
+    result: dict
+        blocks, per-loop (n_frames, n_loops) arrays (see loop_stats())
+        and per-layer (n_frames, n_layers) arrays with the prefix "layer_".
+    """
+    view = trajstore.TrajectoryView(folder)
+    block_idxs = np.arange(len(view))[blocks]
+    loops = np.sort(np.asarray(loops, dtype=np.int64).reshape(-1, 2), axis=1)
+    params = dict(
+        blocks=view.blocks[block_idxs].tolist(),
+        loops_md5=hashlib.md5(loops.tobytes()).hexdigest(),
+        exclude_nested=exclude_nested,
+    )
+
+    # only the particles spanned by loops are read, loops are given
+    # by simulation indices of particles rather than by rows of the view
+    first = int(loops.min()) if len(loops) else 0
+    particles = np.arange(first, int(loops.max()) + 1 if len(loops) else 0)
+
+    def compute():
+        parts = [
+            loop_stats(view.take(particles, block_idxs[i:i + chunk]), loops - first, exclude_nested)
+            for i in range(0, len(block_idxs), chunk)
+        ]
+        result = {k: np.concatenate([p[k] for p in parts]) for k in parts[0]}
+        result.update({f"layer_{k}": v for k, v in per_layer(result, loops).items()})
+        result["blocks"] = view.blocks[block_idxs]
+        return result
+
+    if not use_cache:
+        return compute()
+    return cache.cached(view.folder, "loopstats", params, compute)
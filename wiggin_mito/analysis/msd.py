@@ -0,0 +1,185 @@
+import numpy as np
+
+from .. import conformations, trajstore
+from . import cache
+
+
+def loop_layers(N, loops):
+    """
+    The layer of each particle: the nesting depth of the innermost loop
+    that contains it (0 for root loops), or -1 for the backbone.
+    """
+    loops = np.sort(np.asarray(loops, dtype=np.int64).reshape(-1, 2), axis=1)
+    depths = conformations.loop_depths(loops)
+    layers = np.full(N, -1, dtype=np.int64)
+    for depth in np.unique(depths):
+        layer_loops = loops[depths == depth]
+        cover = np.zeros(N + 1, dtype=np.int64)
+        np.add.at(cover, layer_loops[:, 0], 1)
+        np.add.at(cover, layer_loops[:, 1] + 1, -1)
+        layers[np.cumsum(cover[:-1]) > 0] = depth
+    return layers
+
+
+def loop_tips(loops):
+    """
+    The midpoints of loops, i.e. the particles farthest from loop bases
+    along the chain.
+    """
+    loops = np.asarray(loops, dtype=np.int64).reshape(-1, 2)
+    return np.unique((loops[:, 0] + loops[:, 1]) // 2)
+
+
+def particle_groups(N, loops=None, backbone=None, names=("backbone", "tips", "loop_bases", "loop_layers")):
+    """
+    Indices of particles in standard groups of a loop brush:
+    "all", "backbone", "tips" (the chain ends), "loop_bases",
+    "loop_tips" (the midpoints of loops), "loop_tips_layers", which is
+    expanded into loop_tips_0, loop_tips_1, etc by the nesting depth of
+    loops, and "loop_layers", which is expanded into loop_layer_0,
+    loop_layer_1, etc, see loop_layers().
+    """
+    groups = {}
+    for name in names:
+        if name == "all":
+            groups[name] = np.arange(N)
+        elif name == "backbone" and backbone is not None:
+            groups[name] = np.asarray(backbone, dtype=np.int64)
+        elif name == "tips":
+            groups[name] = np.array([0, N - 1])
+        elif name == "loop_bases" and loops is not None and len(loops):
+            groups[name] = np.unique(np.asarray(loops, dtype=np.int64))
+        elif name == "loop_tips" and loops is not None and len(loops):
+            groups[name] = loop_tips(loops)
+        elif name == "loop_tips_layers" and loops is not None and len(loops):
+            sorted_loops = np.sort(np.asarray(loops, dtype=np.int64).reshape(-1, 2), axis=1)
+            depths = conformations.loop_depths(sorted_loops)
+            for depth in np.unique(depths):
+                groups[f"loop_tips_{depth}"] = loop_tips(sorted_loops[depths == depth])
+        elif name == "loop_layers" and loops is not None and len(loops):
+            layers = loop_layers(N, loops)
+            for depth in np.unique(layers[layers >= 0]):
+                groups[f"loop_layer_{depth}"] = np.flatnonzero(layers == depth)
+    return groups
+
+
+class MultiTauMSD:
+    """
+    An online multi-tau correlator of the mean squared displacement of
+    particle groups.
+
+    Level l keeps the last p frames sampled every m**l frames and measures
+    displacements at lags of k * m**l frames, k < p (k >= p/m for l > 0,
+    shorter lags are covered by the previous level). Memory grows as
+    O(p * log_m(T)) frames of the tracked particles and the cost per
+    frame is O(p) displacements amortized. Frames are decimated, not
+    averaged, so the estimate of the MSD at each lag is unbiased.
+
+    Parameters
+    ----------
+    groups: dict
+        Group names mapped to arrays of particle indices.
+    p: int
+        The number of frames per level.
+    m: int
+        The decimation factor between levels.
+    max_levels: int
+        The max number of levels.
+    """
+
+    def __init__(self, groups, p=16, m=2, max_levels=32):
+        if p % m:
+            raise ValueError("p must be divisible by m")
+        self.p, self.m, self.max_levels = p, m, max_levels
+        self.names = list(groups)
+        self.tracked, inverse = np.unique(
+            np.concatenate([np.asarray(groups[n], dtype=np.int64) for n in self.names]),
+            return_inverse=True,
+        )
+        sizes = np.cumsum([0] + [len(groups[n]) for n in self.names])
+        self._rows = [inverse[a:b] for a, b in zip(sizes[:-1], sizes[1:])]
+
+        self.n_frames = 0
+        self._buffers = []  # a list of per-level lists of the last frames
+        self._sums = np.zeros((max_levels, p, len(self.names)))
+        self._counts = np.zeros((max_levels, p))
+
+    def _push(self, level, frame):
+        if level >= self.max_levels:
+            return
+        if level == len(self._buffers):
+            self._buffers.append([])
+        buf = self._buffers[level]
+
+        k_min = 1 if level == 0 else self.p // self.m
+        lags = np.arange(k_min, min(self.p, len(buf) + 1))
+        if len(lags):
+            past = np.stack([buf[-k] for k in lags])
+            sq = ((frame[None] - past) ** 2).sum(axis=-1)
+            for g, rows in enumerate(self._rows):
+                self._sums[level, lags, g] += sq[:, rows].mean(axis=1)
+            self._counts[level, lags] += 1
+
+        buf.append(frame)
+        if len(buf) > self.p:
+            buf.pop(0)
+
+    def add(self, coords):
+        frame = np.asarray(coords, dtype=np.float64)[self.tracked]
+        level, stride = 0, 1
+        while (level < self.max_levels) and (self.n_frames % stride == 0):
+            self._push(level, frame)
+            level, stride = level + 1, stride * self.m
+        self.n_frames += 1
+
+    def result(self, dt=1.0):
+        """
+        Returns
+        -------
+        result: dict
+            lags (in units of dt) and the MSD of each group.
+        """
+        k = np.arange(self.p)
+        lags, sums, counts = [], [], []
+        for level in range(len(self._buffers)):
+            k_min = 1 if level == 0 else self.p // self.m
+            sel = (k >= k_min) & (self._counts[level] > 0)
+            lags.append(k[sel] * self.m ** level)
+            sums.append(self._sums[level, sel])
+            counts.append(self._counts[level, sel])
+        lags = np.concatenate(lags) if lags else np.zeros(0)
+        msd = np.concatenate(sums) / np.concatenate(counts)[:, None] if lags.size else np.zeros((0, len(self.names)))
+        out = {name: msd[:, g] for g, name in enumerate(self.names)}
+        out["lags"] = lags * dt
+        return out
+
+
+def trajectory_msd(folder, groups, blocks=slice(None), p=16, m=2, use_cache=True):
+    """
+    MSD of particle groups from a stored trajectory (see
+    trajstore.TrajectoryView), with lags in blocks. The tracked particles
+    are decoded block by block; the result is cached in the run folder.
+    """
+    view = trajstore.TrajectoryView(folder)
+    block_idxs = np.arange(len(view))[blocks]
+    params = dict(
+        blocks=view.blocks[block_idxs].tolist(),
+        groups={n: np.asarray(g).tolist() for n, g in groups.items()},
+        p=p,
+        m=m,
+    )
+
+    def compute():
+        correlator = MultiTauMSD(groups, p=p, m=m)
+        rows = view.rows_of(correlator.tracked)
+        tracked = np.arange(len(correlator.tracked))
+        correlator.tracked = tracked
+        for i in block_idxs:
+            correlator.add(view[i, rows])
+        # blocks may be stored with a stride
+        dt = np.median(np.diff(view.blocks[block_idxs])) if len(block_idxs) > 1 else 1
+        return correlator.result(dt=dt)
+
+    if not use_cache:
+        return compute()
+    return cache.cached(view.folder, "msd", params, compute)
@@ -0,0 +1,177 @@
+import glob
+import logging
+import os
+
+import numpy as np
+
+from .. import sidecar, trajstore
+from . import cache, helix, msd
+
+
+def type_groups(particle_types):
+    """Groups of particles of each type, named type_0, type_1, etc."""
+    particle_types = np.asarray(particle_types)
+    return {f"type_{t}": np.flatnonzero(particle_types == t) for t in np.unique(particle_types)}
+
+
+def run_groups(folder, names=("all", "backbone", "loop_layers")):
+    """
+    Particle groups of a finished run (see msd.particle_groups() and
+    type_groups()), using the loops, the backbone and the particle types
+    stored in the sidecar arrays of the shared config by the loop actions
+    and RandomBlockParticleTypes. Raises ValueError if the run has no
+    stored loops.
+    """
+    arrays = {}
+    for key in ["loops", "backbone", "particle_types"]:
+        try:
+            arrays[key] = np.asarray(sidecar.load_shared_array(folder, key))
+        except FileNotFoundError:
+            arrays[key] = None
+    if arrays["loops"] is None:
+        raise ValueError(f"The run in {folder} has no stored loops")
+
+    N = int(trajstore.TrajectoryView(folder).particles.max()) + 1
+    groups = msd.particle_groups(N, arrays["loops"], arrays["backbone"], names)
+    if arrays["particle_types"] is not None:
+        groups.update(type_groups(arrays["particle_types"]))
+    return groups
+
+
+class ProfileAccumulator:
+    """
+    A streaming estimator of radial and axial density profiles of particle
+    groups around the chromosome axis. The axis of each frame is the
+    principal axis of the backbone (or of all particles), passing through
+    its center. Each particle is projected onto the axis once, even if it
+    belongs to several groups; (r, z) histograms of groups are accumulated
+    with a vectorized bincount per group and batch of frames.
+
+    Parameters
+    ----------
+    groups: dict
+        Group names mapped to arrays of particle indices.
+    r_bins, z_bins: np.ndarray
+        Bin edges of the distance to the axis and of the position
+        along the axis (relative to the center).
+    """
+
+    def __init__(self, groups, r_bins, z_bins):
+        self.names = list(groups)
+        self.r_bins, self.z_bins = np.asarray(r_bins, float), np.asarray(z_bins, float)
+        group_particles = [np.asarray(groups[n], dtype=np.int64) for n in self.names]
+        # the positions of group particles among all projected particles
+        self._particles, positions = np.unique(
+            np.concatenate(group_particles + [np.zeros(0, dtype=np.int64)]), return_inverse=True)
+        self._positions = np.split(positions, np.cumsum([len(g) for g in group_particles])[:-1])
+        self.n_frames = 0
+        self.counts = np.zeros((len(self.names), len(self.r_bins) - 1, len(self.z_bins) - 1))
+
+    def add(self, coords, axis_particles=None):
+        """
+        Add a frame or an (n_frames, N, 3) batch of frames. The axis is
+        estimated from axis_particles (e.g. the backbone), all by default.
+        """
+        X = np.asarray(coords, dtype=np.float64)
+        X = X[None] if X.ndim == 2 else X
+        ref = X if axis_particles is None else X[:, axis_particles]
+        axes = helix.principal_axes(ref)
+        center = ref.mean(axis=1, keepdims=True)
+
+        P = X[:, self._particles] - center
+        z = np.einsum("fni,fi->fn", P, axes[:, 0])
+        r = np.sqrt(np.maximum(np.einsum("fni,fni->fn", P, P) - z ** 2, 0))
+        del P
+
+        n_r, n_z = len(self.r_bins) - 1, len(self.z_bins) - 1
+        ri = np.searchsorted(self.r_bins, r, side="right") - 1
+        zi = np.searchsorted(self.z_bins, z, side="right") - 1
+        valid = (ri >= 0) & (ri < n_r) & (zi >= 0) & (zi < n_z)
+        keys = np.where(valid, ri * n_z + zi, -1)
+        for g, positions in enumerate(self._positions):
+            group_keys = keys[:, positions]
+            self.counts[g] += np.bincount(
+                group_keys[group_keys >= 0], minlength=n_r * n_z).reshape(n_r, n_z)
+        self.n_frames += len(X)
+
+    def result(self):
+        """
+        Returns
+        -------
+        result: dict
+            r_bins, z_bins, and for each group: the (r, z) histogram per
+            frame (hist_<group>), the number density in cylindrical shells
+            vs r (radial_<group>) and the linear density vs z (axial_<group>).
+        """
+        n = max(self.n_frames, 1)
+        shell_areas = np.pi * np.diff(self.r_bins ** 2)
+        dz = np.diff(self.z_bins)
+        out = dict(r_bins=self.r_bins, z_bins=self.z_bins, n_frames=np.array(self.n_frames))
+        for g, name in enumerate(self.names):
+            hist = self.counts[g] / n
+            out[f"hist_{name}"] = hist
+            out[f"radial_{name}"] = hist.sum(axis=1) / shell_areas / dz.sum()
+            out[f"axial_{name}"] = hist.sum(axis=0) / dz
+        return out
+
+
+def trajectory_profiles(
+    folder, groups, r_bins, z_bins, axis_group="backbone", blocks=slice(None), chunk=16, use_cache=True
+):
+    """
+    Density profiles of particle groups over a stored trajectory, read in
+    chunks of frames from the memory-mapped view (see trajstore.TrajectoryView)
+    and cached in the run folder.
+    """
+    view = trajstore.TrajectoryView(folder)
+    block_idxs = np.arange(len(view))[blocks]
+    params = dict(
+        blocks=view.blocks[block_idxs].tolist(),
+        groups={n: np.asarray(g).tolist() for n, g in groups.items()},
+        r_bins=np.asarray(r_bins).tolist(),
+        z_bins=np.asarray(z_bins).tolist(),
+        axis_group=axis_group,
+    )
+
+    def compute():
+        # groups are given by simulation indices of particles, only the
+        # particles of groups are read and groups are mapped onto them
+        particles = np.unique(np.concatenate(
+            [np.asarray(g, dtype=np.int64) for g in groups.values()] + [np.zeros(0, dtype=np.int64)]))
+        local_groups = {n: np.searchsorted(particles, g) for n, g in groups.items()}
+        acc = ProfileAccumulator(local_groups, r_bins, z_bins)
+        axis_particles = local_groups.get(axis_group)
+        for i in range(0, len(block_idxs), chunk):
+            acc.add(view.take(particles, block_idxs[i:i + chunk]), axis_particles)
+        return acc.result()
+
+    if not use_cache:
+        return compute()
+    return cache.cached(view.folder, "profiles", params, compute)
+
+
+def sweep_profiles(root_folder, r_bins, z_bins, groups=None, **kwargs):
+    """
+    Density profiles of all runs with stored trajectories in the run
+    folders of a sweep, one run at a time.
+
+    Parameters
+    ----------
+    groups: callable or None
+        Takes a run folder and returns its particle groups, run_groups() by default.
+
+    Returns
+    -------
+    profiles: dict
+        Run folder names mapped to the results of trajectory_profiles().
+    """
+    groups = run_groups if groups is None else groups
+    profiles = {}
+    for folder in sorted(glob.glob(os.path.join(root_folder, "*", ""))):
+        try:
+            run_groups_ = groups(folder)
+            profiles[os.path.basename(os.path.normpath(folder))] = trajectory_profiles(
+                folder, run_groups_, r_bins, z_bins, **kwargs)
+        except ValueError as e:
+            logging.info(f"Skipping {folder}: {e}")
+    return profiles
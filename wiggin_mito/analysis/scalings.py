@@ -0,0 +1,187 @@
+import numpy as np
+
+from .. import trajstore
+from . import cache, contacts
+
+
+def log_bins(s_max, s_min=1, bins_per_decade=10):
+    """
+    Integer edges of logarithmic bins of genomic separations,
+    [s_min, s_max]; duplicate edges of small separations are merged.
+    """
+    n = int(np.ceil(np.log10(s_max / s_min) * bins_per_decade)) + 1
+    return np.unique(np.round(np.geomspace(s_min, s_max + 1, n)).astype(np.int64))
+
+
+def pair_counts(particle_ids, N):
+    """
+    The number of pairs of particles at each separation s = 0..N-1,
+    computed as the autocorrelation of the indicator of particle_ids.
+    """
+    indicator = np.zeros(N)
+    indicator[np.asarray(particle_ids)] = 1
+    n_fft = 1 << int(np.ceil(np.log2(2 * N)))
+    f = np.fft.rfft(indicator, n_fft)
+    return np.round(np.fft.irfft(f * np.conj(f), n_fft)[:N]).astype(np.int64)
+
+
+class ScalingAccumulator:
+    """
+    A streaming estimator of the contact probability P(s) and the mean
+    distance R(s) vs genomic separation s in logarithmic bins.
+    Memory does not depend on the number of frames.
+
+    P(s) is the number of contacts found by the cell list (see
+    contacts.iter_contact_chunks) at separations within a bin, divided
+    by the number of pairs at these separations.
+
+    R(s) is estimated from a fixed number of pairs per bin and frame:
+    separations are drawn within the bin with the weights of their numbers
+    of pairs (so that R matches the mean s of the bin) and pairs start at
+    evenly strided positions along the chain with a random phase, which
+    has a lower variance than independent sampling of positions.
+
+    Parameters
+    ----------
+    N: int
+        The number of particles of the chain.
+    bins: np.ndarray or None
+        Bin edges of separations, log_bins(N - 1) by default.
+    particle_ids: np.ndarray or None
+        The indices of particles present in the frames (e.g. the backbone).
+    n_samples: int
+        The number of sampled pairs per bin and frame for R(s).
+    seed: int or None
+        The seed of pair sampling.
+    """
+
+    def __init__(self, N, bins=None, particle_ids=None, n_samples=1000, seed=None):
+        self.N = N
+        self.bins = log_bins(N - 1) if bins is None else np.asarray(bins)
+        self.particle_ids = np.arange(N) if particle_ids is None else np.asarray(particle_ids)
+        self.n_samples = n_samples
+        self._rng = np.random.default_rng(seed)
+
+        n_bins = len(self.bins) - 1
+        per_s = pair_counts(self.particle_ids, N)
+        s = np.arange(N)
+        in_range = (s >= self.bins[0]) & (s < self.bins[-1])
+        bin_idx = np.searchsorted(self.bins, s[in_range], side="right") - 1
+        self._pairs_cdf = np.cumsum(per_s)
+        self._pairs_per_bin = np.bincount(bin_idx, weights=per_s[in_range], minlength=n_bins)
+        self._s_mean = (
+            np.bincount(bin_idx, weights=(per_s * s)[in_range], minlength=n_bins)
+            / np.maximum(self._pairs_per_bin, 1)
+        )
+
+        self.n_frames = 0
+        self.n_frames_R = 0
+        self._contacts = np.zeros(n_bins)
+        self._R_sum = np.zeros(n_bins)
+        self._R2_sum = np.zeros(n_bins)
+        self._R_n = np.zeros(n_bins)
+
+    def _bin(self, s):
+        idx = np.searchsorted(self.bins, s, side="right") - 1
+        valid = (s >= self.bins[0]) & (s < self.bins[-1])
+        return idx[valid], valid
+
+    def add_contacts(self, coords, cutoff, box=None):
+        for i, j in contacts.iter_contact_chunks(coords, cutoff, box=box):
+            idx, _ = self._bin(self.particle_ids[j] - self.particle_ids[i])
+            self._contacts += np.bincount(idx, minlength=len(self._contacts))
+        self.n_frames += 1
+
+    def add_distances(self, coords):
+        """
+        Accumulate sampled distances. The rows of coords must be
+        consecutive particles of the chain (particle_ids=None).
+        Coordinates must not be wrapped into the periodic box (polychrom
+        stores unwrapped ones): R(s) is the distance along the unwrapped
+        chain, not the minimum image distance used for contacts.
+        """
+        n = len(coords)
+        for b, (lo, hi) in enumerate(zip(self.bins[:-1], self.bins[1:])):
+            hi = min(hi, n)
+            if lo >= hi:
+                continue
+            cdf_lo, cdf_hi = self._pairs_cdf[lo - 1] if lo > 0 else 0, self._pairs_cdf[hi - 1]
+            s = np.searchsorted(
+                self._pairs_cdf, cdf_lo + self._rng.random(self.n_samples) * (cdf_hi - cdf_lo),
+                side="right")
+            n_starts = n - s
+            phase = self._rng.random()
+            i = (np.mod(phase + np.arange(self.n_samples) / self.n_samples, 1) * n_starts).astype(np.int64)
+            d = coords[i + s] - coords[i]
+            R = np.sqrt((d * d).sum(axis=1))
+            self._R_sum[b] += R.sum()
+            self._R2_sum[b] += (R * R).sum()
+            self._R_n[b] += len(R)
+        self.n_frames_R += 1
+
+    def result(self):
+        with np.errstate(invalid="ignore", divide="ignore"):
+            R = self._R_sum / self._R_n
+            R_sem = np.sqrt(np.maximum(self._R2_sum / self._R_n - R * R, 0) / self._R_n)
+            P = self._contacts / self._pairs_per_bin / max(self.n_frames, 1)
+        return dict(
+            bins=self.bins,
+            s=self._s_mean,
+            P=P,
+            R=R,
+            R_sem=R_sem,
+            n_frames=np.array(self.n_frames),
+        )
+
+
+def trajectory_scalings(
+    folder,
+    cutoff=1.5,
+    box=None,
+    blocks=slice(None),
+    bins_per_decade=10,
+    n_samples=1000,
+    seed=0,
+    use_cache=True,
+):
+    """
+    P(s) and R(s) of a stored trajectory (see trajstore.TrajectoryView),
+    streamed block by block and cached in the run folder.
+
+    Returns
+    -------
+    result: dict
+        bins, s (the mean separation in each bin), P, R, R_sem, n_frames.
+    """
+    view = trajstore.TrajectoryView(folder)
+    block_idxs = np.arange(len(view))[blocks]
+    params = dict(
+        blocks=view.blocks[block_idxs].tolist(),
+        cutoff=cutoff,
+        box=None if box is None else list(box),
+        R_unwrapped=True,
+        bins_per_decade=bins_per_decade,
+        n_samples=n_samples,
+        seed=seed,
+    )
+
+    def compute():
+        N = int(view.particles.max()) + 1
+        acc = ScalingAccumulator(
+            N,
+            bins=log_bins(N - 1, bins_per_decade=bins_per_decade),
+            particle_ids=view.particles,
+            n_samples=n_samples,
+            seed=seed,
+        )
+        contiguous = np.array_equal(view.particles, np.arange(N))
+        for i in block_idxs:
+            coords = view[i]
+            acc.add_contacts(coords, cutoff, box=box)
+            if contiguous:
+                acc.add_distances(coords)
+        return acc.result()
+
+    if not use_cache:
+        return compute()
+    return cache.cached(view.folder, "scalings", params, compute)
@@ -0,0 +1,232 @@
+import glob
+import json
+import logging
+import os
+import random
+import shutil
+
+import numpy as np
+
+from polychrom.forces import openmm
+
+try:
+    import openmm.unit as units
+except ImportError:
+    import simtk.unit as units
+
+
+CHECKPOINT_FOLDER = "checkpoint"
+CHECKPOINT_FILE = "checkpoint.npz"
+STASH_FOLDER = "stashed_output"
+
+
+def checkpoint_path(folder):
+    """
+    The default path of the checkpoint of a simulation. The checkpoint is
+    stored in a subfolder, since reporters may clean the simulation folder.
+    """
+    return os.path.join(folder, CHECKPOINT_FOLDER, CHECKPOINT_FILE)
+
+
+def register_state(sim, name, get_state, set_state):
+    """
+    Register a piece of state of an action (e.g. the progress of
+    an adaptive schedule) to be stored in checkpoints.
+
+    Parameters
+    ----------
+    sim: polychrom.simulation.Simulation
+    name: str
+        A unique name of the state, e.g. the name of the action.
+    get_state: callable
+        Returns a JSON-serializable state.
+    set_state: callable
+        Restores the state returned by get_state().
+    """
+    if not hasattr(sim, "wm_checkpoint_hooks"):
+        sim.wm_checkpoint_hooks = {}
+    sim.wm_checkpoint_hooks[name] = (get_state, set_state)
+
+
+def stash_output(folder):
+    """
+    Move the output files of a simulation (but not subfolders) into
+    a subfolder of the checkpoint folder, so that they survive reporters
+    that clean the simulation folder when a simulation is resumed.
+    """
+    stash = os.path.join(folder, CHECKPOINT_FOLDER, STASH_FOLDER)
+    os.makedirs(stash, exist_ok=True)
+    for path in glob.glob(os.path.join(folder, "*")):
+        if os.path.isfile(path):
+            os.replace(path, os.path.join(stash, os.path.basename(path)))
+
+
+def unstash_output(folder):
+    """
+    Move the files stashed by stash_output() back into the simulation
+    folder; files created since then (e.g. the new config) are kept.
+    """
+    stash = os.path.join(folder, CHECKPOINT_FOLDER, STASH_FOLDER)
+    if not os.path.isdir(stash):
+        return
+    for path in glob.glob(os.path.join(stash, "*")):
+        dest = os.path.join(folder, os.path.basename(path))
+        if not os.path.exists(dest):
+            os.replace(path, dest)
+    shutil.rmtree(stash)
+
+
+def iter_hdf5_reporters(reporters):
+    """
+    Iterate over polychrom HDF5 reporters, including those wrapped by
+    the reporters of wiggin_mito.reporters.
+    """
+    for reporter in reporters:
+        if reporter is None:
+            continue
+        if hasattr(reporter, "counter") and hasattr(reporter, "folder"):
+            yield reporter
+        yield from iter_hdf5_reporters(getattr(reporter, "replica_reporters", []))
+        yield from iter_hdf5_reporters(
+            [
+                getattr(reporter, attr, None)
+                for attr in ["reporter", "common_reporter", "full_reporter", "subset_reporter"]
+            ]
+        )
+
+
+def reporter_counters(reporters):
+    """
+    The number of blocks reported to each HDF5 reporter, by folder.
+    """
+    return {r.folder: int(r.counter.get("data", 0)) for r in iter_hdf5_reporters(reporters)}
+
+
+def set_reporter_counters(reporters, counters):
+    """
+    Continue the block files of HDF5 reporters from the counters returned
+    by reporter_counters(); files of blocks reported after the counters
+    were taken (i.e. after the checkpoint) are deleted.
+    """
+    for reporter in iter_hdf5_reporters(reporters):
+        if reporter.folder not in counters:
+            continue
+        n_blocks = counters[reporter.folder]
+        reporter.counter["data"] = n_blocks
+        reporter.datas = {}
+        for path in glob.glob(os.path.join(reporter.folder, "blocks_*-*.h5")):
+            first = os.path.basename(path)[len("blocks_"):].split("-")[0]
+            if int(first) >= n_blocks:
+                os.remove(path)
+
+
+def _rng_states():
+    np_state = np.random.get_state()
+    return (
+        np.asarray(np_state[1]),
+        dict(
+            np_state=[np_state[0], int(np_state[2]), int(np_state[3]), float(np_state[4])],
+            py_state=list(random.getstate()),
+        ),
+    )
+
+
+def _set_rng_states(np_keys, meta):
+    name, pos, has_gauss, cached_gaussian = meta["np_state"]
+    np.random.set_state((name, np_keys, pos, has_gauss, cached_gaussian))
+    version, internal_state, gauss_next = meta["py_state"]
+    random.setstate((version, tuple(internal_state), gauss_next))
+
+
+def save_checkpoint(sim, path, extra=None):
+    """
+    Save the dynamic state of a running simulation: positions, velocities,
+    the PBC box, time, block and step counters, context parameters,
+    RNG states and the states registered with register_state().
+    The file is replaced atomically, so that a checkpoint interrupted
+    by a kill does not corrupt the previous one.
+    """
+    state = sim.context.getState(
+        getPositions=True, getVelocities=True, getParameters=True
+    )
+    positions = np.asarray(state.getPositions(asNumpy=True) / sim.conlen)
+    velocities = np.asarray(
+        state.getVelocities(asNumpy=True).value_in_unit(
+            units.nanometer / units.picosecond
+        )
+    )
+    box = np.asarray(
+        state.getPeriodicBoxVectors(asNumpy=True).value_in_unit(units.nanometer)
+    )
+
+    np_keys, rng_meta = _rng_states()
+    hooks = getattr(sim, "wm_checkpoint_hooks", {})
+    meta = dict(
+        block=int(sim.block),
+        step=int(sim.step),
+        time=float(state.getTime().value_in_unit(units.picosecond)),
+        parameters={k: float(v) for k, v in state.getParameters().items()},
+        rng=rng_meta,
+        action_states={name: get() for name, (get, _) in hooks.items()},
+        extra={} if extra is None else extra,
+    )
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = path + ".tmp.npz"
+    np.savez(
+        tmp_path,
+        positions=positions,
+        velocities=velocities,
+        box=box,
+        np_rng_keys=np_keys,
+        meta=np.array(json.dumps(meta)),
+    )
+    os.replace(tmp_path, path)
+    logging.info(f"Checkpoint of block {sim.block} saved to {path}")
+
+
+def load_checkpoint(path):
+    """
+    Load a checkpoint as a dict of arrays (positions, velocities, box,
+    np_rng_keys) and metadata (block, step, time, parameters, etc).
+    """
+    with np.load(path) as f:
+        checkpoint = {k: f[k] for k in ["positions", "velocities", "box", "np_rng_keys"]}
+        checkpoint.update(json.loads(str(f["meta"])))
+    return checkpoint
+
+
+def load_positions(path):
+    with np.load(path) as f:
+        return f["positions"]
+
+
+def restore_checkpoint(sim, checkpoint):
+    """
+    Restore the state saved by save_checkpoint() into a simulation,
+    whose forces have been applied (i.e. the context exists).
+    """
+    sim.context.setPeriodicBoxVectors(
+        *[openmm.Vec3(*vec) * units.nanometer for vec in checkpoint["box"].tolist()]
+    )
+    sim.context.setPositions(checkpoint["positions"] * sim.conlen)
+    sim.context.setVelocities(
+        units.Quantity(checkpoint["velocities"], units.nanometer / units.picosecond)
+    )
+    sim.context.setTime(checkpoint["time"] * units.picosecond)
+    for name, val in checkpoint["parameters"].items():
+        sim.context.setParameter(name, val)
+
+    sim.block = checkpoint["block"]
+    sim.step = checkpoint["step"]
+
+    _set_rng_states(checkpoint["np_rng_keys"], checkpoint["rng"])
+
+    hooks = getattr(sim, "wm_checkpoint_hooks", {})
+    for name, action_state in checkpoint["action_states"].items():
+        if name in hooks:
+            hooks[name][1](action_state)
+        else:
+            logging.warning(f"No action to restore the checkpointed state {name}")
+
+    logging.info(f"Simulation restored from the checkpoint of block {sim.block}")
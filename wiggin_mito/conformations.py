@@ -2,13 +2,137 @@ import looplib.looptools
 import numpy as np
 
 import polychrom
+import polychrom.hdf5_format
 import polychrom.starting_conformations
 
+from . import simutils
+
 
 def norm(vector):
     return np.sqrt(np.dot(vector, vector))
 
 
+class LazyConformation:
+    """
+    A handle to a conformation that is generated only when its coordinates
+    are requested, e.g. when the conformation is loaded into a simulation.
+    Cheap metadata (bounding box, max distance from the z axis) can be
+    provided analytically; otherwise, it is calculated from the coordinates,
+    which are discarded afterwards.
+    The conformation is generated with a fixed seed, so that it is identical
+    every time it is generated. Pickling a handle stores only the generator
+    and its arguments.
+
+    Parameters
+    ----------
+    generator: callable
+        A function that returns an Lx3 array of coordinates.
+    kwargs: dict
+        Keyword arguments of the generator.
+    seed: int
+        The seed of the numpy random number generator.
+    metadata: dict or None
+        Precomputed metadata: 'bounding_box' (a 2x3 array of min and max
+        coordinates), 'max_radius' and 'backbone_bounding_box'.
+    """
+
+    def __init__(self, generator=None, kwargs=None, seed=None, metadata=None):
+        self.generator = generator
+        self.kwargs = {} if kwargs is None else kwargs
+        self.seed = seed
+        self.metadata = {} if metadata is None else dict(metadata)
+        self._coords = None
+
+    @classmethod
+    def from_array(cls, coords):
+        conformation = cls()
+        conformation._coords = np.asarray(coords)
+        return conformation
+
+    @property
+    def is_materialized(self):
+        return self._coords is not None
+
+    def materialize(self):
+        if self._coords is None:
+            rng_state = np.random.get_state()
+            if self.seed is not None:
+                np.random.seed(self.seed)
+            try:
+                self._coords = np.asarray(self.generator(**self.kwargs))
+            finally:
+                np.random.set_state(rng_state)
+        return self._coords
+
+    def release(self):
+        """Free the memory taken by coordinates, if they can be regenerated."""
+        if self.generator is not None:
+            self._coords = None
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self.materialize(), dtype=dtype)
+
+    def _from_coords(self, key, func, particles=None):
+        if (particles is None) and (key in self.metadata):
+            return self.metadata[key]
+
+        was_materialized = self.is_materialized
+        coords = self.materialize()
+        val = func(coords if particles is None else coords[np.asarray(particles)])
+        if not was_materialized:
+            self.release()
+        if particles is None:
+            self.metadata[key] = val
+        return val
+
+    def bounding_box(self, particles=None):
+        """
+        Returns a 2x3 array of min and max coordinates of all particles
+        or of a subset of particles.
+        """
+        return self._from_coords(
+            "bounding_box",
+            lambda x: np.vstack([x.min(axis=0), x.max(axis=0)]),
+            particles,
+        )
+
+    def backbone_bounding_box(self, backbone):
+        if "backbone_bounding_box" in self.metadata:
+            return self.metadata["backbone_bounding_box"]
+        return self.bounding_box(backbone)
+
+    def z_extent(self, particles=None):
+        bbox = self.bounding_box(particles)
+        return bbox[0, 2], bbox[1, 2]
+
+    def max_radius(self, particles=None):
+        """The max distance of particles from the z axis."""
+        return self._from_coords(
+            "max_radius",
+            lambda x: ((x[:, :2] ** 2).sum(axis=1) ** 0.5).max(),
+            particles,
+        )
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        if self.generator is not None:
+            state["_coords"] = None
+        return state
+
+    def __repr__(self):
+        name = getattr(self.generator, "__name__", None)
+        return (
+            f"LazyConformation(generator={name}, seed={self.seed}, "
+            f"materialized={self.is_materialized})"
+        )
+
+
+def as_lazy_conformation(conformation):
+    if isinstance(conformation, LazyConformation):
+        return conformation
+    return LazyConformation.from_array(conformation)
+
+
 # def swap_nearby_particles(d, portion, cutoff=1.5, separation_cutoff=1):
 #     newd = np.copy(d)
 #     contacts = polymerScalings.giveContacts(d, cutoff)
@@ -224,6 +348,7 @@ def make_helical_loopbrush(
     bb_linear_density=1.0,
     random_loop_orientations=False,
     bb_random_shift=0,
+    nested_loop_fold="pin",
 ):
     """
     Generate a conformation of a loop brush with a helically folded backbone.
@@ -251,6 +376,10 @@ def make_helical_loopbrush(
     bb_random_shift : float
         Add a random shift along all three coordinates to the backbone.
         The default value is 0.
+    nested_loop_fold : str
+        The fold of nested loops, "pin" or "bridge".
+        Nested loops are placed inside their parents,
+        see fold_loops_hierarchically().
     Returns
     -------
     coords: np.ndarray
@@ -258,10 +387,11 @@ def make_helical_loopbrush(
 
     """
     coords = np.zeros(shape=(L, 3))
-    root_loops = loops[looplib.looptools.get_roots(loops)]
+    loops = np.asarray(loops)
+    root_mask = looplib.looptools.get_roots(loops)
+    root_loops = loops[root_mask]
     loopstarts = np.array([min(i) for i in root_loops])
     loopends = np.array([max(i) for i in root_loops])
-    looplens = loopends - loopstarts
 
     if len(root_loops) > 0:
         bbidxs = np.concatenate(
@@ -292,23 +422,108 @@ def make_helical_loopbrush(
     ).T
     coords[bbidxs] += np.random.random(bb_len * 3).reshape(bb_len, 3) * bb_random_shift
 
-    for i in range(len(root_loops)):
+    if len(root_loops) > 0:
+        root_starts = coords[root_loops.min(axis=1)]
+        root_ends = coords[root_loops.max(axis=1)]
         if random_loop_orientations:
-            bb_u = coords[root_loops[i][1]] - coords[root_loops[i][0]]
-            u = np.cross(bb_u, bb_u + (np.random.random(3) * 0.2 - 0.1))
-            u[2] = 0
+            bb_u = root_ends - root_starts
+            u = np.cross(
+                bb_u, bb_u + (np.random.random(bb_u.shape) * 0.2 - 0.1)
+            )
         else:
-            u = (coords[root_loops[i][0]] + coords[root_loops[i][1]]) / 2
-            u[2] = 0
-
-        u /= (u ** 2).sum() ** 0.5
-        for j in range(looplens[i] // 2):
-            coords[loopstarts[i] + j + 1] = coords[loopstarts[i] + j] + u
-            coords[loopends[i] - j - 1] = coords[loopends[i] - j] + u
+            u = (root_starts + root_ends) / 2
+        u[:, 2] = 0
+
+        loop_directions = np.full((len(loops), 3), np.nan)
+        loop_directions[root_mask] = u
+        fold_loops_hierarchically(
+            coords,
+            loops,
+            loop_fold="pin",
+            nested_loop_fold=nested_loop_fold,
+            loop_directions=loop_directions,
+        )
 
     return coords
 
 
+def helical_loopbrush_metadata(
+    L,
+    helix_radius,
+    helix_step,
+    loops,
+    bb_linear_density=1.0,
+    bb_random_shift=0,
+    nested_loop_fold="pin",
+    **kwargs,
+):
+    """
+    Calculate the bounds of a conformation generated by
+    make_helical_loopbrush() without generating it.
+    The bounds of the backbone are exact, the bounds of non-nested loops
+    are upper estimates based on the fact that pin-folded loops
+    cannot go further than half their contour length from the backbone.
+    The bounds of nested loops are not estimated, since such estimates
+    are much looser than the actual bounds; LazyConformation then computes
+    them from the generated coordinates.
+
+    Returns
+    -------
+    metadata: dict
+        The metadata of a LazyConformation.
+
+    """
+    loops = np.asarray(loops)
+    root_loops = np.sort(loops[looplib.looptools.get_roots(loops)], axis=1)
+    root_loops = root_loops[np.argsort(root_loops[:, 0])]
+    if len(root_loops) > 0:
+        bb_len = (
+            root_loops[0, 0]
+            + 1
+            + (root_loops[1:, 0] - root_loops[:-1, 1] + 1).sum()
+            + L
+            - root_loops[-1, 1]
+        )
+        max_pin_len = 0.5 * (root_loops[:, 1] - root_loops[:, 0]).max()
+    else:
+        bb_len = L
+        max_pin_len = 0
+
+    helix_turn_len = np.sqrt((2.0 * np.pi * helix_radius) ** 2 + helix_step ** 2)
+    bb_z_max = (bb_len - 1) / bb_linear_density / helix_turn_len * helix_step
+
+    bb_bbox = np.array(
+        [
+            [-helix_radius, -helix_radius, 0],
+            [
+                helix_radius + bb_random_shift,
+                helix_radius + bb_random_shift,
+                bb_z_max + bb_random_shift,
+            ],
+        ]
+    )
+    metadata = {"backbone_bounding_box": bb_bbox}
+
+    has_interior = (loops[:, 1] - loops[:, 0]) > 1
+    is_nested = (loop_depths(loops[has_interior]) > 0).any()
+    if is_nested:
+        return metadata
+
+    # pins are perpendicular to their bases, so they can only leave the backbone
+    # z-range by tilting along the xy-component of the backbone
+    if bb_random_shift > 0:
+        z_pad = max_pin_len
+    else:
+        z_pad = max_pin_len * 2.0 * np.pi * helix_radius / helix_turn_len
+
+    metadata["bounding_box"] = bb_bbox + np.array(
+        [[-max_pin_len, -max_pin_len, -z_pad], [max_pin_len, max_pin_len, z_pad]]
+    )
+    metadata["max_radius"] = helix_radius + bb_random_shift * np.sqrt(2) + max_pin_len
+
+    return metadata
+
+
 def make_helical_loopbrush_2(
     L,
     helix_radius,
@@ -418,6 +633,7 @@ def make_uniform_helical_loopbrush(
     loops,
     chain_bond_length=1.0,
     loop_fold="RW",  # possible values: RW, pin_radial, pin_random
+    nested_loop_fold=None,
 ):
     """
     Generate a conformation of a loop brush with a helically folded backbone.
@@ -442,6 +658,10 @@ def make_uniform_helical_loopbrush(
         within the xy plane.
         If 'pin_periodic_XX', loops are pin folded and aligned
         radially, with a period of XX loops.
+    nested_loop_fold: str or None
+        The fold of nested loops, "pin" or "bridge".
+        If None, nested loops are folded into random walks for
+        loop_fold="RW" and pin-folded otherwise.
 
 
     Returns
@@ -464,7 +684,8 @@ def make_uniform_helical_loopbrush(
     coords = np.zeros(shape=(L, 3))
     loops = np.asarray(loops)
     loops = loops[np.abs(loops[:, 1] - loops[:, 0]) > 0]
-    root_loops = loops[looplib.looptools.get_roots(loops)]
+    root_mask = looplib.looptools.get_roots(loops)
+    root_loops = loops[root_mask]
 
     loopstarts = np.array([min(i) for i in root_loops])
     loopends = np.array([max(i) for i in root_loops])
@@ -508,56 +729,35 @@ def make_uniform_helical_loopbrush(
         last_angle += scaled_loop_angle_step
         last_z += scaled_loop_z_step
 
+    loop_directions = np.full((len(loops), 3), np.nan)
     if loop_fold == "RW":
-        for i in range(len(root_loops)):
-            coords[loopstarts[i] : loopends[i] + 1] = brownian_bridge(
-                N=looplens[i] + 1,
-                ndim=3,
-                start=coords[loopstarts[i]],
-                end=coords[loopends[i]],
-                step_size=chain_bond_length,
-            )
-
-    elif loop_fold in ["pin_radial", "pin_random", "pin_periodic"]:
-        for i in range(len(root_loops)):
-            loopstart = root_loops[i][0]
-            loopend = root_loops[i][1]
-            bb_u = coords[loopend] - coords[loopstart]
-            loop_base_length = np.linalg.norm(bb_u)
-            if loop_fold == "pin_random":
-                u = np.cross(bb_u, bb_u + (np.random.random(3) * 0.2 - 0.1))
-                u[2] = 0
-            elif loop_fold == "pin_radial":
-                u = (coords[root_loops[i][0]] + coords[root_loops[i][1]]) / 2
-                u[2] = 0
-            elif loop_fold == "pin_periodic":
-                u = [
-                    np.sin(2 * np.pi * i / loop_pin_period),
-                    np.cos(2 * np.pi * i / loop_pin_period),
-                    0,
-                ]
-
-            u /= np.linalg.norm(u)
-
-            loop_full_contour_len = looplens[i] * chain_bond_length
-            if loop_full_contour_len > loop_base_length:
-                pin_length = 0.5 * np.sqrt(
-                    (loop_full_contour_len) ** 2 - (loop_base_length) ** 2
-                )
-                u1 = u * pin_length + bb_u * 0.5 * loop_base_length
-                u2 = u * pin_length - bb_u * 0.5 * loop_base_length
-                u1 *= chain_bond_length / np.linalg.norm(u1)
-                u2 *= chain_bond_length / np.linalg.norm(u2)
-            else:
-
-                u1 = bb_u
-                u2 = -bb_u
-                u1 *= chain_bond_length / np.linalg.norm(u1)
-                u2 *= chain_bond_length / np.linalg.norm(u2)
-
-            for j in range(looplens[i] // 2):
-                coords[loopstarts[i] + j + 1] = coords[loopstarts[i] + j] + u1
-                coords[loopends[i] - j - 1] = coords[loopends[i] - j] + u2
+        root_fold = "bridge"
+    else:
+        root_fold = "pin"
+        root_starts = coords[root_loops[:, 0]]
+        root_ends = coords[root_loops[:, 1]]
+        if loop_fold == "pin_random":
+            bb_u = root_ends - root_starts
+            u = np.cross(bb_u, bb_u + (np.random.random(bb_u.shape) * 0.2 - 0.1))
+            u[:, 2] = 0
+        elif loop_fold == "pin_radial":
+            u = (root_starts + root_ends) / 2
+            u[:, 2] = 0
+        elif loop_fold == "pin_periodic":
+            phases = 2 * np.pi * np.arange(len(root_loops)) / loop_pin_period
+            u = np.vstack(
+                [np.sin(phases), np.cos(phases), np.zeros(len(root_loops))]
+            ).T
+        loop_directions[root_mask] = u
+
+    fold_loops_hierarchically(
+        coords,
+        loops,
+        loop_fold=root_fold,
+        nested_loop_fold=root_fold if nested_loop_fold is None else nested_loop_fold,
+        loop_directions=loop_directions,
+        chain_bond_length=chain_bond_length,
+    )
 
     return coords
 
@@ -588,11 +788,237 @@ def brownian_bridge(N, ndim=1, step_size=1.0, start=0, end=0):
     return d
 
 
-def make_random_loopbrush(L, loops, end=None):
+def loop_depths(loops):
     """
-    Generate a conformation of a loop brush with a helically folded backbone.
-    In this conformation, loops are folded in half and project radially
-    from the backbone.
+    Calculate the nesting depth of each loop, i.e. the number of loops
+    that enclose it. Root loops have depth 0.
+
+    Parameters
+    ----------
+    loops: np.ndarray
+        An (n_loops, 2) array of (start, end) of each loop.
+
+    Returns
+    -------
+    depths: np.ndarray
+        An int array of nesting depths.
+
+    """
+    loops = np.sort(np.asarray(loops), axis=1)
+    if len(loops) == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    # parents come before their children when sorted by (start, -end)
+    order = np.lexsort((-loops[:, 1], loops[:, 0]))
+    rank = np.empty(len(loops), dtype=np.int64)
+    rank[order] = np.arange(len(loops))
+    n_closed = np.searchsorted(np.sort(loops[:, 1]), loops[:, 0], side="right")
+
+    return rank - n_closed
+
+
+def _random_unit_vectors(n, ndim=3):
+    u = np.random.normal(size=(n, ndim))
+    u /= np.linalg.norm(u, axis=1)[:, None]
+    return u
+
+
+def segment_brownian_bridges(starts, ends, seg_lens, step_size=1.0):
+    """
+    Generate many Brownian bridges at once.
+
+    Parameters
+    ----------
+    starts, ends: np.ndarray
+        (n, ndim) arrays of positions of the fixed ends of each bridge.
+    seg_lens: np.ndarray
+        The number of free particles in each bridge. The i-th bridge
+        has seg_lens[i]+1 steps.
+    step_size: float
+        The root mean square length of a step.
+
+    Returns
+    -------
+    coords: np.ndarray
+        A (seg_lens.sum(), ndim) array of concatenated free particles
+        of all bridges.
+
+    """
+    starts = np.asarray(starts, dtype=float)
+    ends = np.asarray(ends, dtype=float)
+    seg_lens = np.asarray(seg_lens, dtype=np.int64)
+    ndim = starts.shape[1]
+
+    n_steps = seg_lens + 1
+    step_offsets = np.r_[0, np.cumsum(n_steps)[:-1]]
+    walks = np.cumsum(
+        np.random.normal(scale=step_size / np.sqrt(ndim), size=(n_steps.sum(), ndim)),
+        axis=0,
+    )
+    walk_origins = np.vstack([np.zeros((1, ndim)), walks])[step_offsets]
+    walk_ends = walks[step_offsets + n_steps - 1] - walk_origins
+
+    seg_idx = np.repeat(np.arange(len(seg_lens)), seg_lens)
+    # position of each free particle within its bridge, 1..seg_len
+    j = np.arange(seg_lens.sum()) - np.repeat(step_offsets - np.arange(len(seg_lens)), seg_lens) + 1
+    frac = (j / n_steps[seg_idx])[:, None]
+
+    bridge = (
+        walks[step_offsets[seg_idx] + j - 1]
+        - walk_origins[seg_idx]
+        - frac * walk_ends[seg_idx]
+    )
+    return bridge + starts[seg_idx] * (1 - frac) + ends[seg_idx] * frac
+
+
+def _pin_fold(starts, ends, seg_lens, directions, chain_bond_length=1.0):
+    """
+    Fold many segments into hairpins that project along `directions`
+    from the middle of their bases. Returns concatenated coordinates
+    of free particles, same as segment_brownian_bridges.
+    """
+    bb_u = ends - starts
+    base_lens = np.linalg.norm(bb_u, axis=1)
+    degenerate = base_lens == 0
+    bb_u[degenerate] = _random_unit_vectors(degenerate.sum())
+    base_lens[degenerate] = 0
+    e = bb_u / np.linalg.norm(bb_u, axis=1)[:, None]
+
+    u = np.array(directions, dtype=float)
+    u -= e * (u * e).sum(axis=1)[:, None]
+    u_lens = np.linalg.norm(u, axis=1)
+    bad = ~(u_lens > 1e-9)
+    if bad.any():
+        u_rand = _random_unit_vectors(bad.sum())
+        u_rand -= e[bad] * (u_rand * e[bad]).sum(axis=1)[:, None]
+        u[bad] = u_rand
+        u_lens[bad] = np.linalg.norm(u_rand, axis=1)
+    u /= u_lens[:, None]
+
+    contour_lens = (seg_lens + 1) * chain_bond_length
+    pin_lens = 0.5 * np.sqrt(np.maximum(contour_lens ** 2 - base_lens ** 2, 0))
+    u1 = u * pin_lens[:, None] + e * 0.5 * base_lens[:, None]
+    u2 = u * pin_lens[:, None] - e * 0.5 * base_lens[:, None]
+    straight = contour_lens <= base_lens
+    u1[straight] = e[straight]
+    u2[straight] = -e[straight]
+    u1 *= chain_bond_length / np.linalg.norm(u1, axis=1)[:, None]
+    u2 *= chain_bond_length / np.linalg.norm(u2, axis=1)[:, None]
+
+    seg_idx = np.repeat(np.arange(len(seg_lens)), seg_lens)
+    offsets = np.r_[0, np.cumsum(seg_lens)[:-1]]
+    j = np.arange(seg_lens.sum()) - offsets[seg_idx] + 1
+    steps_from_start = j
+    steps_from_end = seg_lens[seg_idx] + 1 - j
+    from_start = (steps_from_start <= steps_from_end)[:, None]
+
+    return np.where(
+        from_start,
+        starts[seg_idx] + steps_from_start[:, None] * u1[seg_idx],
+        ends[seg_idx] + steps_from_end[:, None] * u2[seg_idx],
+    )
+
+
+def fold_loops_hierarchically(
+    coords,
+    loops,
+    loop_fold="pin",
+    nested_loop_fold=None,
+    loop_directions=None,
+    chain_bond_length=1.0,
+):
+    """
+    Place particles of all loops, including nested ones, level by level.
+    At each nesting level, the particles of a loop that do not belong to
+    its child loops are folded between the loop bases, which must be
+    already placed (i.e. the bases of root loops are expected to be
+    on the backbone). The bases of child loops thus land on the parent
+    loop and the child loops are folded at the next level.
+    All loops of the same level are placed in one vectorized pass.
+
+    Parameters
+    ----------
+    coords: np.ndarray
+        An Lx3 array of particle coordinates, modified in place.
+    loops: np.ndarray
+        An (n_loops, 2) array of (start, end) of each loop.
+    loop_fold: str
+        The fold of root loops. If "pin", loops are folded in half and
+        project from the middle of their base. If "bridge", loops are
+        folded into Brownian bridges.
+    nested_loop_fold: str or None
+        The fold of nested loops, same as `loop_fold` if None.
+    loop_directions: np.ndarray or None
+        An (n_loops, 3) array of directions of pin-folded loops, aligned
+        with `loops`. Rows with NaNs, as well as all rows if None, are
+        replaced with random directions perpendicular to the loop base.
+    chain_bond_length: float
+        The length of a bond along the chain.
+
+    Returns
+    -------
+    coords: np.ndarray
+        The same array of coordinates.
+
+    """
+    FOLDS = ["pin", "bridge"]
+    nested_loop_fold = loop_fold if nested_loop_fold is None else nested_loop_fold
+    for fold in [loop_fold, nested_loop_fold]:
+        if fold not in FOLDS:
+            raise ValueError(f"Unknown fold type {fold}. Enabled fold types: {FOLDS}")
+
+    L = len(coords)
+    loops = np.sort(np.asarray(loops, dtype=np.int64).reshape(-1, 2), axis=1)
+    if loop_directions is None:
+        loop_directions = np.full((len(loops), 3), np.nan)
+    loop_directions = np.asarray(loop_directions, dtype=float)
+
+    has_interior = (loops[:, 1] - loops[:, 0]) > 1
+    loops = loops[has_interior]
+    loop_directions = loop_directions[has_interior]
+    if len(loops) == 0:
+        return coords
+
+    depths = loop_depths(loops)
+
+    # the number of loops strictly enclosing each particle
+    particle_depths = np.cumsum(
+        np.bincount(loops[:, 0] + 1, minlength=L + 1)[: L + 1]
+        - np.bincount(loops[:, 1], minlength=L + 1)[: L + 1]
+    )[:L]
+
+    for depth in range(depths.max() + 1):
+        level_loops = loops[depths == depth]
+        level_dirs = loop_directions[depths == depth]
+        order = np.argsort(level_loops[:, 0])
+        level_loops, level_dirs = level_loops[order], level_dirs[order]
+
+        particles = np.flatnonzero(particle_depths == depth + 1)
+        owners = np.searchsorted(level_loops[:, 0], particles, side="right") - 1
+        seg_lens = np.bincount(owners, minlength=len(level_loops))
+
+        starts = coords[level_loops[:, 0]]
+        ends = coords[level_loops[:, 1]]
+        fold = loop_fold if depth == 0 else nested_loop_fold
+        if fold == "pin":
+            no_dir = np.isnan(level_dirs).any(axis=1)
+            level_dirs[no_dir] = _random_unit_vectors(no_dir.sum())
+            coords[particles] = _pin_fold(
+                starts, ends, seg_lens, level_dirs, chain_bond_length
+            )
+        else:
+            coords[particles] = segment_brownian_bridges(
+                starts, ends, seg_lens, step_size=chain_bond_length
+            )
+
+    return coords
+
+
+def make_random_loopbrush(L, loops, end=None, periodic_z=None):
+    """
+    Generate a conformation of a loop brush with a randomly folded backbone.
+    In this conformation, loops, including the nested ones,
+    are folded into Brownian bridges.
 
     Parameters
     ----------
@@ -600,6 +1026,14 @@ def make_random_loopbrush(L, loops, end=None):
         Number of particles.
     loops: a list of tuples [(int, int)]
         Particle indices of (start, end) of each loop.
+    end: (float, float, float) or None
+        If provided, the backbone is a Brownian bridge from the origin
+        to `end`, otherwise a random walk.
+    periodic_z: float or None
+        If provided, the backbone is a Brownian bridge that starts at
+        the origin and continues into its own periodic image at
+        (0, 0, periodic_z), i.e. the last backbone particle is one step
+        away from the image of the first one.
     Returns
     -------
     coords: np.ndarray
@@ -607,10 +1041,10 @@ def make_random_loopbrush(L, loops, end=None):
 
     """
     coords = np.zeros(shape=(L, 3))
+    loops = np.asarray(loops)
     root_loops = loops[looplib.looptools.get_roots(loops)]
     loopstarts = np.array([min(i) for i in root_loops])
     loopends = np.array([max(i) for i in root_loops])
-    looplens = loopends - loopstarts
 
     if len(root_loops) > 0:
         bbidxs = np.concatenate(
@@ -625,17 +1059,294 @@ def make_random_loopbrush(L, loops, end=None):
         bbidxs = range(L)
     bb_len = len(bbidxs)
 
-    if end is None:
+    if periodic_z is not None:
+        coords[bbidxs] = brownian_bridge(
+            bb_len + 1, ndim=3, start=[0, 0, 0], end=[0, 0, periodic_z])[:-1]
+    elif end is None:
         coords[bbidxs] = polychrom.starting_conformations.create_random_walk(bb_len)
     else:
         coords[bbidxs] = brownian_bridge(bb_len, ndim=3, start=[0,0,0], end=end)
 
-    for i in range(len(root_loops)):
-        coords[loopstarts[i] : loopends[i] + 1] = brownian_bridge(
-            N=looplens[i] + 1,
-            ndim=3,
-            start=coords[loopstarts[i]],
-            end=coords[loopends[i]],
-        )
+    fold_loops_hierarchically(coords, loops, loop_fold="bridge")
+
+    return coords
+
+
+def _hilbert_transpose_to_axes(X, order):
+    """
+    Convert Hilbert indices in the "transposed" form into lattice
+    coordinates (J. Skilling, AIP Conf. Proc. 707, 381 (2004)),
+    vectorized over rows of X.
+    """
+    X = X.copy()
+    n = X.shape[1]
+    N = 2 << (order - 1)
+
+    # Gray decode
+    t = X[:, n - 1] >> 1
+    for i in range(n - 1, 0, -1):
+        X[:, i] ^= X[:, i - 1]
+    X[:, 0] ^= t
+
+    # undo excess work
+    Q = 2
+    while Q != N:
+        P = Q - 1
+        for i in range(n - 1, -1, -1):
+            invert = (X[:, i] & Q) != 0
+            X[invert, 0] ^= P
+            t = (X[~invert, 0] ^ X[~invert, i]) & P
+            X[np.flatnonzero(~invert), 0] ^= t
+            X[np.flatnonzero(~invert), i] ^= t
+        Q <<= 1
+
+    return X
+
+
+def hilbert_curve(order, ndim=3):
+    """
+    Generate lattice points of a Hilbert curve filling a cube
+    with the side of 2**order.
+
+    Returns
+    -------
+    points: np.ndarray
+        A (2**(order*ndim), ndim) int array of consecutive lattice points;
+        the curve starts at the origin.
+    """
+    if order == 0:
+        return np.zeros((1, ndim), dtype=np.int64)
+
+    h = np.arange(2 ** (order * ndim), dtype=np.int64)
+    X = np.zeros((len(h), ndim), dtype=np.int64)
+    n_bits = order * ndim
+    for j in range(n_bits):
+        bit = (h >> (n_bits - 1 - j)) & 1
+        X[:, j % ndim] |= bit << (order - 1 - j // ndim)
+
+    return _hilbert_transpose_to_axes(X, order)
+
+
+def serpentine_curve(shape):
+    """
+    Generate lattice points of a boustrophedon ("serpentine") path through
+    a 3D lattice of the given shape. The path fills xy-layers one by one,
+    moving along the z axis.
+
+    Returns
+    -------
+    points: np.ndarray
+        A (prod(shape), 3) int array of consecutive lattice points;
+        the curve starts at the origin and, for an even number of layers,
+        ends right above it.
+    """
+    nx, ny, nz = shape
+    k = np.arange(nx * ny * nz, dtype=np.int64)
+    z = k // (nx * ny)
+    r = k % (nx * ny)
+    r = np.where(z % 2, nx * ny - 1 - r, r)
+    y = r // nx
+    x = np.where(y % 2, nx - 1 - r % nx, r % nx)
+    return np.vstack([x, y, z]).T
+
+
+def space_filling_waypoints(box, n_points, curve="hilbert", even_z=False):
+    """
+    Generate points of a space-filling curve through a box.
+
+    Parameters
+    ----------
+    box: (float, float, float)
+        The sides of the box. The points fill [-box_x/2, box_x/2] x
+        [-box_y/2, box_y/2] x [0, box_z].
+    n_points: int
+        The approximate number of points.
+    curve: str
+        "hilbert" - Hilbert curves in cubes stacked along the z axis;
+        "serpentine" - a boustrophedon path through xy layers.
+    even_z: bool
+        If True, the curve ends right above its start, i.e. it can be
+        continued periodically along the z axis.
 
+    Returns
+    -------
+    points: np.ndarray
+        An (n, 3) array of points at the centers of lattice cells.
+    """
+    box = np.asarray(box, dtype=float)
+    cell = (box.prod() / max(n_points, 1)) ** (1 / 3)
+    shape = np.maximum(1, np.round(box / cell)).astype(int)
+
+    if curve == "hilbert":
+        order = int(max(0, np.round(np.log2(shape[:2].min()))))
+        side = 2 ** order
+        points = hilbert_curve(order)
+        # rotate the cube so that the curve ends above its start
+        end_axis = int(np.argmax(np.abs(points[-1] - points[0])))
+        points = points[:, [i for i in range(3) if i != end_axis] + [end_axis]]
+        n_cubes = max(1, int(np.round(shape[2] / side)))
+        if order == 0 and even_z:
+            n_cubes += n_cubes % 2
+        points = np.vstack([points + [0, 0, i * side] for i in range(n_cubes)])
+        shape = np.array([side, side, side * n_cubes])
+    elif curve == "serpentine":
+        if even_z:
+            shape[2] += shape[2] % 2
+        points = serpentine_curve(shape)
+    else:
+        raise ValueError(f"Unknown curve {curve}. Enabled curves: hilbert, serpentine")
+
+    return (points + 0.5) * (box / shape) - [box[0] / 2, box[1] / 2, 0]
+
+
+def make_space_filling_loopbrush(
+    L,
+    loops,
+    box,
+    curve="hilbert",
+    backbone_extension=0.5,
+    start=None,
+    end=None,
+    periodic_z=None,
+):
+    """
+    Generate a conformation of a loop brush that uniformly fills a box.
+    The backbone follows a space-filling curve through the box, with
+    Brownian bridges between consecutive points of the curve; loops,
+    including the nested ones, are folded into Brownian bridges around
+    their bases.
+
+    Parameters
+    ----------
+    L : int
+        Number of particles.
+    loops: a list of tuples [(int, int)]
+        Particle indices of (start, end) of each loop.
+    box: (float, float, float)
+        The sides of the box, e.g. of the PBC box.
+    curve: str
+        "hilbert" or "serpentine", see space_filling_waypoints().
+    backbone_extension: float
+        The length of the space-filling curve relative to the contour
+        length of the backbone; sets the resolution of the curve.
+    start, end: (float, float, float) or None
+        If provided, the first/last backbone particles are placed here.
+    periodic_z: float or None
+        If provided, the backbone continues into the periodic image of
+        its first particle at the distance of periodic_z along the z axis.
+
+    Returns
+    -------
+    coords: np.ndarray
+        An Lx3 array of particle coordinates.
+
+    """
+    coords = np.zeros(shape=(L, 3))
+    loops = np.asarray(loops, dtype=np.int64).reshape(-1, 2)
+    box = np.array(box, dtype=float)
+    if periodic_z is not None:
+        box[2] = periodic_z
+
+    # the backbone: particles that are not inside root loops
+    root_loops = np.sort(loops[looplib.looptools.get_roots(loops)], axis=1)
+    coverage = np.zeros(L + 1, dtype=np.int64)
+    np.add.at(coverage, root_loops[:, 0] + 1, 1)
+    np.add.at(coverage, root_loops[:, 1], -1)
+    bbidxs = np.flatnonzero(np.cumsum(coverage)[:L] == 0)
+    bb_len = len(bbidxs)
+
+    n_points = int(
+        np.clip((backbone_extension * bb_len / box.prod() ** (1 / 3)) ** 1.5, 2, bb_len)
+    )
+    waypoints = space_filling_waypoints(
+        box, n_points, curve, even_z=periodic_z is not None)
+    if start is not None:
+        waypoints = np.vstack([start, waypoints])
+    if end is not None:
+        waypoints = np.vstack([waypoints, end])
+
+    # with a periodic backbone, an extra particle lands onto the image
+    # of the first one and is dropped afterwards
+    n_bb = bb_len
+    if periodic_z is not None:
+        waypoints = np.vstack([waypoints, waypoints[0] + [0, 0, periodic_z]])
+        n_bb += 1
+    waypoints = waypoints[: n_bb]
+
+    wp_idxs = np.round(np.linspace(0, n_bb - 1, len(waypoints))).astype(np.int64)
+    bb_coords = np.zeros((n_bb, 3))
+    bb_coords[wp_idxs] = waypoints
+    free = np.ones(n_bb, dtype=bool)
+    free[wp_idxs] = False
+    if free.any():
+        bb_coords[free] = segment_brownian_bridges(
+            waypoints[:-1], waypoints[1:], np.diff(wp_idxs) - 1)
+    coords[bbidxs] = bb_coords[:bb_len]
+
+    fold_loops_hierarchically(coords, loops, loop_fold="bridge")
+
+    return coords
+
+
+def load_conformation(folder, block=-1):
+    """
+    Load particle coordinates of a block stored by polychrom's HDF5Reporter.
+    """
+    uris = polychrom.hdf5_format.list_URIs(folder)
+    if len(uris) == 0:
+        raise ValueError(f"No blocks found in {folder}")
+    return np.asarray(polychrom.hdf5_format.load_URI(uris[block])["pos"])
+
+
+def loop_base_distances(coords, loops):
+    loops = np.asarray(loops, dtype=np.int64).reshape(-1, 2)
+    coords = np.asarray(coords)
+    return np.linalg.norm(coords[loops[:, 0]] - coords[loops[:, 1]], axis=1)
+
+
+def rescale_loopbrush(coords, loops, z_scale, r_scale=None):
+    """
+    Stretch or compress a loop brush along the z axis about the origin.
+    Chain segments (root loops with the following backbone linkers)
+    move as rigid bodies, so that bonds within segments are preserved.
+
+    Parameters
+    ----------
+    coords: np.ndarray
+        An Lx3 array of particle coordinates.
+    loops: np.ndarray
+        An (n_loops, 2) array of loops.
+    z_scale: float
+        The scaling factor along the z axis.
+    r_scale: float or None
+        The scaling factor in the xy plane. By default, 1/sqrt(z_scale),
+        preserving the volume.
+    """
+    r_scale = z_scale ** -0.5 if r_scale is None else r_scale
+    loops = np.asarray(loops, dtype=np.int64).reshape(-1, 2)
+    boundaries = loops[looplib.looptools.get_roots(loops)].min(axis=1)
+    seg_ids = simutils.segment_ids(len(coords), boundaries)
+    return simutils.scale_segments(
+        np.asarray(coords, dtype=float), seg_ids, [r_scale, r_scale, z_scale]
+    )
+
+
+def warm_start_loopbrush(folder, L, loops, axial_length=None, block=-1, periodic=False):
+    """
+    Load the conformation of a finished loop brush simulation and rescale
+    it to a new axial length, measured between the chain tips.
+    If periodic, the axial length is the z side of the periodic box,
+    i.e. the tips of the (unwrapped) source conformation are one
+    backbone step short of it.
+    """
+    coords = load_conformation(folder, block)
+    if len(coords) != L:
+        raise ValueError(
+            f"The conformation in {folder} has {len(coords)} particles instead of {L}")
+    if axial_length is not None:
+        length = coords[-1, 2] - coords[0, 2]
+        if periodic:
+            n_bb = len(looplib.looptools.get_backbone(loops, N=L))
+            length *= n_bb / max(n_bb - 1, 1)
+        coords = rescale_loopbrush(coords, loops, axial_length / length)
     return coords
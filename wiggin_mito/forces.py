@@ -78,6 +78,121 @@ def homotypic_quartic_repulsive_attractive(
     return force
 
 
+def _as_index_array(idxs, n_cols, N):
+    idxs = np.asarray(idxs, dtype=np.int64).reshape(-1, n_cols)
+    if len(idxs) and ((idxs.max() >= N) or (idxs.min() < 0)):
+        raise ValueError(
+            "\nCannot add a term with monomers beyond the polymer length %d" % N
+        )
+    return idxs
+
+
+def harmonic_bonds(
+    sim_object,
+    bonds,
+    bondWiggleDistance=0.05,
+    bondLength=1.0,
+    name="harmonic_bonds",
+    override_checks=False,
+):
+    """Adds harmonic bonds. Bonds are provided as an int array
+    and converted to Python ints in bulk.
+
+    Parameters
+    ----------
+
+    bonds : (n, 2) array of int
+        Pairs of particle indices to be connected with a bond.
+    bondWiggleDistance : float
+        Average displacement from the equilibrium bond distance.
+        Can be provided per-bond.
+    bondLength : float
+        The length of the bond.
+        Can be provided per-bond.
+    override_checks : bool
+        If False, check that no bond is added twice.
+    """
+
+    bonds = _as_index_array(bonds, 2, sim_object.N)
+
+    if not override_checks:
+        keys = np.sort(bonds, axis=1)
+        if len(np.unique(keys, axis=0)) != len(keys):
+            raise ValueError("Some bonds are added twice!")
+
+    force = openmm.HarmonicBondForce()
+    force.name = name
+
+    bondLength = np.broadcast_to(
+        np.asarray(bondLength, dtype=float) * sim_object.length_scale, len(bonds)
+    ).tolist()
+    bondWiggleDistance = np.broadcast_to(
+        np.asarray(bondWiggleDistance, dtype=float) * sim_object.length_scale,
+        len(bonds),
+    )
+    # using kbond = kt / (delta x)^2, infinite wiggle distance means no bond
+    with np.errstate(divide="ignore"):
+        kbond = np.where(
+            bondWiggleDistance == 0,
+            0,
+            sim_object.kbondScalingFactor / bondWiggleDistance ** 2,
+        ).tolist()
+
+    for (i, j), l0, k in zip(bonds.tolist(), bondLength, kbond):
+        force.addBond(i, j, l0, k)
+
+    return force
+
+
+def angle_force(
+    sim_object,
+    triplets,
+    k=1.5,
+    theta_0=np.pi,
+    name="angle",
+    override_checks=False,
+):
+    """Adds harmonic angle bonds. k specifies energy in kT at one radian.
+    Triplets are provided as an int array and converted to Python ints in bulk.
+
+    Parameters
+    ----------
+
+    triplets : (n, 3) array of int
+        Triplets of particle indices to be connected with an angle bond.
+    k : float or list of length N
+        Stiffness of the bond.
+        If list, then determines the stiffness of the i-th triplet
+        Potential is k * alpha^2 * 0.5 * kT
+    theta_0 : float or list of length N
+        Equilibrium angle of the bond. By default it is np.pi.
+    override_checks : bool
+        If False, check that no triplet is added twice.
+    """
+
+    triplets = _as_index_array(triplets, 3, sim_object.N)
+
+    if not override_checks:
+        if len(np.unique(triplets, axis=0)) != len(triplets):
+            raise ValueError("Some triplets are added twice!")
+
+    energy = "kT*angK * (theta - angT0) * (theta - angT0) * (0.5)"
+    force = openmm.CustomAngleForce(energy)
+    force.name = name
+
+    force.addGlobalParameter("kT", sim_object.kT)
+    force.addPerAngleParameter("angK")
+    force.addPerAngleParameter("angT0")
+
+    k = np.broadcast_to(np.asarray(k, dtype=float), len(triplets)).tolist()
+    theta_0 = np.broadcast_to(np.asarray(theta_0, dtype=float), len(triplets)).tolist()
+
+    for (i, j, l), k_i, theta_i in zip(triplets.tolist(), k, theta_0):
+        force.addAngle(i, j, l, (k_i, theta_i))
+
+    return force
+
+
 def max_dist_bonds(
     sim_object,
     bonds,
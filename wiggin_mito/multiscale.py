@@ -0,0 +1,130 @@
+import numpy as np
+
+from . import conformations
+
+
+def coarse_grain_loops(loops, k, min_loop_size=2):
+    """
+    Map loops onto a chain coarse-grained by a factor of k, i.e. where
+    each coarse bead represents k consecutive monomers.
+
+    Parameters
+    ----------
+    loops: np.ndarray
+        An (n_loops, 2) array of loops of the fine chain.
+    k: int
+        The number of monomers per coarse bead.
+    min_loop_size: int
+        Loops that are shorter than this number of coarse beads are dropped.
+
+    Returns
+    -------
+    coarse_loops: np.ndarray
+        An (n_coarse_loops, 2) array of unique coarse loops.
+    """
+    coarse_loops = np.sort(np.asarray(loops, dtype=np.int64).reshape(-1, 2), axis=1) // k
+    coarse_loops = coarse_loops[coarse_loops[:, 1] - coarse_loops[:, 0] >= min_loop_size]
+    return np.unique(coarse_loops, axis=0)
+
+
+def coarse_grain_conformation(coords, k):
+    """
+    Replace each k consecutive particles with their center of mass.
+    The last coarse bead may represent fewer particles.
+    """
+    coords = np.asarray(coords, dtype=float)
+    starts = np.arange(0, len(coords), k)
+    sizes = np.diff(np.r_[starts, len(coords)])
+    return np.add.reduceat(coords, starts, axis=0) / sizes[:, None]
+
+
+def backmap_conformation(
+    coarse_coords, k, L, loops, scale=None, min_loop_size=2, chain_bond_length=1.0
+):
+    """
+    Generate a fine-grained conformation from a coarse-grained one.
+
+    The middle monomer of each k-monomer block is placed at its coarse bead;
+    the bases of loops that are represented in the coarse conformation
+    are placed next to each other, in the middle between the coarse beads
+    of the loop base. The rest of monomers are filled in with Brownian
+    bridges between these anchors. Loops shorter than min_loop_size
+    coarse beads are not resolved by the coarse conformation and are
+    left to relax in the simulation.
+
+    Parameters
+    ----------
+    coarse_coords: np.ndarray
+        An (n_coarse, 3) array of coordinates of coarse beads.
+    k: int
+        The number of monomers per coarse bead.
+    L: int
+        The number of fine monomers.
+    loops: np.ndarray
+        An (n_loops, 2) array of loops of the fine chain.
+    scale: float or None
+        The scaling factor of coarse coordinates. By default, k**(1/3),
+        preserving the density at equal bond lengths.
+    min_loop_size: int
+        The min loop size in coarse beads, as in coarse_grain_loops().
+    chain_bond_length: float
+        The distance between the two bases of a loop.
+
+    Returns
+    -------
+    coords: np.ndarray
+        An Lx3 array of particle coordinates.
+    """
+    scale = k ** (1 / 3) if scale is None else scale
+    X = np.asarray(coarse_coords, dtype=float) * scale
+    n_coarse = len(X)
+    if n_coarse * k < L:
+        raise ValueError("The coarse conformation is too short for the fine chain")
+
+    # anchors at the middles of k-monomer blocks and at the chain ends
+    center_idxs = np.minimum(np.arange(n_coarse) * k + k // 2, L - 1)
+    anchor_idxs = [np.r_[0, center_idxs, L - 1]]
+    anchor_pos = [np.vstack([X[0], X, X[(L - 1) // k]])]
+
+    # anchors at the bases of loops resolved by the coarse conformation
+    loops = np.sort(np.asarray(loops, dtype=np.int64).reshape(-1, 2), axis=1)
+    coarse = loops // k
+    resolved = coarse[:, 1] - coarse[:, 0] >= min_loop_size
+    loops, coarse = loops[resolved], coarse[resolved]
+    if len(loops):
+        mids = (X[coarse[:, 0]] + X[coarse[:, 1]]) / 2
+        base_vecs = X[coarse[:, 1]] - X[coarse[:, 0]]
+        base_vecs /= np.maximum(np.linalg.norm(base_vecs, axis=1), 1e-9)[:, None]
+        anchor_idxs += [loops[:, 0], loops[:, 1]]
+        anchor_pos += [
+            mids - base_vecs * chain_bond_length / 2,
+            mids + base_vecs * chain_bond_length / 2,
+        ]
+
+    # loop bases override block centers; the first occurrence is kept after reversal
+    anchor_idxs = np.concatenate(anchor_idxs)[::-1]
+    anchor_pos = np.vstack(anchor_pos)[::-1]
+    anchor_idxs, first = np.unique(anchor_idxs, return_index=True)
+    anchor_pos = anchor_pos[first]
+
+    coords = np.zeros((L, 3))
+    coords[anchor_idxs] = anchor_pos
+    seg_lens = np.diff(anchor_idxs) - 1
+    free = np.ones(L, dtype=bool)
+    free[anchor_idxs] = False
+    if free.any():
+        coords[free] = conformations.segment_brownian_bridges(
+            anchor_pos[:-1], anchor_pos[1:], seg_lens, step_size=chain_bond_length
+        )
+
+    return coords
+
+
+def backmap_from_folder(coarse_folder, k, L, loops, block=-1, **kwargs):
+    """
+    Back-map the conformation of a block of a finished coarse-grained
+    simulation, see backmap_conformation().
+    """
+    return backmap_conformation(
+        conformations.load_conformation(coarse_folder, block), k, L, loops, **kwargs
+    )
@@ -0,0 +1,139 @@
+import numpy as np
+
+
+def replica_offsets(n_replicas, spacing=None, axis=0):
+    """
+    Calculate the shifts of replicas. If spacing is None, all replicas
+    are overlaid at the origin, otherwise they are placed side by side
+    along the given axis. Note that overlaying replicas does not save
+    any cost, since interactions of overlaid particles are still evaluated
+    (see mask_interreplica_interactions()).
+    """
+    offsets = np.zeros((n_replicas, 3))
+    if spacing is not None:
+        offsets[:, axis] = np.arange(n_replicas) * spacing
+    return offsets
+
+
+def replica_ids(n_replicas, replica_N):
+    return np.repeat(np.arange(n_replicas), replica_N)
+
+
+def within_replicas(idxs, replica_N):
+    """
+    Returns a boolean mask of rows of an (n, k) array of particle indices
+    (e.g. bonds or angle triplets) that do not cross replica boundaries.
+    """
+    idxs = np.asarray(idxs)
+    if idxs.size == 0:
+        return np.ones(len(idxs), dtype=bool)
+    r = idxs // replica_N
+    return (r == r[:, :1]).all(axis=1)
+
+
+def expand_particles(particles, n_replicas, replica_N):
+    """
+    Convert indices of particles within a replica (negative indices count
+    from the end of the replica) into global indices of these particles
+    in all replicas.
+    """
+    particles = np.asarray(particles) % replica_N
+    return (
+        np.arange(n_replicas)[:, None] * replica_N + particles[None, :]
+    ).ravel()
+
+
+def split_by_replica(idxs, n_replicas, replica_N):
+    """
+    Split particle indices (or rows of an (n, k) array of indices, by their
+    first index) into the arrays of each replica; indices stay global.
+    """
+    idxs = np.asarray(idxs)
+    r = (idxs if idxs.ndim == 1 else idxs[:, 0]) // replica_N
+    return [idxs[r == i] for i in range(n_replicas)]
+
+
+def split_loops(loops, n_replicas, replica_N):
+    """
+    Split an array of loops into arrays of loops of each replica,
+    with particle indices local to the replica.
+    """
+    loops = np.asarray(loops)
+    loop_replicas = loops.min(axis=1) // replica_N
+    if (loops.max(axis=1) // replica_N != loop_replicas).any():
+        raise ValueError("Some loops span multiple replicas")
+    return [loops[loop_replicas == r] - r * replica_N for r in range(n_replicas)]
+
+
+def make_replicated_conformation(
+    generator, n_replicas, replica_N, offsets, L, loops, **kwargs
+):
+    """
+    Generate a conformation of independent replicas of a loop brush.
+
+    Parameters
+    ----------
+    generator: callable
+        A loop brush generator with arguments L and loops,
+        e.g. make_random_loopbrush().
+    n_replicas: int
+        The number of replicas.
+    replica_N: int
+        The number of particles in each replica.
+    offsets: np.ndarray
+        An (n_replicas, 3) array of shifts of each replica.
+    L: int
+        The total number of particles.
+    loops: np.ndarray
+        Loops of all replicas, with global particle indices.
+    **kwargs:
+        Other arguments of the generator.
+
+    Returns
+    -------
+    coords: np.ndarray
+        An Lx3 array of particle coordinates.
+
+    """
+    if L != n_replicas * replica_N:
+        raise ValueError("The number of particles does not match the number of replicas")
+
+    coords = np.zeros((L, 3))
+    for r, replica_loops in enumerate(split_loops(loops, n_replicas, replica_N)):
+        coords[r * replica_N : (r + 1) * replica_N] = (
+            generator(L=replica_N, loops=replica_loops, **kwargs) + offsets[r]
+        )
+    return coords
+
+
+def demultiplex(coords, n_replicas):
+    """
+    Split an (N, 3) array of coordinates or a (n_frames, N, 3) trajectory
+    into an array of (n_replicas, ...) arrays of individual replicas.
+    """
+    coords = np.asarray(coords)
+    if coords.ndim == 2:
+        return coords.reshape(n_replicas, -1, coords.shape[-1])
+    return np.moveaxis(
+        coords.reshape(coords.shape[0], n_replicas, -1, coords.shape[-1]), 1, 0
+    )
+
+
+def mask_interreplica_interactions(force, replica_ids, param_name="wm_replica"):
+    """
+    Switch off the interactions between particles of different replicas
+    in a CustomNonbondedForce, by adding a per-particle replica index.
+    Masked pairs are still found and evaluated by OpenMM, so replicas must
+    also be kept apart (see ReplicaMultiplexing); the mask is a safety net.
+    """
+    energy = force.getEnergyFunction().split(";")
+    energy[0] = f"delta({param_name}1-{param_name}2)*({energy[0]})"
+    force.setEnergyFunction(";".join(energy))
+
+    force.addPerParticleParameter(param_name)
+    replica_ids = np.asarray(replica_ids, dtype=float).tolist()
+    for i in range(force.getNumParticles()):
+        params = list(force.getParticleParameters(i)) + [replica_ids[i]]
+        force.setParticleParameters(i, params)
+
+    return force
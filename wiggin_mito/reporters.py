@@ -0,0 +1,276 @@
+import logging
+import queue
+import threading
+
+import numpy as np
+
+from . import trajstore
+
+
+class ReplicaReporter:
+    """
+    A reporter that splits block data of a multiplexed simulation
+    into separate reporters of each replica. Particle coordinates
+    and velocities are sliced per replica, other block data
+    (time, energies, etc) are passed to every replica as is.
+    Non-block reports (e.g. initArgs, applied_forces) are passed
+    to the optional common reporter.
+
+    Parameters
+    ----------
+    replica_reporters: list
+        polychrom-style reporters, one per replica.
+    replica_N: int
+        The number of particles in each replica.
+    common_reporter: reporter or None
+        The reporter of non-block data.
+    """
+
+    PER_PARTICLE_KEYS = ["pos", "vel"]
+
+    def __init__(self, replica_reporters, replica_N, common_reporter=None):
+        self.replica_reporters = list(replica_reporters)
+        self.replica_N = replica_N
+        self.common_reporter = common_reporter
+
+    def report(self, name, values):
+        if name != "data":
+            if self.common_reporter is not None:
+                self.common_reporter.report(name, values)
+            return
+
+        for r, reporter in enumerate(self.replica_reporters):
+            replica_values = dict(values)
+            for key in self.PER_PARTICLE_KEYS:
+                if key in values:
+                    replica_values[key] = np.asarray(values[key])[
+                        r * self.replica_N : (r + 1) * self.replica_N
+                    ]
+            reporter.report(name, replica_values)
+
+    def dump_data(self):
+        for reporter in self.replica_reporters:
+            reporter.dump_data()
+        if self.common_reporter is not None:
+            self.common_reporter.dump_data()
+
+
+class ChainDeltaReporter:
+    """
+    A reporter that stores block coordinates in the compact chain-delta
+    format of trajstore.TrajectoryWriter. Non-block reports (and, if
+    keep_blocks is True, block data too) are passed to the optional
+    common reporter.
+
+    Parameters
+    ----------
+    folder: str
+        The folder of the trajectory.
+    max_error: float
+        The max distance between stored and original positions.
+    anchor_every: int
+        The distance between anchor particles.
+    particles: np.ndarray or None
+        The indices of stored particles, all particles by default.
+    compression: str or None
+        None, "bitpack" or "zlib", see trajstore.TrajectoryWriter.
+    common_reporter: reporter or None
+        The reporter of non-block data.
+    keep_blocks: bool
+        Whether to pass block data to the common reporter as well.
+    """
+
+    def __init__(
+        self,
+        folder,
+        max_error=0.05,
+        anchor_every=1024,
+        particles=None,
+        compression=None,
+        common_reporter=None,
+        keep_blocks=False,
+    ):
+        self.writer = trajstore.TrajectoryWriter(
+            folder,
+            max_error=max_error,
+            anchor_every=anchor_every,
+            particles=particles,
+            compression=compression,
+        )
+        self.common_reporter = common_reporter
+        self.keep_blocks = keep_blocks
+
+    def report(self, name, values):
+        if name == "data":
+            self.writer.write(values["pos"], block=values["block"], time=values.get("time"))
+            if not self.keep_blocks:
+                return
+
+        if self.common_reporter is not None:
+            self.common_reporter.report(name, values)
+
+    def dump_data(self):
+        self.writer.flush()
+        if self.common_reporter is not None:
+            self.common_reporter.dump_data()
+
+
+class AsyncReporter:
+    """
+    A reporter that passes reports to another reporter in a background
+    thread, so that serialization and writing of blocks overlap with
+    the simulation. Arrays of reports are copied before queueing.
+
+    The queue is bounded; when it is full, block data are either
+    waited for (policy="block") or dropped (policy="drop"), while other
+    reports are always waited for. Errors of the background writer are
+    raised in the simulation thread with the next report.
+
+    Parameters
+    ----------
+    reporter: reporter
+        The wrapped polychrom-style reporter.
+    max_queue: int
+        The max number of reports waiting to be written.
+    policy: str
+        "block" or "drop".
+    """
+
+    _FLUSH = object()
+    _STOP = object()
+
+    def __init__(self, reporter, max_queue=4, policy="block"):
+        if policy not in ["block", "drop"]:
+            raise ValueError(f"Unknown backpressure policy {policy}")
+        self.reporter = reporter
+        self.policy = policy
+        self.n_dropped = 0
+        self._error = None
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = threading.Thread(target=self._work, daemon=True)
+        self._thread.start()
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is self._STOP:
+                    return
+                if self._error is None:
+                    if item is self._FLUSH:
+                        self.reporter.dump_data()
+                    else:
+                        self.reporter.report(*item)
+            except Exception as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _check(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError("The background reporter failed") from error
+
+    def report(self, name, values):
+        self._check()
+        values = {
+            k: (np.array(v) if isinstance(v, np.ndarray) else v)
+            for k, v in values.items()
+        }
+
+        if (name == "data") and (self.policy == "drop"):
+            try:
+                self._queue.put_nowait((name, values))
+            except queue.Full:
+                self.n_dropped += 1
+                logging.warning(
+                    f"The output queue is full, dropped block {values.get('block')} "
+                    f"({self.n_dropped} in total)"
+                )
+        else:
+            self._queue.put((name, values))
+
+    def flush(self):
+        """
+        Wait until all queued reports are passed to the wrapped reporter.
+        Note that the wrapped reporter may still buffer them, use dump_data()
+        to write them out.
+        """
+        if self._thread.is_alive():
+            self._queue.join()
+        self._check()
+
+    def dump_data(self):
+        """
+        Write out all queued and buffered reports: the wrapped reporter
+        dumps its data in the background thread after the queued reports.
+        """
+        if self._thread.is_alive():
+            self._queue.put(self._FLUSH)
+        self.flush()
+
+    def close(self):
+        if self._thread.is_alive():
+            self.dump_data()
+            self._queue.put(self._STOP)
+            self._thread.join()
+
+
+class SelectiveReporter:
+    """
+    A reporter that passes block data to a reporter of the full state
+    every full_every blocks and to a reporter of a particle subset
+    (e.g. a ChainDeltaReporter with particles) every subset_every blocks.
+    While dense(block) is True (e.g. during compression), the denser
+    intervals dense_full_every and dense_subset_every are used.
+    Non-block reports are passed to the full-state reporter.
+
+    Parameters
+    ----------
+    full_reporter: reporter or None
+    subset_reporter: reporter
+    full_every, subset_every: int
+    dense: callable or None
+        Takes the block index, returns whether the output must be dense.
+    dense_full_every, dense_subset_every: int
+    """
+
+    def __init__(
+        self,
+        full_reporter,
+        subset_reporter,
+        full_every=100,
+        subset_every=1,
+        dense=None,
+        dense_full_every=10,
+        dense_subset_every=1,
+    ):
+        self.full_reporter = full_reporter
+        self.subset_reporter = subset_reporter
+        self.full_every = full_every
+        self.subset_every = subset_every
+        self.dense = dense
+        self.dense_full_every = dense_full_every
+        self.dense_subset_every = dense_subset_every
+
+    def report(self, name, values):
+        if name != "data":
+            if self.full_reporter is not None:
+                self.full_reporter.report(name, values)
+            return
+
+        block = values["block"]
+        if (self.dense is not None) and self.dense(block):
+            full_every, subset_every = self.dense_full_every, self.dense_subset_every
+        else:
+            full_every, subset_every = self.full_every, self.subset_every
+
+        if (self.full_reporter is not None) and (block % full_every == 0):
+            self.full_reporter.report(name, values)
+        if block % subset_every == 0:
+            self.subset_reporter.report(name, values)
+
+    def dump_data(self):
+        self.subset_reporter.dump_data()
+        if self.full_reporter is not None:
+            self.full_reporter.dump_data()
@@ -0,0 +1,114 @@
+import logging
+import os
+
+import numpy as np
+
+
+SIDECAR_FOLDER = "shared_arrays"
+MIN_SIDECAR_SIZE = 10000
+
+
+class SidecarArray(np.memmap):
+    """
+    An array stored in a .npy file and memory-mapped in copy-on-write mode.
+
+    When pickled (e.g. when the shared config is saved) or printed,
+    a SidecarArray is represented only by the path to its file,
+    so that config files do not grow with the size of the system.
+    Views and results of computations behave as regular arrays.
+    """
+
+    def __array_finalize__(self, obj):
+        super().__array_finalize__(obj)
+        self._sidecar_path = None
+
+    @property
+    def sidecar_path(self):
+        return self._sidecar_path
+
+    def __reduce__(self):
+        if self._sidecar_path is None:
+            return np.asarray(self).__reduce__()
+        return (load, (self._sidecar_path,))
+
+    def __deepcopy__(self, memo):
+        if self._sidecar_path is None:
+            return np.array(self)
+        return load(self._sidecar_path)
+
+    def __repr__(self):
+        if self._sidecar_path is None:
+            return repr(np.asarray(self))
+        return (
+            f"SidecarArray('{self._sidecar_path}', "
+            f"shape={self.shape}, dtype={self.dtype})"
+        )
+
+    __str__ = __repr__
+
+
+def load(path):
+    """
+    Memory-map an array stored in a sidecar .npy file.
+    The data is only read from disk when it is accessed.
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"The sidecar array file {path} does not exist")
+    arr = np.load(path, mmap_mode="c").view(SidecarArray)
+    arr._sidecar_path = path
+    return arr
+
+
+def save(arr, folder, name):
+    """
+    Store an array in a sidecar .npy file in `folder` and
+    return its memory-mapped SidecarArray.
+    """
+    sidecar_folder = os.path.join(os.path.abspath(folder), SIDECAR_FOLDER)
+    os.makedirs(sidecar_folder, exist_ok=True)
+    path = os.path.join(sidecar_folder, f"{name}.npy")
+    np.save(path, np.ascontiguousarray(arr))
+    return load(path)
+
+
+def load_shared_array(folder, name):
+    """
+    Load a single array of the shared config of a finished simulation
+    without reading the rest of the config.
+    """
+    return load(os.path.join(os.path.abspath(folder), SIDECAR_FOLDER, f"{name}.npy"))
+
+
+def store_large_arrays(shared, folder, min_size=MIN_SIDECAR_SIZE):
+    """
+    Replace large numeric arrays in a dict of shared config values
+    with references to sidecar files.
+
+    Parameters
+    ----------
+    shared: dict
+        The output of SimAction.configure().
+    folder: str or None
+        The folder of the simulation. If None, arrays are kept in memory.
+    min_size: int
+        The minimal number of elements of an array to be stored in a file.
+
+    Returns
+    -------
+    shared: dict
+        The same dict with large arrays replaced by SidecarArrays.
+    """
+    if folder is None:
+        return shared
+
+    for key, val in shared.items():
+        if (
+            isinstance(val, np.ndarray)
+            and not isinstance(val, SidecarArray)
+            and val.dtype != object
+            and val.size >= min_size
+        ):
+            shared[key] = save(val, folder, key)
+            logging.info(f"Shared array {key} is stored in {shared[key].sidecar_path}")
+
+    return shared
@@ -0,0 +1,98 @@
+import numpy as np
+
+from polychrom.forces import openmm
+
+
+def get_positions(sim):
+    """
+    Returns an Nx3 array of current (unwrapped) particle coordinates
+    in the units of the bond length.
+    """
+    state = sim.context.getState(getPositions=True)
+    return np.asarray(state.getPositions(asNumpy=True) / sim.conlen)
+
+
+def set_positions(sim, coords):
+    """
+    Set particle coordinates (in the units of the bond length)
+    in the context of a running simulation.
+    """
+    coords = np.asarray(coords, dtype=float)
+    sim.context.setPositions(coords * sim.conlen)
+    sim.data = coords * sim.conlen
+
+
+def get_box(sim):
+    """Returns the sides of the current rectangular PBC box."""
+    box_vectors = sim.context.getState().getPeriodicBoxVectors(asNumpy=True)
+    return np.diag(np.asarray(box_vectors / sim.conlen))
+
+
+def _box_vectors(box, conlen):
+    box = np.asarray(box, dtype=float)
+    return [
+        openmm.Vec3(*(np.eye(3)[i] * box[i])) * conlen
+        for i in range(3)
+    ]
+
+
+def set_box(sim, box):
+    """Set the sides of the rectangular PBC box of a running simulation."""
+    sim.context.setPeriodicBoxVectors(*_box_vectors(box, sim.conlen))
+
+
+def set_default_box(sim, box):
+    """
+    Set the sides of the rectangular PBC box before the context
+    of the simulation is created.
+    """
+    sim.system.setDefaultPeriodicBoxVectors(*_box_vectors(box, sim.conlen))
+
+
+def segment_ids(N, boundaries):
+    """
+    Returns the segment index of each of N particles, given the
+    indices of the first particles of segments.
+    """
+    ids = np.zeros(N, dtype=np.int64)
+    boundaries = np.asarray(boundaries, dtype=np.int64)
+    boundaries = boundaries[(boundaries > 0) & (boundaries < N)]
+    np.add.at(ids, boundaries, 1)
+    return np.cumsum(ids)
+
+
+def segment_centers(coords, seg_ids):
+    """Returns the centers of mass of particle segments."""
+    counts = np.bincount(seg_ids)
+    return np.vstack(
+        [np.bincount(seg_ids, weights=coords[:, i]) / counts for i in range(3)]
+    ).T
+
+
+def scale_segments(coords, seg_ids, scale):
+    """
+    Affinely rescale the centers of mass of particle segments about
+    the origin, translating each segment as a rigid body so that
+    bonds within segments are preserved.
+    """
+    centers = segment_centers(coords, seg_ids)
+    return coords + (centers * (np.asarray(scale) - 1))[seg_ids]
+
+
+def scale_tether_positions(sim, force_name, scale):
+    """
+    Affinely rescale the anchor points (x0, y0, z0) of tethered particles.
+    """
+    force = sim.force_dict[force_name]
+    param_names = [
+        force.getPerParticleParameterName(i)
+        for i in range(force.getNumPerParticleParameters())
+    ]
+    param_idxs = [param_names.index(p) for p in ["x0", "y0", "z0"]]
+    for term in range(force.getNumParticles()):
+        particle, params = force.getParticleParameters(term)
+        params = list(params)
+        for s, p in zip(scale, param_idxs):
+            params[p] *= s
+        force.setParticleParameters(term, particle, params)
+    force.updateParametersInContext(sim.context)
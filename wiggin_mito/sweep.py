@@ -0,0 +1,380 @@
+import concurrent.futures
+import glob
+import hashlib
+import itertools
+import json
+import logging
+import os
+import queue
+import re
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+
+
+DONE_FILE = "sweep_done.json"
+THREAD_ENV_VARS = [
+    "OMP_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+    "OPENMM_CPU_THREADS",
+]
+
+
+def expand_grids(base_params, grids):
+    """
+    Expand a list of parameter grids into a list of parameter combinations.
+
+    Parameters
+    ----------
+    base_params: dict
+        Default command line parameters, e.g. {"--loop_n": 500}.
+    grids: list of dicts
+        Each grid maps parameter names to lists of values. Combinations
+        of values within each grid are concatenated across grids.
+
+    Returns
+    -------
+    points: list of dicts
+        Full sets of parameters of each unique combination,
+        in the order of grids.
+    """
+    points = []
+    seen = set()
+    for grid in grids:
+        for combo in itertools.product(
+            *[[(k, val) for val in vals] for k, vals in grid.items()]
+        ):
+            params = dict(base_params)
+            params.update(combo)
+            key = json.dumps(params, sort_keys=True, default=str)
+            if key not in seen:
+                seen.add(key)
+                points.append(params)
+    return points
+
+
+def params_to_cli(params):
+    """
+    Convert a dict of parameters into a list of command line arguments.
+    Parameters set to None are skipped, parameters set to "" become flags.
+    """
+    args = []
+    for k, v in params.items():
+        if v is not None:
+            args.append(k)
+            if bool(str(v)):
+                args.append(str(v))
+    return args
+
+
+def point_id(params):
+    return hashlib.sha1(
+        json.dumps(params, sort_keys=True, default=str).encode()
+    ).hexdigest()[:12]
+
+
+def parse_run_name(name):
+    """
+    Parse a run folder name of the form Key1_value1-Key2_value2-...
+    into a dict; numeric values are converted to floats.
+    Returns None if the name does not follow this pattern.
+    """
+    params = {}
+    for item in re.split(r"-(?=[A-Za-z][A-Za-z0-9]*_)", name):
+        key, sep, val = item.partition("_")
+        if not (sep and key):
+            return None
+        try:
+            params[key] = float(val)
+        except ValueError:
+            params[key] = val
+    return params
+
+
+def _param_distance(a, b):
+    if isinstance(a, float) and isinstance(b, float):
+        if a > 0 and b > 0:
+            return abs(np.log(a / b))
+        return abs(a - b)
+    return 0.0 if a == b else np.inf
+
+
+def mark_done(folder, record=None):
+    """
+    Mark a run as finished, see is_finished_run().
+    """
+    os.makedirs(folder, exist_ok=True)
+    with open(os.path.join(folder, DONE_FILE), "w") as f:
+        json.dump({} if record is None else record, f, default=str)
+
+
+def is_finished_run(folder):
+    """
+    A run is finished if it is marked as done, by the sweep or by
+    the run itself (see mark_done()); stored blocks alone do not
+    tell a finished run from a crashed or a running one.
+    """
+    return os.path.exists(os.path.join(folder, DONE_FILE))
+
+
+def find_nearest_run(root_folder, params, ignore_keys=("R",), exclude=None):
+    """
+    Find the finished run with the nearest parameters among the run
+    folders in root_folder, named as Key1_value1-Key2_value2-...
+
+    The distance between runs is the sum over parameters of |log(a/b)|
+    for positive numbers, |a-b| for other numbers; runs with different
+    non-numeric parameters or different sets of parameters (apart from
+    ignore_keys) are skipped.
+
+    Parameters
+    ----------
+    root_folder: str
+        The folder with run folders.
+    params: dict
+        The parameters of the run, e.g. parse_run_name() of its folder.
+    ignore_keys: list of str
+        Parameters that do not affect the distance, e.g. the replicate index.
+    exclude: str or None
+        The folder of the run itself.
+
+    Returns
+    -------
+    folder: str or None
+        The folder of the nearest finished run.
+    distance: float
+        The distance to the nearest run, inf if none is found.
+    """
+    params = {
+        k: (float(v) if isinstance(v, (int, float)) else v) for k, v in params.items()
+    }
+    exclude = None if exclude is None else os.path.abspath(exclude)
+
+    best, best_dist = None, np.inf
+    for folder in sorted(glob.glob(os.path.join(root_folder, "*"))):
+        if (not os.path.isdir(folder)) or (os.path.abspath(folder) == exclude):
+            continue
+        other = parse_run_name(os.path.basename(folder))
+        if (other is None) or (
+            set(other) - set(ignore_keys) != set(params) - set(ignore_keys)
+        ):
+            continue
+        if not is_finished_run(folder):
+            continue
+        dist = sum(
+            _param_distance(params[k], other[k])
+            for k in params
+            if k not in ignore_keys
+        )
+        if dist < best_dist:
+            best, best_dist = folder, dist
+
+    return best, best_dist
+
+
+def _done_path(params, folder_func, state_folder):
+    if folder_func is not None:
+        return os.path.join(folder_func(params), DONE_FILE)
+    return os.path.join(state_folder, "done", f"{point_id(params)}.json")
+
+
+def is_done(params, folder_func=None, state_folder="./sweep"):
+    return os.path.exists(_done_path(params, folder_func, state_folder))
+
+
+def _pinned_env(n_threads):
+    env = dict(os.environ)
+    for var in THREAD_ENV_VARS:
+        env[var] = str(n_threads)
+    return env
+
+
+def run_point(
+    script,
+    params,
+    cores=None,
+    folder_func=None,
+    state_folder="./sweep",
+    python=sys.executable,
+    n_threads=None,
+):
+    """
+    Run a single sweep point in a subprocess and mark it as done
+    if it finishes successfully.
+
+    Parameters
+    ----------
+    script: str
+        The path to the simulation script.
+    params: dict
+        Command line parameters of the script.
+    cores: list of int or None
+        CPU cores to pin the subprocess and its threads to.
+    folder_func: callable or None
+        A function mapping params to the output folder of the run.
+        If provided, the done-marker is stored in the output folder,
+        otherwise in state_folder.
+    state_folder: str
+        The folder for logs of the sweep.
+    python: str
+        The python interpreter.
+    n_threads: int or None
+        The number of CPU threads of the run, len(cores) by default.
+
+    Returns
+    -------
+    record: dict
+        The summary of the run: return code, wall time and throughput.
+    """
+    pid = point_id(params)
+    cmd = [python, script] + params_to_cli(params)
+
+    log_folder = os.path.join(state_folder, "logs")
+    os.makedirs(log_folder, exist_ok=True)
+
+    if (n_threads is None) and (cores is not None):
+        n_threads = len(cores)
+    env = os.environ if n_threads is None else _pinned_env(n_threads)
+    preexec_fn = None
+    if cores is not None:
+        if hasattr(os, "sched_setaffinity"):
+            def preexec_fn():
+                os.sched_setaffinity(0, cores)
+
+    logging.info(f"Executing command: {repr(cmd)}")
+    start = time.time()
+    with open(os.path.join(log_folder, f"{pid}.out"), "w") as out, open(
+        os.path.join(log_folder, f"{pid}.err"), "w"
+    ) as err:
+        returncode = subprocess.call(
+            cmd, stdout=out, stderr=err, env=env, preexec_fn=preexec_fn
+        )
+    wall_time = time.time() - start
+
+    record = dict(
+        point_id=pid,
+        params=params,
+        cmd=cmd,
+        host=socket.gethostname(),
+        cores=None if cores is None else list(cores),
+        returncode=returncode,
+        start=start,
+        wall_time=wall_time,
+    )
+    if "--num_blocks" in params:
+        record["blocks_per_hour"] = float(params["--num_blocks"]) / wall_time * 3600
+
+    if returncode == 0:
+        if folder_func is not None:
+            mark_done(folder_func(params), record)
+        else:
+            done_path = _done_path(params, folder_func, state_folder)
+            os.makedirs(os.path.dirname(done_path), exist_ok=True)
+            with open(done_path, "w") as f:
+                json.dump(record, f, default=str)
+    else:
+        logging.warning(f"Point {pid} failed with the return code {returncode}")
+
+    return record
+
+
+def run_sweep(
+    script,
+    base_params,
+    grids,
+    folder_func=None,
+    n_workers=None,
+    threads_per_worker=1,
+    state_folder="./sweep",
+    python=sys.executable,
+):
+    """
+    Run all points of a parameter sweep in a local pool of processes.
+    Points that have already finished (e.g. before a crash or in
+    a previous sweep) are skipped. Each worker is pinned to its own
+    set of CPU cores. The summary of each run is appended to
+    state_folder/sweep_log.jsonl.
+
+    Parameters
+    ----------
+    script: str
+        The path to the simulation script.
+    base_params: dict
+        Default command line parameters.
+    grids: list of dicts
+        Parameter grids, see expand_grids().
+    folder_func: callable or None
+        A function mapping params to the output folder of the run,
+        used to detect finished runs.
+    n_workers: int or None
+        The number of simultaneous runs. By default, all available
+        cores are used.
+    threads_per_worker: int
+        The number of CPU threads of each run.
+    state_folder: str
+        The folder for logs of the sweep.
+    python: str
+        The python interpreter.
+
+    Returns
+    -------
+    records: list of dicts
+        Summaries of the runs executed in this call.
+    """
+    points = expand_grids(base_params, grids)
+    todo = [p for p in points if not is_done(p, folder_func, state_folder)]
+    logging.info(
+        f"Sweeping over {len(points)} parameter combinations, "
+        f"{len(points) - len(todo)} are already done"
+    )
+
+    if hasattr(os, "sched_getaffinity"):
+        all_cores = sorted(os.sched_getaffinity(0))
+    else:
+        all_cores = list(range(os.cpu_count()))
+    if n_workers is None:
+        n_workers = max(1, len(all_cores) // threads_per_worker)
+
+    core_slots = queue.Queue()
+    for i in range(n_workers):
+        cores = all_cores[i * threads_per_worker : (i + 1) * threads_per_worker]
+        core_slots.put(cores if len(cores) == threads_per_worker else None)
+
+    os.makedirs(state_folder, exist_ok=True)
+    log_path = os.path.join(state_folder, "sweep_log.jsonl")
+    log_lock = threading.Lock()
+
+    def worker(params):
+        cores = core_slots.get()
+        try:
+            record = run_point(
+                script,
+                params,
+                cores,
+                folder_func,
+                state_folder,
+                python,
+                n_threads=threads_per_worker,
+            )
+        finally:
+            core_slots.put(cores)
+        with log_lock, open(log_path, "a") as f:
+            f.write(json.dumps(record, default=str) + "\n")
+        return record
+
+    records = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=n_workers) as pool:
+        for record in pool.map(worker, todo):
+            records.append(record)
+            logging.info(
+                f"Point {record['point_id']} finished in "
+                f"{record['wall_time']:.0f} s with the return code {record['returncode']}"
+            )
+
+    return records
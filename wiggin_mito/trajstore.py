@@ -0,0 +1,504 @@
+from collections import OrderedDict
+import json
+import logging
+import os
+import zlib
+
+import numpy as np
+
+import polychrom.hdf5_format
+
+
+DATA_FILE = "data.bin"
+INDEX_FILE = "index.jsonl"
+PARTICLES_FILE = "particles.npy"
+
+DELTA_DTYPES = [np.int8, np.int16, np.int32]
+COMPRESSIONS = [None, "zlib", "bitpack"]
+
+
+def grid_step(max_error):
+    """
+    The step of the quantization grid that keeps the distance between
+    the original and decoded positions below max_error.
+    """
+    return 2.0 * max_error / np.sqrt(3)
+
+
+def pack_deltas(deltas, bits):
+    """
+    Pack integer differences into `bits` bits per value, zigzag-encoded
+    (0, -1, 1, -2, ... -> 0, 1, 2, 3, ...), little-endian bit order.
+    """
+    d = np.asarray(deltas, dtype=np.int64).ravel()
+    z = ((d << 1) ^ (d >> 63)).astype(np.uint64)
+    bit_matrix = (z[:, None] >> np.arange(bits, dtype=np.uint64)) & np.uint64(1)
+    return np.packbits(bit_matrix.astype(np.uint8).ravel(), bitorder="little")
+
+
+def unpack_deltas(buf, bits, lo, hi):
+    """
+    Unpack rows lo..hi (exclusive) of (N, 3) differences packed by
+    pack_deltas(); buf may be a memory-mapped array of the whole record.
+    """
+    start, stop = lo * 3 * bits, hi * 3 * bits
+    bit_matrix = np.unpackbits(
+        np.asarray(buf[start // 8:-(-stop // 8)]), bitorder="little"
+    )[start % 8:start % 8 + stop - start].reshape(-1, bits)
+    z = bit_matrix.astype(np.int64) @ (np.int64(1) << np.arange(bits, dtype=np.int64))
+    return ((z >> 1) ^ -(z & 1)).reshape(-1, 3)
+
+
+def encode_chain(
+    coords, q, anchor_every=1024, dtype=None, max_exception_frac=1e-3, packed=False
+):
+    """
+    Encode particle coordinates along a chain as quantized bond vectors.
+
+    Coordinates are rounded to a grid with the step q (i.e. with the error
+    of at most q/2 per coordinate) and stored as integer differences between
+    consecutive particles. Every anchor_every-th particle is an anchor with
+    its absolute position stored in full, so that the chain can be decoded
+    in chunks. Differences that do not fit into the integer type (e.g. at
+    chain breaks) are stored separately as exceptions.
+
+    Parameters
+    ----------
+    coords: np.ndarray
+        An (N, 3) array of coordinates, ordered along the chain.
+    q: float
+        The step of the quantization grid.
+    anchor_every: int
+        The distance between anchors.
+    dtype: np.dtype or None
+        The integer type of differences. If None, the smallest type
+        with at most max_exception_frac exceptions is chosen.
+    packed: bool
+        If True, differences are bit-packed (see pack_deltas()) with
+        the smallest number of bits per value with at most
+        max_exception_frac exceptions, instead of stored as dtype.
+
+    Returns
+    -------
+    record: dict
+        anchors: (n_anchors, 3) int64, deltas: (N, 3) int (or, if packed,
+        uint8 bytes), exc_idx: (n_exc,) int64, exc_vals: (n_exc, 3) int64,
+        and, if packed, bits: int.
+    """
+    Q = np.round(np.asarray(coords, dtype=np.float64) / q).astype(np.int64)
+    anchor_idx = np.arange(0, len(Q), anchor_every)
+
+    deltas = np.diff(Q, axis=0, prepend=Q[:1])
+    deltas[anchor_idx] = 0
+    max_delta = np.abs(deltas).max(axis=1)
+
+    if packed:
+        for bits in range(1, 33):
+            if (max_delta > 2 ** (bits - 1) - 1).mean() <= max_exception_frac:
+                break
+        exc_idx = np.flatnonzero(max_delta > 2 ** (bits - 1) - 1)
+        exc_vals = deltas[exc_idx]
+        deltas[exc_idx] = 0
+        return dict(
+            anchors=Q[anchor_idx],
+            deltas=pack_deltas(deltas, bits),
+            exc_idx=exc_idx,
+            exc_vals=exc_vals,
+            bits=bits,
+        )
+
+    if dtype is None:
+        for dtype in DELTA_DTYPES:
+            if (max_delta > np.iinfo(dtype).max).mean() <= max_exception_frac:
+                break
+    exc_idx = np.flatnonzero(max_delta > np.iinfo(dtype).max)
+    exc_vals = deltas[exc_idx]
+    deltas[exc_idx] = 0
+
+    return dict(
+        anchors=Q[anchor_idx],
+        deltas=deltas.astype(dtype),
+        exc_idx=exc_idx,
+        exc_vals=exc_vals,
+    )
+
+
+def decode_chain(anchors, deltas, exc_idx, exc_vals, q, anchor_every=1024):
+    """
+    Decode coordinates encoded by encode_chain(), with a cumulative sum
+    along the chain restarted at every anchor.
+    The arrays may cover a range of whole chunks between anchors, with
+    exc_idx counted from the start of the range.
+    """
+    D = deltas.astype(np.int64)
+    D[exc_idx] = exc_vals
+    cs = np.cumsum(D, axis=0)
+    anchor_idx = np.arange(0, len(D), anchor_every)
+    chunk = np.arange(len(D)) // anchor_every
+    return (cs + (anchors - cs[anchor_idx])[chunk]) * q
+
+
+class TrajectoryWriter:
+    """
+    Append-only storage of a trajectory in the chain-delta format, see
+    encode_chain(). Records of blocks are appended to folder/data.bin and
+    described by lines of folder/index.jsonl, which are written after the
+    record, so that an interrupted write never corrupts stored blocks.
+    A writer reopened in an existing folder continues after the last
+    indexed record; writing a block that is already stored (e.g. after
+    resuming from a checkpoint) discards it and all later blocks.
+
+    Parameters
+    ----------
+    folder: str
+        The folder of the trajectory.
+    max_error: float
+        The max distance between original and decoded positions.
+    anchor_every: int
+        The distance between anchor particles.
+    particles: np.ndarray or None
+        The indices of stored particles. If None, all particles are stored.
+    compression: str or None
+        If "bitpack", differences are bit-packed, see encode_chain() (records
+        can still be memory-mapped and decoded by chunks). If "zlib", records
+        are compressed (and cannot be memory-mapped).
+    """
+
+    def __init__(
+        self, folder, max_error=0.05, anchor_every=1024, particles=None, compression=None
+    ):
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"Unknown compression {compression}")
+
+        self.folder = folder
+        self.q = grid_step(max_error)
+        self.anchor_every = anchor_every
+        self.particles = None if particles is None else np.asarray(particles)
+        self.compression = compression
+
+        os.makedirs(folder, exist_ok=True)
+        if self.particles is not None:
+            np.save(os.path.join(folder, PARTICLES_FILE), self.particles)
+
+        self._entries = read_index(folder)
+        self._data = open(os.path.join(folder, DATA_FILE), "ab")
+        self._index = open(os.path.join(folder, INDEX_FILE), "a")
+        self._truncate(len(self._entries))
+
+    def _truncate(self, n_entries):
+        self._entries = self._entries[:n_entries]
+        last = self._entries[-1] if self._entries else None
+        self._offset = (last["offset"] + last["nbytes"]) if last else 0
+        self._data.truncate(self._offset)
+        self._index.truncate(0)
+        self._index.write("".join(json.dumps(e) + "\n" for e in self._entries))
+        self._index.flush()
+
+    def write(self, coords, block, time=None):
+        stored = [e["block"] for e in self._entries]
+        if stored and block <= stored[-1]:
+            logging.info(f"Overwriting stored blocks from {block} in {self.folder}")
+            self._truncate(int(np.searchsorted(stored, block)))
+
+        coords = np.asarray(coords)
+        if self.particles is not None:
+            coords = coords[self.particles]
+
+        record = encode_chain(
+            coords, self.q, self.anchor_every, packed=self.compression == "bitpack")
+        parts = [record[k] for k in ["anchors", "deltas", "exc_idx", "exc_vals"]]
+        buf = b"".join(np.ascontiguousarray(p).tobytes() for p in parts)
+        if self.compression == "zlib":
+            buf = zlib.compress(buf, 1)
+
+        self._data.write(buf)
+        self._data.flush()
+
+        entry = dict(
+            block=int(block),
+            time=None if time is None else float(time),
+            offset=self._offset,
+            nbytes=len(buf),
+            N=len(coords),
+            q=self.q,
+            anchor_every=self.anchor_every,
+            dtype=np.dtype(record["deltas"].dtype).name,
+            n_exc=len(record["exc_idx"]),
+            compression=self.compression,
+        )
+        if "bits" in record:
+            entry["bits"] = record["bits"]
+        self._index.write(json.dumps(entry) + "\n")
+        self._index.flush()
+        self._entries.append(entry)
+        self._offset += len(buf)
+
+    def flush(self):
+        for f in [self._data, self._index]:
+            f.flush()
+            os.fsync(f.fileno())
+
+    def close(self):
+        self.flush()
+        self._data.close()
+        self._index.close()
+
+
+def read_index(folder):
+    path = os.path.join(folder, INDEX_FILE)
+    if not os.path.exists(path):
+        return []
+    index = []
+    with open(path) as f:
+        for line in f:
+            try:
+                index.append(json.loads(line))
+            except json.JSONDecodeError:
+                logging.warning(f"Skipping a truncated index entry in {path}")
+                break
+    return index
+
+
+def record_layout(entry):
+    """
+    Byte offsets (relative to the record start) and shapes of the arrays
+    of an uncompressed record.
+    """
+    N, n_anchors = entry["N"], -(-entry["N"] // entry["anchor_every"])
+    n_exc = entry["n_exc"]
+    layout = {}
+    pos = 0
+    # bit-packed differences are stored as bytes, see pack_deltas()
+    deltas_shape = (N, 3) if "bits" not in entry else (-(-N * 3 * entry["bits"] // 8),)
+    for name, dtype, shape in [
+        ("anchors", np.int64, (n_anchors, 3)),
+        ("deltas", np.dtype(entry["dtype"]), deltas_shape),
+        ("exc_idx", np.int64, (n_exc,)),
+        ("exc_vals", np.int64, (n_exc, 3)),
+    ]:
+        layout[name] = (pos, np.dtype(dtype), shape)
+        pos += int(np.prod(shape)) * np.dtype(dtype).itemsize
+    return layout
+
+
+def parse_record(buf, entry):
+    if entry["compression"] == "zlib":
+        buf = zlib.decompress(buf)
+    return {
+        name: np.frombuffer(buf, dtype=dtype, count=int(np.prod(shape)), offset=pos).reshape(shape)
+        for name, (pos, dtype, shape) in record_layout(entry).items()
+    }
+
+
+def load_block(folder, i):
+    """Decode the i-th stored block of a trajectory."""
+    entry = read_index(folder)[i]
+    with open(os.path.join(folder, DATA_FILE), "rb") as f:
+        f.seek(entry["offset"])
+        record = parse_record(f.read(entry["nbytes"]), entry)
+    if "bits" in entry:
+        record["deltas"] = unpack_deltas(record["deltas"], entry["bits"], 0, entry["N"])
+    return decode_chain(q=entry["q"], anchor_every=entry["anchor_every"], **record)
+
+
+class _LRUCache(OrderedDict):
+    def __init__(self, max_size):
+        super().__init__()
+        self.max_size = max_size
+
+    def get(self, key):
+        if key in self:
+            self.move_to_end(key)
+            return self[key]
+        return None
+
+    def put(self, key, value):
+        self[key] = value
+        self.move_to_end(key)
+        while len(self) > self.max_size:
+            self.popitem(last=False)
+
+
+def _as_indices(key, n):
+    if isinstance(key, slice):
+        return np.arange(n)[key]
+    key = np.asarray(key)
+    if key.dtype == bool:
+        return np.flatnonzero(key)
+    return np.where(key < 0, key + n, key).astype(np.int64)
+
+
+class TrajectoryView:
+    """
+    A lazy (n_blocks, n_particles, 3) array view of a stored trajectory.
+
+    Chain-delta trajectories (see TrajectoryWriter) are memory-mapped and
+    decoded in chunks between anchors, so that reading a block range or
+    a particle subset touches only the bytes it needs, and concurrent
+    readers share the page cache. Decoded chunks are kept in an LRU cache.
+    Folders of polychrom's HDF5Reporter are read block by block instead.
+
+    Indexing follows numpy: view[blocks], view[blocks, rows], where rows
+    are the positions of particles in the stored subset. To select
+    particles by their indices in the simulation, use take().
+
+    Parameters
+    ----------
+    folder: str
+        A chain-delta trajectory folder, a run folder with a chain-delta
+        trajectory in the subfolder `subfolder`, or a folder of HDF5 blocks.
+    subfolder: str
+        The subfolder of the chain-delta trajectory in a run folder.
+    cache_size: int
+        The max number of decoded chunks (or HDF5 blocks) to keep.
+    """
+
+    def __init__(self, folder, subfolder="trajectory", cache_size=1024):
+        if not os.path.exists(os.path.join(folder, INDEX_FILE)):
+            if os.path.exists(os.path.join(folder, subfolder, INDEX_FILE)):
+                folder = os.path.join(folder, subfolder)
+        self.folder = folder
+        self._cache = _LRUCache(cache_size)
+
+        self._index = read_index(folder)
+        if self._index:
+            self.format = "chain_delta"
+            self.blocks = np.array([e["block"] for e in self._index])
+            self.times = np.array([np.nan if e["time"] is None else e["time"] for e in self._index])
+            n_particles = self._index[0]["N"]
+            self._data = np.memmap(os.path.join(folder, DATA_FILE), dtype=np.uint8, mode="r")
+            particles_path = os.path.join(folder, PARTICLES_FILE)
+            self.particles = (
+                np.load(particles_path) if os.path.exists(particles_path)
+                else np.arange(n_particles)
+            )
+        else:
+            self.format = "hdf5"
+            self._uris = polychrom.hdf5_format.list_URIs(folder)
+            if len(self._uris) == 0:
+                raise ValueError(f"No trajectory found in {folder}")
+            self.blocks = np.array([int(uri.split("::")[-1]) for uri in self._uris])
+            self.times = np.full(len(self._uris), np.nan)
+            self.particles = np.arange(len(self._load_hdf5_block(0)))
+
+        self.shape = (len(self.blocks), len(self.particles), 3)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def _load_hdf5_block(self, i):
+        pos = self._cache.get(i)
+        if pos is None:
+            pos = np.asarray(polychrom.hdf5_format.load_URI(self._uris[i])["pos"])
+            self._cache.put(i, pos)
+        return pos
+
+    def _record(self, i):
+        entry = self._index[i]
+        start = entry["offset"]
+        buf = self._data[start:start + entry["nbytes"]]
+        if entry["compression"] == "zlib":
+            return parse_record(bytes(buf), entry)
+        return {
+            name: buf[pos:pos + int(np.prod(shape)) * dtype.itemsize].view(dtype).reshape(shape)
+            for name, (pos, dtype, shape) in record_layout(entry).items()
+        }
+
+    def _decode_chunks(self, i, first, last):
+        """Decode chunks first..last (inclusive) of block i and cache them."""
+        entry = self._index[i]
+        M, N = entry["anchor_every"], entry["N"]
+        record = self._record(i)
+        lo, hi = first * M, min((last + 1) * M, N)
+        exc = (record["exc_idx"] >= lo) & (record["exc_idx"] < hi)
+        deltas = (
+            record["deltas"][lo:hi] if "bits" not in entry
+            else unpack_deltas(record["deltas"], entry["bits"], lo, hi)
+        )
+        coords = decode_chain(
+            record["anchors"][first:last + 1],
+            deltas,
+            record["exc_idx"][exc] - lo,
+            record["exc_vals"][exc],
+            q=entry["q"],
+            anchor_every=M,
+        )
+        chunks = {}
+        for c in range(first, last + 1):
+            chunks[c] = coords[(c - first) * M:(c + 1 - first) * M]
+            self._cache.put((i, c), chunks[c])
+        return chunks
+
+    def _read_block(self, i, rows):
+        if self.format == "hdf5":
+            return self._load_hdf5_block(i)[rows]
+
+        M = self._index[i]["anchor_every"]
+        chunk_ids = rows // M
+        ids = np.unique(chunk_ids)
+        chunks = {}
+        for c in ids:
+            cached = self._cache.get((i, c))
+            if cached is not None:
+                chunks[c] = cached
+        missing = np.array([c for c in ids if c not in chunks], dtype=np.int64)
+        if len(missing):
+            # decode contiguous runs of missing chunks at once
+            run_starts = np.flatnonzero(np.diff(missing, prepend=-2) != 1)
+            run_ends = np.r_[run_starts[1:], len(missing)] - 1
+            for a, b in zip(missing[run_starts], missing[run_ends]):
+                chunks.update(self._decode_chunks(i, a, b))
+
+        if (len(ids) == 0) or (ids[-1] - ids[0] + 1 == len(ids)):
+            # contiguous chunks (e.g. full blocks) are indexed at once
+            coords = np.concatenate([chunks[c] for c in ids] + [np.empty((0, 3))])
+            return coords[rows - (ids[0] * M if len(ids) else 0)]
+
+        # otherwise, rows are sorted by chunk once and taken chunk by chunk
+        order = np.argsort(chunk_ids, kind="stable")
+        starts = np.searchsorted(chunk_ids[order], ids)
+        ends = np.r_[starts[1:], len(rows)]
+        out = np.empty((len(rows), 3))
+        for c, a, b in zip(ids, starts, ends):
+            sel = order[a:b]
+            out[sel] = chunks[c][rows[sel] - c * M]
+        return out
+
+    def __getitem__(self, key):
+        block_key, row_key = (key, slice(None)) if not isinstance(key, tuple) else key
+        block_idxs = _as_indices(block_key, self.shape[0])
+        rows = _as_indices(row_key, self.shape[1])
+        out = np.stack([self._read_block(i, rows.ravel()) for i in np.atleast_1d(block_idxs)])
+        out = out.reshape((len(np.atleast_1d(block_idxs)),) + rows.shape + (3,))
+        return out[0] if np.ndim(block_idxs) == 0 else out
+
+    def rows_of(self, particles):
+        """The rows of the given (simulation) particle indices."""
+        particles = np.asarray(particles, dtype=np.int64)
+        rows = np.searchsorted(self.particles, particles)
+        rows = np.minimum(rows, len(self.particles) - 1)
+        if not np.array_equal(self.particles[rows], particles):
+            raise ValueError("Some particles are not stored in the trajectory")
+        return rows
+
+    def take(self, particles, blocks=slice(None)):
+        """
+        Coordinates of particles (given by their indices in the simulation,
+        e.g. the backbone) in the selected blocks.
+        """
+        return self[blocks, self.rows_of(particles)]
+
+    def loop(self, loops, loop_id, blocks=slice(None)):
+        """Coordinates of the particles of a loop in the selected blocks."""
+        start, end = np.sort(np.asarray(loops)[loop_id])
+        return self.take(np.arange(start, end + 1), blocks)
+
+    def iter_blocks(self, particles=None, blocks=slice(None)):
+        """Yield (block, coords) of the selected blocks one by one."""
+        rows = slice(None) if particles is None else self.rows_of(particles)
+        for i in _as_indices(blocks, self.shape[0]):
+            yield self.blocks[i], self[i, rows]
+
+
+def open_trajectory(folder, **kwargs):
+    return TrajectoryView(folder, **kwargs)